@@ -1,42 +1,119 @@
 import os
 import json
-from datasets import load_dataset, DatasetDict
+from datasets import load_dataset, load_from_disk, DatasetDict
 from transformers import (
     GPT2LMHeadModel,
-    GPT2Tokenizer,
+    GPT2TokenizerFast,
     DataCollatorForLanguageModeling,
-    Trainer,
     TrainingArguments,
+    default_data_collator,
+    LogitsProcessorList,
     pipeline,
 )
 
+from constrained_decoding import OUTPUT_GRAMMAR, TrajectoryGrammar
+from dataset_cache import DatasetCache
+from streaming_dataset import StreamingRouteDataset
+from token_store import PackedBlockDataset, TokenStore, build_token_store
+from trajectory_tokenizer import load_or_build_trajectory_tokenizer
+from training_metrics import InstrumentedTrainer
+
+# "packed": whole corpus from the pre-tokenized token store (token_store.py), 512-token blocks without padding
+# "stream": vessel_gpt_*.txt shards read and tokenized on the fly (streaming_dataset.py), split by MMSI hash
+# "text":   10K/1K lines tokenized with padding="max_length"
+DATA_MODE = "packed"
+# token stores / tokenized datasets keyed by corpus content + tokenizer + parameters (dataset_cache.py)
+DATASET_CACHE_DIR = "/mnt/new_home/idan7/data_mining/ais_tracks_export/dataset_cache/"
+DATASET_CACHE_MAX_BYTES = 200 * 1024 ** 3
+SHARDS_DIR = "/mnt/new_home/idan7/data_mining/ais_tracks_export/text_for_GPT_extended/"
+STREAM_WORKERS = 4
+EVAL_BLOCKS = 500  # validation blocks per DataLoader worker in "stream" mode
+BLOCK_SIZE = 512
+
+# "gpt2":       GPT-2 BPE (~45 tokens per route line); the pretrained gpt2 embeddings are used as they are
+# "trajectory": field / digit-group tokenizer from trajectory_tokenizer.py (27 tokens per route line).
+#               Its vocabulary is unrelated to GPT-2's, so the embeddings are initialized anew and learned
+#               from scratch: switch only for a new training run. A model trained with one tokenizer cannot
+#               be used (or fine-tuned further) with the other, keep the tokenizer saved with each checkpoint.
+TOKENIZER_MODE = "gpt2"
+TRAJECTORY_TOKENIZER_DIR = "/mnt/new_home/idan7/data_mining/ais_tracks_export/trajectory_tokenizer/"
+
 # === שלב 1: טוקניזר ומודל ===
 model_name = "gpt2"
-tokenizer = GPT2Tokenizer.from_pretrained(model_name)
+file_path = "/mnt/new_home/idan7/data_mining/ais_tracks_export/cleaned_data/vessel_tracks.txt"
+if TOKENIZER_MODE == "trajectory":
+    tokenizer = load_or_build_trajectory_tokenizer(TRAJECTORY_TOKENIZER_DIR, file_path)
+else:
+    tokenizer = GPT2TokenizerFast.from_pretrained(model_name)  # batched Rust tokenization for the token store
+    tokenizer.add_special_tokens({'additional_special_tokens': ['<|endofroute|>']})
+    tokenizer.pad_token = tokenizer.eos_token
 model = GPT2LMHeadModel.from_pretrained(model_name)
 
-tokenizer.add_special_tokens({'additional_special_tokens': ['<|endofroute|>']})
-tokenizer.pad_token = tokenizer.eos_token
 model.resize_token_embeddings(len(tokenizer))
+if TOKENIZER_MODE == "trajectory":
+    # new vocabulary: the transformer weights are kept, but the first rows of the BPE embedding
+    # (and the tied lm_head) mean nothing for the new tokens, so they are re-initialized
+    model.get_input_embeddings().weight.data.normal_(mean=0.0, std=model.config.initializer_range)
+model.config.bos_token_id = tokenizer.bos_token_id
+model.config.eos_token_id = tokenizer.eos_token_id
+model.config.pad_token_id = tokenizer.pad_token_id
+model.generation_config.update(bos_token_id=tokenizer.bos_token_id, eos_token_id=tokenizer.eos_token_id,
+                               pad_token_id=tokenizer.pad_token_id)
 
-# === שלב 2: טעינת הקובץ ===
-file_path = "/mnt/new_home/idan7/data_mining/ais_tracks_export/cleaned_data/vessel_tracks.txt"
-dataset = load_dataset("text", data_files={"data": file_path})["data"]
+# === שלב 2: טעינת הקובץ (מה-cache אם הקורפוס והטוקניזר לא השתנו) ===
+if DATA_MODE in ("packed", "text"):
+    cache = DatasetCache(DATASET_CACHE_DIR, DATASET_CACHE_MAX_BYTES)
+
+if DATA_MODE == "packed":
+    # === שלב 3+4: טוקניזציה חד-פעמית ל-token store, פיצול לפי מסלולים ===
+    # blocks are cut at load time, so BLOCK_SIZE is not part of the key
+    key = cache.key(file_path, tokenizer, {"format": "token_store", "version": 1})
+    store_dir = cache.get_or_build(key, lambda d: build_token_store(file_path, tokenizer, d), "token_store")
+    store = TokenStore(store_dir)
+    train_routes, val_routes = store.split_routes(val_fraction=0.1)
+    tokenized_train = PackedBlockDataset(store, BLOCK_SIZE, train_routes)
+    tokenized_val = PackedBlockDataset(store, BLOCK_SIZE, val_routes)
+    print(f"[INFO] {len(tokenized_train)} train / {len(tokenized_val)} val blocks of {BLOCK_SIZE} tokens")
+    data_collator = default_data_collator
+elif DATA_MODE == "stream":
+    # === שלב 3+4: קריאה וטוקניזציה תוך כדי אימון, פיצול לפי MMSI ===
+    tokenized_train = StreamingRouteDataset(SHARDS_DIR, tokenizer, "train", val_fraction=0.1, block_size=BLOCK_SIZE)
+    tokenized_val = StreamingRouteDataset(SHARDS_DIR, tokenizer, "validation", val_fraction=0.1,
+                                          block_size=BLOCK_SIZE, max_blocks=EVAL_BLOCKS)
+    print(f"[INFO] Streaming {len(tokenized_train.shards)} shards in blocks of {BLOCK_SIZE} tokens")
+    data_collator = default_data_collator
+else:
+    # every parameter of the tokenized data goes into the cache key
+    text_params = {"format": "text", "test_size": 0.1, "seed": 42, "train_rows": 10000, "val_rows": 1000,
+                   "max_length": 512, "padding": "max_length", "version": 1}
+
+    def build_text_dataset(directory):
+        dataset = load_dataset("text", data_files={"data": file_path})["data"]
+
+        # === שלב 3: פיצול ל-train ו-validation בלבד ===
+        split = dataset.train_test_split(test_size=text_params["test_size"], seed=text_params["seed"])
+        train_dataset = split["train"]
+        val_dataset = split["test"]
 
-# === שלב 3: פיצול ל-train ו-validation בלבד ===
-split = dataset.train_test_split(test_size=0.1, seed=42)
-train_dataset = split["train"]
-val_dataset = split["test"]
+        # === שלב 4: טוקניזציה (רק 10K ל-train, 1K ל-val) ===
+        def tokenize_function(examples):
+            return tokenizer(examples["text"], truncation=True, padding=text_params["padding"],
+                             max_length=text_params["max_length"])
 
-# === שלב 4: טוקניזציה (רק 10K ל-train, 1K ל-val) ===
-def tokenize_function(examples):
-    return tokenizer(examples["text"], truncation=True, padding="max_length", max_length=512)
+        DatasetDict({
+            "train": train_dataset.select(range(text_params["train_rows"])).map(
+                tokenize_function, batched=True, remove_columns=["text"]),
+            "validation": val_dataset.select(range(text_params["val_rows"])).map(
+                tokenize_function, batched=True, remove_columns=["text"]),
+        }).save_to_disk(directory)
 
-tokenized_train = train_dataset.select(range(10000)).map(tokenize_function, batched=True, remove_columns=["text"])
-tokenized_val = val_dataset.select(range(1000)).map(tokenize_function, batched=True, remove_columns=["text"])
+    key = cache.key(file_path, tokenizer, text_params)
+    tokenized = load_from_disk(cache.get_or_build(key, build_text_dataset, "text"))
+    tokenized_train = tokenized["train"]
+    tokenized_val = tokenized["validation"]
 
-# === שלב 5: פרמטרים לאימון מהיר ===
-data_collator = DataCollatorForLanguageModeling(tokenizer=tokenizer, mlm=False)
+    # === שלב 5: פרמטרים לאימון מהיר ===
+    data_collator = DataCollatorForLanguageModeling(tokenizer=tokenizer, mlm=False)
 
 training_args = TrainingArguments(
     output_dir="./gpt-vessel",
@@ -49,10 +126,12 @@ training_args = TrainingArguments(
     logging_dir="./logs",
     logging_steps=50,
     do_eval=True,
+    dataloader_num_workers=STREAM_WORKERS if DATA_MODE == "stream" else 0,
 )
 
 # === שלב 6: אימון ===
-trainer = Trainer(
+# tokens/sec, data wait vs compute, step time percentiles, peak RSS -> gpt-vessel/throughput_log.jsonl
+trainer = InstrumentedTrainer(
     model=model,
     args=training_args,
     train_dataset=tokenized_train,
@@ -70,22 +149,23 @@ trainer.save_model("/mnt/new_home/idan7/data_mining/ais_tracks_export/")
 tokenizer.save_pretrained("/mnt/new_home/idan7/data_mining/ais_tracks_export/")
 
 with open("/mnt/new_home/idan7/data_mining/ais_tracks_export/training_metrics.json", "w") as f:
-    json.dump(train_result.metrics, f, indent=4)
+    json.dump({**train_result.metrics, "throughput": trainer.throughput.summary()}, f, indent=4)
 
 # === שלב 8: בדיקה של פרומפט לדוגמה ===
 generator = pipeline("text-generation", model="./gpt-vessel", tokenizer="./gpt-vessel")
+# generation is constrained to " LAT:<num> LON:<num> |" and ends there (constrained_decoding.py)
+output_grammar = TrajectoryGrammar(generator.tokenizer, OUTPUT_GRAMMAR)
 
 def predict_next_coordinate(prompt: str):
     output = generator(
         prompt,
-        max_length=60,
+        max_new_tokens=output_grammar.max_new_tokens(),
         num_return_sequences=1,
-        eos_token_id=tokenizer.eos_token_id
+        eos_token_id=tokenizer.eos_token_id,
+        logits_processor=LogitsProcessorList([output_grammar.logits_processor()]),
     )
     generated_text = output[0]['generated_text']
-    if "OUTPUT:" in generated_text:
-        return generated_text.split("OUTPUT:", 1)[-1].strip().split("|")[0].strip()
-    return generated_text
+    return generated_text.split("OUTPUT:", 1)[-1].strip().split("|")[0].strip()
 
 # דוגמה לבדיקה
 example_prompt = "INPUT: LAT:18.3234 LON:-64.8056 SPD:5.1064 BRG:278.3201 ΔT:158 | OUTPUT:"
@@ -0,0 +1,175 @@
+"""
+Batched multi-vessel rollout.
+
+BatchPredictor runs the test_gpt.py rollout (seed lines, "→ Predict next input" instruction,
+drop seed lines every drop_every steps) for many vessels at once:
+- vessels are sorted by prompt length and cut into batches of batch_size, so a batch pads little
+- every step left-pads the batch's prompts and generates one continuation for all of them
+- a sequence stops as soon as its line is complete (a "|" after the LAT/LON fields or a
+  newline after text); the batch stops when all sequences did or at max_new_tokens
+- the first generated line is normalized (as in rollout.py) and appended to that vessel's context
+Returns {mmsi: array of (lat, lon)} with NaN rows for steps whose line had no LAT/LON.
+
+Prompts are re-encoded every step (the per-vessel contexts grow by different lengths, which
+the left-padded batch cache can't follow); for one vessel with a long rollout RolloutEngine is
+the better fit.
+"""
+
+import time
+
+import numpy as np
+import pandas as pd
+import torch
+from transformers import LogitsProcessorList, StoppingCriteria, StoppingCriteriaList
+
+from gpt_text_format import extract_points, normalize_predicted_line, parse_line, row_to_prompt
+from rollout import INSTRUCTION, context_text
+
+shard_path = "/mnt/new_home/idan7/data_mining/ais_tracks_export/text_for_GPT_extended/vessel_gpt_1.txt"
+model_path = "/mnt/new_home/idan7/data_mining/ais_tracks_export/"
+output_csv = "/mnt/new_home/idan7/data_mining/ais_tracks_export/predicted_points_all_vessels.csv"
+BATCH_SIZE = 32
+
+
+class LineCompleteCriteria(StoppingCriteria):
+    """Per-sequence stop once the generated text holds a complete line."""
+
+    def __init__(self, tokenizer, prompt_length):
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+
+    def __call__(self, input_ids, scores, **kwargs):
+        texts = self.tokenizer.batch_decode(input_ids[:, self.prompt_length:], skip_special_tokens=True)
+        done = [line_complete(text) for text in texts]
+        return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
+
+
+def line_complete(text):
+    text = text.lstrip()
+    return "|" in text or "\n" in text
+
+
+def first_line(text):
+    lines = [l.strip() for l in text.strip().split("\n") if l.strip()]
+    return lines[0] if lines else None
+
+
+def seed_windows(df, seed_lines=20, skip_last=0, min_lines=None):
+    """
+    {mmsi: prompt lines} from a parse_line DataFrame: per vessel the seed_lines rows before its
+    last skip_last rows (test_gpt.py uses rows -40:-20, i.e. skip_last=20).
+    """
+    windows = {}
+    min_lines = seed_lines if min_lines is None else min_lines
+    for mmsi, ship_df in df.groupby("MMSI", sort=False):
+        end = len(ship_df) - skip_last
+        rows = ship_df.iloc[max(0, end - seed_lines):max(0, end)]
+        if len(rows) >= min_lines:
+            windows[mmsi] = [row_to_prompt(row) for _, row in rows.iterrows()]
+    return windows
+
+
+class BatchPredictor:
+    def __init__(self, model, tokenizer, batch_size=BATCH_SIZE, grammar=None):
+        self.model = model.eval()
+        self.tokenizer = tokenizer
+        # continuations must start right after every prompt; too long prompts lose their oldest lines
+        self.tokenizer.padding_side = "left"
+        self.tokenizer.truncation_side = "left"
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        self.device = next(model.parameters()).device
+        self.batch_size = batch_size
+        # constrained_decoding.TrajectoryGrammar: rows end with EOS exactly at the end of their segment
+        self.grammar = grammar
+        self.grammar_max_tokens = grammar.max_new_tokens() if grammar is not None else None
+        self.max_positions = getattr(model.config, "n_positions", None) \
+            or getattr(model.config, "max_position_embeddings", 1024)
+
+    @torch.no_grad()
+    def generate_lines(self, prompts, max_new_tokens=17, **generate_kwargs):
+        """One continuation per prompt (one batch); returns the first generated line of each, or None."""
+        if self.grammar is not None:
+            max_new_tokens = self.grammar_max_tokens
+            generate_kwargs["logits_processor"] = LogitsProcessorList(
+                list(generate_kwargs.get("logits_processor") or []) + [self.grammar.logits_processor()])
+        encoded = self.tokenizer(prompts, add_special_tokens=False, padding=True, return_tensors="pt",
+                                 truncation=True, max_length=self.max_positions - max_new_tokens)
+        input_ids = encoded["input_ids"].to(self.device)
+        attention_mask = encoded["attention_mask"].to(self.device)
+        output = self.model.generate(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            max_new_tokens=max_new_tokens,
+            pad_token_id=self.tokenizer.pad_token_id,
+            stopping_criteria=StoppingCriteriaList([LineCompleteCriteria(self.tokenizer, input_ids.shape[1])]),
+            **generate_kwargs,
+        )
+        texts = self.tokenizer.batch_decode(output[:, input_ids.shape[1]:], skip_special_tokens=True)
+        return [first_line(text) for text in texts]
+
+    def _rollout_batch(self, seeds, n_steps, max_new_tokens, drop_every, drop_count, **generate_kwargs):
+        predicted = [[] for _ in seeds]
+        points = np.full((len(seeds), n_steps, 2), np.nan)
+        drop = 0
+        for step in range(n_steps):
+            prompts = [context_text(seed[drop:], lines) + INSTRUCTION for seed, lines in zip(seeds, predicted)]
+            for i, line in enumerate(self.generate_lines(prompts, max_new_tokens, **generate_kwargs)):
+                if line is None:
+                    continue
+                line = normalize_predicted_line(line)
+                predicted[i].append(line)
+                coords = extract_points(line)
+                if coords:
+                    lon, lat = coords[0]
+                    points[i, step] = (lat, lon)
+            if drop_every and (step + 1) % drop_every == 0:
+                drop += drop_count
+        return points
+
+    def predict(self, windows, n_steps=10, max_new_tokens=17, drop_every=5, drop_count=5, verbose=True,
+                **generate_kwargs):
+        """
+        windows: {mmsi: seed prompt lines}. Returns {mmsi: (n_steps, 2) array of (lat, lon)}.
+        generate_kwargs go to model.generate (do_sample, temperature, top_k, logits_processor, ...).
+        """
+        start_time = time.time()
+        # sort by prompt size so every batch holds similar lengths
+        order = sorted(windows, key=lambda mmsi: sum(len(line) for line in windows[mmsi]))
+        results = {}
+        for b in range(0, len(order), self.batch_size):
+            batch = order[b:b + self.batch_size]
+            points = self._rollout_batch([windows[mmsi] for mmsi in batch], n_steps, max_new_tokens,
+                                         drop_every, drop_count, **generate_kwargs)
+            results.update(zip(batch, points))
+            if verbose:
+                print(f"[INFO] {min(b + self.batch_size, len(order))}/{len(order)} vessels "
+                      f"({time.time() - start_time:.1f} seconds)")
+        return results
+
+
+def points_to_frame(results):
+    rows = []
+    for mmsi, points in results.items():
+        for step, (lat, lon) in enumerate(points):
+            rows.append({"MMSI": mmsi, "Step": step, "LAT": lat, "LON": lon})
+    return pd.DataFrame(rows, columns=["MMSI", "Step", "LAT", "LON"])
+
+
+if __name__ == "__main__":
+    from transformers import AutoTokenizer
+
+    from quantized_model import load_inference_model
+
+    tokenizer = AutoTokenizer.from_pretrained(model_path)
+    model = load_inference_model(model_path)  # int8 if model_path is a quantized_model.py export
+
+    with open(shard_path, "r") as f:
+        parsed = [p for p in (parse_line(line) for line in f) if p is not None]
+    windows = seed_windows(pd.DataFrame(parsed), seed_lines=20, skip_last=20)
+    print(f"[INFO] {len(windows)} vessels with a full seed window")
+
+    predictor = BatchPredictor(model, tokenizer)
+    results = predictor.predict(windows, n_steps=10, do_sample=True, temperature=0.7, top_k=50)
+    points_to_frame(results).to_csv(output_csv, index=False)
+    print(f"[DONE] Saved predicted points to {output_csv}")
@@ -1,37 +1,191 @@
+"""
+Validates the training corpus (vessel_tracks.txt) in parallel.
+
+The file is memory-mapped and split into newline-aligned byte ranges, one task per range.
+Every line must be a route line matching LINE_RE (4-decimal LAT/LON/SPD/BRG, integer ΔT) with
+values inside the ranges below, or the <|endofroute|> separator. Route checks: no empty
+routes, no route left open at the end of the file.
+
+Workers return per-range counts, route pieces and offending byte offsets; the pieces are
+joined into per-route stats (a route can span ranges). Reports are written next to the input:
+<input>.routes.csv (one row per route) and <input>.issues.csv (byte offset and kind of every
+problem, up to MAX_ISSUES_PER_TASK per range).
+"""
+
+import csv
+import mmap
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
 input_file = "/mnt/new_home/idan7/data_mining/ais_tracks_export/cleaned_data/vessel_tracks.txt"
+max_workers = os.cpu_count()
+preview_lines = 5  # how many issues to print
+
+END_OF_ROUTE = b"<|endofroute|>"
+NUMBER = rb"(-?\d+\.\d{4})"
+LINE_RE = re.compile(
+    rb"INPUT: LAT:" + NUMBER + rb" LON:" + NUMBER + rb" SPD:" + NUMBER + rb" BRG:" + NUMBER
+    + " ΔT:".encode("utf-8") + rb"(-?\d+)"
+    + rb" \| OUTPUT: LAT:" + NUMBER + rb" LON:" + NUMBER + rb" \|"
+)
+# (group, field, low, high) - closed ranges
+RANGES = [
+    (1, "LAT", -90.0, 90.0),
+    (2, "LON", -180.0, 180.0),
+    (3, "SPD", 0.0, 100.0),
+    (4, "BRG", 0.0, 360.0),
+    (5, "DT", 0, float("inf")),
+    (6, "LAT", -90.0, 90.0),
+    (7, "LON", -180.0, 180.0),
+]
+MIN_TASK_BYTES = 64 * 1024 * 1024
+MAX_ISSUES_PER_TASK = 10000
+
+
+def split_ranges(path, n_tasks):
+    """Newline-aligned (start, stop) byte ranges covering the file."""
+    size = os.path.getsize(path)
+    if size == 0:
+        return []
+    n_tasks = max(1, min(n_tasks, size // MIN_TASK_BYTES or 1))
+    bounds = [0]
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for k in range(1, n_tasks):
+            newline = mm.find(b"\n", max(size * k // n_tasks, bounds[-1]))
+            if newline == -1:
+                break
+            if newline + 1 > bounds[-1]:
+                bounds.append(newline + 1)
+    if bounds[-1] != size:
+        bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _check_line(line):
+    """Returns (kind of the problem or None, ΔT)."""
+    match = LINE_RE.fullmatch(line)
+    if match is None:
+        return "syntax", 0
+    for group, field, low, high in RANGES:
+        value = float(match.group(group))
+        if not low <= value <= high:
+            return f"range:{field}", 0
+    return None, int(match.group(5))
+
+
+def validate_range(task):
+    """
+    Worker: checks the lines in [start, stop).
+    Returns counts, issues [(offset, kind, excerpt)] and route pieces
+    [start_offset, lines, invalid, total_dt, end_offset or None if the route continues].
+    """
+    path, start, stop = task
+    counts = {"lines": 0, "valid": 0, "invalid": 0, "empty": 0, "separators": 0}
+    issues, pieces = [], []
+    piece = [start, 0, 0, 0, None]
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        pos = start
+        while pos < stop:
+            end = mm.find(b"\n", pos, stop)
+            if end == -1:
+                end = stop
+            line = mm[pos:end].rstrip(b"\r")
+            if line == END_OF_ROUTE:
+                counts["separators"] += 1
+                piece[4] = pos
+                pieces.append(piece)
+                piece = [end + 1, 0, 0, 0, None]
+            elif not line.strip():
+                counts["empty"] += 1
+                if len(issues) < MAX_ISSUES_PER_TASK:
+                    issues.append((pos, "empty line", ""))
+            else:
+                counts["lines"] += 1
+                kind, dt = _check_line(line)
+                piece[1] += 1
+                piece[3] += dt
+                if kind is None:
+                    counts["valid"] += 1
+                else:
+                    counts["invalid"] += 1
+                    counts[kind] = counts.get(kind, 0) + 1
+                    piece[2] += 1
+                    if len(issues) < MAX_ISSUES_PER_TASK:
+                        issues.append((pos, kind, line[:120].decode("utf-8", "replace")))
+            pos = end + 1
+    if piece[1]:
+        pieces.append(piece)
+    return counts, issues, pieces
+
+
+def validate_file(path, max_workers=max_workers, routes_csv=None, issues_csv=None):
+    routes_csv = routes_csv or f"{path}.routes.csv"
+    issues_csv = issues_csv or f"{path}.issues.csv"
+    start_time = time.time()
+    tasks = [(path, start, stop) for start, stop in split_ranges(path, max_workers * 4)]
+    print(f"[START] Checking {path} ({os.path.getsize(path) / 1e9:.2f} GB) in {len(tasks)} ranges...")
+
+    totals = {}
+    route_issues = []
+    n_routes = n_route_lines = printed = 0
+    current = None
+    with ProcessPoolExecutor(max_workers=max_workers) as executor, \
+            open(routes_csv, "w", newline="") as froutes, open(issues_csv, "w", newline="", encoding="utf-8") as fissues:
+        routes_writer = csv.writer(froutes)
+        routes_writer.writerow(["Route", "StartOffset", "Lines", "InvalidLines", "TotalDeltaT"])
+        issues_writer = csv.writer(fissues)
+        issues_writer.writerow(["Offset", "Kind", "Line"])
+
+        for counts, issues, pieces in executor.map(validate_range, tasks):
+            for key, value in counts.items():
+                totals[key] = totals.get(key, 0) + value
+            issues_writer.writerows(issues)
+            for offset, kind, line in issues[:max(0, preview_lines - printed)]:
+                print(f"[WARNING] {kind} at byte {offset}: {line}")
+                printed += 1
+
+            # join route pieces that span ranges
+            for piece in pieces:
+                if current is None:
+                    current = list(piece)
+                else:
+                    current[1:4] = [a + b for a, b in zip(current[1:4], piece[1:4])]
+                    current[4] = piece[4]
+                if current[4] is not None:
+                    if current[1] == 0:
+                        route_issues.append((current[4], "empty route", ""))
+                    routes_writer.writerow([n_routes] + current[:4])
+                    n_routes += 1
+                    n_route_lines += current[1]
+                    current = None
+
+        if current is not None:
+            route_issues.append((current[0], "unterminated route", ""))
+            routes_writer.writerow([n_routes] + current[:4])
+            n_routes += 1
+            n_route_lines += current[1]
+        issues_writer.writerows(route_issues)
+
+    for offset, kind, _ in route_issues[:preview_lines]:
+        print(f"[WARNING] {kind} at byte {offset}")
+    for offset, kind, _ in route_issues:
+        totals[kind] = totals.get(kind, 0) + 1
+
+    print("\n[SUMMARY]")
+    print(f"Valid lines: {totals.get('valid', 0)}")
+    print(f"Invalid lines: {totals.get('invalid', 0)}")
+    print(f"Empty lines: {totals.get('empty', 0)}")
+    print(f"Routes found (endofroute): {totals.get('separators', 0)}")
+    for kind in sorted(k for k in totals if k not in ("lines", "valid", "invalid", "empty", "separators")):
+        print(f"  {kind}: {totals[kind]}")
+    if n_routes:
+        print(f"Lines per route: {n_route_lines / n_routes:.1f} on average")
+    print(f"Reports: {routes_csv}, {issues_csv}")
+    print(f"[DONE] File check completed in {time.time() - start_time:.2f} seconds.")
+    return totals
+
 
-valid_lines = 0
-invalid_lines = 0
-empty_lines = 0
-routes = 0
-preview_lines = 5  # how many valid lines to preview
-
-print("[START] Checking file integrity...")
-
-with open(input_file, "r", encoding="utf-8") as f:
-    for i, line in enumerate(f, 1):
-        line = line.strip()
-
-        if not line:
-            empty_lines += 1
-            continue
-
-        if line == "<|endofroute|>":
-            routes += 1
-            continue
-
-        if "INPUT:" in line and "OUTPUT:" in line:
-            valid_lines += 1
-            if preview_lines > 0:
-                print(f"[VALID] Line {i}: {line}")
-                preview_lines -= 1
-        else:
-            print(f"[WARNING] Suspicious line {i}: {line}")
-            invalid_lines += 1
-
-print("\n[SUMMARY]")
-print(f"Valid lines: {valid_lines}")
-print(f"Suspicious lines: {invalid_lines}")
-print(f"Empty lines: {empty_lines}")
-print(f"Routes found (endofroute): {routes}")
-print("[DONE] File check completed.")
+if __name__ == "__main__":
+    validate_file(input_file)
@@ -0,0 +1,253 @@
+"""
+Columnar chunk format (ais_chunk_{i}.parquet) as an alternative to ais_chunk_{i}.csv.
+
+Attribute columns are stored with their types. The track geometry is stored GeoArrow-style
+(geoarrow.multilinestring, separated x/y) as a large_list<large_list<struct<x, y>>> column:
+track -> parts -> coordinates. Readers get the coordinates as flat float64 NumPy arrays plus
+offset arrays straight from the Arrow buffers, so neither WKT nor CSV floats are parsed.
+Every track is stored as a multilinestring; its original shapely geometry type id is kept in
+the geometry_type column, so readers can apply the same geometry_types filter as for WKT.
+"""
+
+import io
+import json
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import shapely
+
+GEOMETRY_COLUMN = "geometry"
+GEOMETRY_TYPE_COLUMN = "geometry_type"
+
+
+class TrackCoords(NamedTuple):
+    """
+    Coordinates of all tracks in a chunk.
+    Track i owns parts track_offsets[i]:track_offsets[i+1],
+    part j owns coordinates part_offsets[j]:part_offsets[j+1] of lon/lat.
+    """
+    lon: np.ndarray            # float64, one entry per vertex
+    lat: np.ndarray            # float64, one entry per vertex
+    part_offsets: np.ndarray   # int64, n_parts + 1
+    track_offsets: np.ndarray  # int64, n_tracks + 1
+
+
+def _counts_to_offsets(counts):
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return offsets
+
+
+def geometries_to_track_coords(geometries):
+    """
+    Flattens an array of (Multi)LineStrings into TrackCoords.
+    A LineString is one part; None / empty geometries become tracks with no parts.
+    """
+    geometries = np.asarray(geometries, dtype=object)
+    parts, track_index = shapely.get_parts(geometries, return_index=True)
+    coords, part_index = shapely.get_coordinates(parts, return_index=True)
+
+    return TrackCoords(
+        lon=np.ascontiguousarray(coords[:, 0]),
+        lat=np.ascontiguousarray(coords[:, 1]),
+        part_offsets=_counts_to_offsets(np.bincount(part_index, minlength=len(parts))),
+        track_offsets=_counts_to_offsets(np.bincount(track_index, minlength=len(geometries))),
+    )
+
+
+LINE_TYPES = (shapely.GeometryType.LINESTRING, shapely.GeometryType.MULTILINESTRING)
+MULTILINE_TYPES = (shapely.GeometryType.MULTILINESTRING,)
+
+
+def decode_wkt_geometries(wkt_values, geometry_types=LINE_TYPES):
+    """
+    Parses a whole chunk's WKT geometry column in one vectorized call into TrackCoords.
+    Unparseable / missing values and geometries whose type is not in geometry_types become
+    tracks with no parts. The reconstruction scripts pass MULTILINE_TYPES: their per-row
+    "multiline.geoms" parsing skipped LineString rows.
+    """
+    values = np.asarray(wkt_values, dtype=object)
+    values = np.where([isinstance(v, str) for v in values], values, None)
+    geometries = shapely.from_wkt(values, on_invalid="ignore")
+    geometries = np.where(np.isin(shapely.get_type_id(geometries), geometry_types), geometries, None)
+    return geometries_to_track_coords(geometries)
+
+
+def coordinate_indices(track_coords):
+    """
+    Per-vertex index arrays: (track_index, part_index) where part_index is the global part
+    number (use track_offsets / part_offsets to turn them into positions within a track / part).
+    """
+    part_index = np.repeat(np.arange(len(track_coords.part_offsets) - 1), np.diff(track_coords.part_offsets))
+    track_of_part = np.repeat(np.arange(len(track_coords.track_offsets) - 1), np.diff(track_coords.track_offsets))
+    return track_of_part[part_index], part_index
+
+
+def track_point_offsets(track_coords):
+    """Vertex offsets per track, all parts of a track concatenated."""
+    return track_coords.part_offsets[track_coords.track_offsets]
+
+
+def _collect(geometries, counts, constructor, empty_wkt):
+    # shapely requires every output index to be present, so empty items are filled in afterwards
+    out = np.full(len(counts), shapely.from_wkt(empty_wkt), dtype=object)
+    nonempty = counts > 0
+    if nonempty.any():
+        indices = np.repeat(np.arange(nonempty.sum()), counts[nonempty])
+        out[nonempty] = constructor(geometries, indices=indices)
+    return out
+
+
+def track_coords_to_geometries(track_coords):
+    """Inverse of geometries_to_track_coords: one MultiLineString per track."""
+    coords = np.column_stack([track_coords.lon, track_coords.lat])
+    lines = _collect(coords, np.diff(track_coords.part_offsets), shapely.linestrings, "LINESTRING EMPTY")
+    return _collect(lines, np.diff(track_coords.track_offsets), shapely.multilinestrings, "MULTILINESTRING EMPTY")
+
+
+def track_coords_to_arrow(track_coords, crs=None):
+    xy = pa.StructArray.from_arrays(
+        [pa.array(track_coords.lon, type=pa.float64()), pa.array(track_coords.lat, type=pa.float64())],
+        names=["x", "y"],
+    )
+    parts = pa.LargeListArray.from_arrays(pa.array(track_coords.part_offsets, type=pa.int64()), xy)
+    return pa.LargeListArray.from_arrays(pa.array(track_coords.track_offsets, type=pa.int64()), parts)
+
+
+def _geometry_field(crs=None):
+    extension_metadata = {"crs": crs} if crs else {}
+    return pa.field(
+        GEOMETRY_COLUMN,
+        pa.large_list(pa.large_list(pa.struct([("x", pa.float64()), ("y", pa.float64())]))),
+        metadata={
+            "ARROW:extension:name": "geoarrow.multilinestring",
+            "ARROW:extension:metadata": json.dumps(extension_metadata),
+        },
+    )
+
+
+def write_columnar_chunk(gdf, output_path, compression="zstd", row_group_size=2000):
+    """
+    Writes a GeoDataFrame of tracks as one columnar chunk.
+    Small row groups let readers fetch (and schedulers split) parts of a chunk.
+    """
+    geometry_name = gdf.geometry.name
+    attributes = pd.DataFrame(gdf.drop(columns=geometry_name))
+    table = pa.Table.from_pandas(attributes, preserve_index=False)
+
+    crs = gdf.crs.to_json() if gdf.crs is not None else None
+    geometries = gdf.geometry.to_numpy()
+    geometry = track_coords_to_arrow(geometries_to_track_coords(geometries))
+    table = table.append_column(GEOMETRY_TYPE_COLUMN, pa.array(shapely.get_type_id(geometries), type=pa.int8()))
+    table = table.append_column(_geometry_field(crs), geometry)
+
+    pq.write_table(table, output_path, compression=compression, row_group_size=row_group_size)
+
+
+def _offsets(list_array):
+    offsets = list_array.offsets.to_numpy(zero_copy_only=True)
+    return offsets - offsets[0] if offsets[0] else offsets
+
+
+def arrow_to_track_coords(geometry):
+    """Zero-copy view of a geometry column (Array or ChunkedArray) as TrackCoords."""
+    if isinstance(geometry, pa.ChunkedArray):
+        geometry = geometry.combine_chunks() if geometry.num_chunks != 1 else geometry.chunk(0)
+    parts = geometry.flatten()
+    xy = parts.flatten()
+    return TrackCoords(
+        lon=xy.field("x").to_numpy(zero_copy_only=True),
+        lat=xy.field("y").to_numpy(zero_copy_only=True),
+        part_offsets=_offsets(parts),
+        track_offsets=_offsets(geometry),
+    )
+
+
+def table_tracks(table, geometry_types=LINE_TYPES):
+    """
+    Splits an Arrow table / record batch of a columnar chunk into (attributes DataFrame,
+    TrackCoords, kept) after dropping the rows whose geometry type is not in geometry_types
+    (missing geometries included). kept is the boolean row mask, or None when nothing was
+    filtered (geometry_types None, or a chunk written without the geometry_type column).
+    """
+    kept = None
+    if GEOMETRY_TYPE_COLUMN in table.column_names:
+        if geometry_types is not None:
+            kept = np.isin(table.column(GEOMETRY_TYPE_COLUMN).to_numpy(), geometry_types)
+            table = table.filter(pa.array(kept))
+        table = table.drop_columns([GEOMETRY_TYPE_COLUMN])
+    track_coords = arrow_to_track_coords(table.column(GEOMETRY_COLUMN))
+    attributes = table.drop_columns([GEOMETRY_COLUMN]).to_pandas()
+    return attributes, track_coords, kept
+
+
+def read_columnar_chunk(path, columns=None, geometry_types=LINE_TYPES):
+    """
+    Reads a columnar chunk.
+    Returns (attributes DataFrame, TrackCoords); columns limits the attribute columns read.
+    Rows whose geometry type is not in geometry_types are dropped (see table_tracks).
+    """
+    if columns is not None:
+        extra = [GEOMETRY_TYPE_COLUMN] if GEOMETRY_TYPE_COLUMN in pq.read_schema(path).names else []
+        columns = [c for c in columns if c not in (GEOMETRY_COLUMN, GEOMETRY_TYPE_COLUMN)] + extra + [GEOMETRY_COLUMN]
+    attributes, track_coords, _ = table_tracks(pq.read_table(path, columns=columns), geometry_types)
+    return attributes, track_coords
+
+
+def read_chunk_tracks(path, geometry_types=LINE_TYPES):
+    """
+    Reads a chunk file (.parquet or .csv) as (attributes DataFrame, TrackCoords).
+    CSV geometry is decoded with decode_wkt_geometries (other geometry types become empty
+    tracks); Parquet rows of other geometry types are dropped. Either way they give no segments.
+    """
+    if path.endswith(".parquet"):
+        return read_columnar_chunk(path, geometry_types=geometry_types)
+    df = pd.read_csv(path)
+    track_coords = decode_wkt_geometries(df.pop(GEOMETRY_COLUMN), geometry_types)
+    return df, track_coords
+
+
+def iter_chunk_tracks(path, batch_rows=50000, geometry_types=LINE_TYPES):
+    """
+    Streams a chunk file (.parquet or .csv) as (attributes DataFrame, TrackCoords) batches of
+    at most batch_rows tracks, in file order. Rows keep their position in the file as index.
+    geometry_types is applied as in read_chunk_tracks.
+    """
+    first_row = 0
+    if path.endswith(".parquet"):
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_rows):
+            attributes, track_coords, kept = table_tracks(batch, geometry_types)
+            positions = np.arange(first_row, first_row + batch.num_rows)
+            attributes.index = positions[kept] if kept is not None else pd.RangeIndex(first_row, first_row + len(positions))
+            first_row += batch.num_rows
+            yield attributes, track_coords
+    else:
+        for df in pd.read_csv(path, chunksize=batch_rows):
+            yield df, decode_wkt_geometries(df.pop(GEOMETRY_COLUMN), geometry_types)
+
+
+def read_csv_byte_range(path, start, stop):
+    """
+    Reads the CSV rows in bytes [start, stop) of path (line-aligned) with the file's header.
+    The range must not cut a quoted field: an odd number of '"' in it means a boundary fell on
+    a newline inside quotes (ValueError).
+    """
+    with open(path, "rb") as f:
+        header = f.readline()
+        f.seek(start)
+        data = f.read(stop - start)
+    if data.count(b'"') % 2:
+        raise ValueError(f"{path}: bytes {start}-{stop} cut a quoted field with a newline; "
+                         f"split this file into larger tasks or none")
+    return pd.read_csv(io.BytesIO(header + data))
+
+
+def read_chunk_attributes(path, columns=None):
+    """Reads only attribute columns from a chunk file (.parquet or .csv)."""
+    if path.endswith(".parquet"):
+        df = pd.read_parquet(path, columns=columns)
+        return df.drop(columns=[GEOMETRY_TYPE_COLUMN], errors="ignore")
+    return pd.read_csv(path, usecols=columns)
@@ -1,32 +1,164 @@
+"""
+Assembles the vessel_gpt_*.txt shards ("MMSI:<id> | <line>") into vessel_tracks.txt: one route per
+MMSI (the lines without the MMSI prefix) followed by <|endofroute|>.
+
+The shards are a concatenation of MMSI-sorted runs (csvs_to_gpt_format_parallel.py sorts every
+vectors file by MMSI), so instead of holding every line in a dict:
+- pass 1 finds the sorted runs (byte ranges where the MMSI stops increasing)
+- the runs are k-way merged by MMSI, at most MAX_OPEN_FILES at a time (more runs are merged in
+  intermediate passes into temporary files); lines of a vessel keep their shard order
+- routes are streamed to the output, dropping identical consecutive lines
+
+Memory is one line per open run. Routes are written in MMSI order. route_stats.csv next to the
+output has one row per route.
+"""
+
+import csv
+import heapq
+import itertools
 import os
-from collections import defaultdict
+import shutil
+import time
+
+from run_manifest import atomic_output
 
 input_dir = "/mnt/new_home/idan7/data_mining/ais_tracks_export/text_for_GPT_extended/"
 output_file = "/mnt/new_home/idan7/data_mining/ais_tracks_export/cleaned_data/vessel_tracks.txt"
 
-# אוגר את כל השורות לפי MMSI
-mmsi_to_lines = defaultdict(list)
-
-for fname in sorted(os.listdir(input_dir)):
-    if fname.endswith(".txt"):
-        file_path = os.path.join(input_dir, fname)
-        with open(file_path, "r", encoding="utf-8") as f:
-            for line in f:
-                line = line.strip()
-                if not line:
-                    continue
-                try:
-                    mmsi, content = line.split("|", 1)
-                    mmsi = mmsi.strip()
-                    mmsi_to_lines[mmsi].append(content.strip())
-                except ValueError:
-                    continue  # מדלג על שורות לא תקינות
-
-# כותב את כל הנתונים המאורגנים לקובץ אחד
-with open(output_file, "w", encoding="utf-8") as fout:
-    for mmsi, lines in mmsi_to_lines.items():
-        for line in lines:
-            fout.write(line + "\n")
-        fout.write("<|endofroute|>\n")  # מפריד בין מסלולים
-
-print(f"[INFO] קובץ מאוחד נוצר בהצלחה: {output_file}")
+END_OF_ROUTE = "<|endofroute|>"
+MAX_OPEN_FILES = 64
+ROUTE_STATS_FILE = "route_stats.csv"
+
+
+def shard_files(input_dir):
+    names = [f for f in os.listdir(input_dir) if f.endswith(".txt")]
+    # vessel_gpt_{i}.txt in numeric order (the order the converter wrote them)
+    return [os.path.join(input_dir, f) for f in sorted(names, key=lambda f: (len(f), f))]
+
+
+def _parse_line(raw):
+    line = raw.decode("utf-8").strip()
+    if not line or "|" not in line:
+        return None  # מדלג על שורות לא תקינות
+    mmsi, content = line.split("|", 1)
+    return mmsi.strip(), content.strip()
+
+
+def mmsi_sort_key(mmsi):
+    number = mmsi[5:] if mmsi.startswith("MMSI:") else mmsi
+    return (0, int(number), "") if number.isdigit() else (1, 0, mmsi)
+
+
+def find_sorted_runs(paths):
+    """
+    Pass 1: splits the concatenation of paths into MMSI-sorted runs.
+    A run is a list of (path, start, stop) byte ranges (a run can continue into the next file).
+    """
+    runs, current, previous_key = [], [], None
+    for path in paths:
+        start = offset = 0
+        with open(path, "rb") as f:
+            for raw in f:
+                parsed = _parse_line(raw)
+                if parsed is not None:
+                    key = mmsi_sort_key(parsed[0])
+                    if previous_key is not None and key < previous_key:
+                        if offset > start:
+                            current.append((path, start, offset))
+                        runs.append(current)
+                        current, start = [], offset
+                    previous_key = key
+                offset += len(raw)
+        if offset > start:
+            current.append((path, start, offset))
+    if current:
+        runs.append(current)
+    return runs
+
+
+def iter_run(run):
+    """Yields (sort_key, mmsi, content) for the lines of a run."""
+    for path, start, stop in run:
+        with open(path, "rb") as f:
+            f.seek(start)
+            offset = start
+            for raw in f:
+                if offset >= stop:
+                    break
+                offset += len(raw)
+                parsed = _parse_line(raw)
+                if parsed is not None:
+                    yield (mmsi_sort_key(parsed[0]),) + parsed
+
+
+def _merge(runs):
+    return heapq.merge(*(iter_run(run) for run in runs), key=lambda item: item[0])
+
+
+def merge_runs(runs, tmp_dir, max_open_files=MAX_OPEN_FILES):
+    """Merges groups of runs into temporary run files until at most max_open_files runs are left."""
+    merge_pass = 0
+    while len(runs) > max_open_files:
+        merged_runs = []
+        for i in range(0, len(runs), max_open_files):
+            path = os.path.join(tmp_dir, f"pass{merge_pass}_{len(merged_runs)}.txt")
+            with open(path, "w", encoding="utf-8") as f:
+                for _, mmsi, content in _merge(runs[i:i + max_open_files]):
+                    f.write(f"{mmsi} | {content}\n")
+            merged_runs.append([(path, 0, os.path.getsize(path))])
+        for run in runs:
+            for path, _, _ in run:
+                if path.startswith(tmp_dir) and os.path.exists(path):
+                    os.remove(path)
+        runs = merged_runs
+        merge_pass += 1
+        print(f"[INFO] Merge pass {merge_pass}: {len(runs)} runs left")
+    return _merge(runs)
+
+
+def assemble_routes(input_dir, output_file, dedupe=True, max_open_files=MAX_OPEN_FILES):
+    start_time = time.time()
+    paths = shard_files(input_dir)
+    runs = find_sorted_runs(paths)
+    print(f"[INFO] {len(paths)} shard files, {len(runs)} MMSI-sorted runs")
+
+    output_dir = os.path.dirname(os.path.abspath(output_file))
+    os.makedirs(output_dir, exist_ok=True)
+    tmp_dir = os.path.join(output_dir, "_route_runs")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    routes = total_lines = total_duplicates = longest = 0
+    stats_path = os.path.join(output_dir, ROUTE_STATS_FILE)
+    with atomic_output(output_file) as tmp_output, atomic_output(stats_path) as tmp_stats:
+        with open(tmp_output, "w", encoding="utf-8") as fout, open(tmp_stats, "w", newline="") as fstats:
+            stats = csv.writer(fstats)
+            stats.writerow(["MMSI", "Lines", "DuplicatesRemoved", "Bytes"])
+            merged = merge_runs(runs, tmp_dir, max_open_files)
+            for mmsi, items in itertools.groupby(merged, key=lambda item: item[1]):
+                lines = duplicates = n_bytes = 0
+                previous = None
+                for _, _, content in items:
+                    if dedupe and content == previous:
+                        duplicates += 1
+                        continue
+                    previous = content
+                    fout.write(content + "\n")
+                    lines += 1
+                    n_bytes += len(content.encode("utf-8")) + 1
+                fout.write(END_OF_ROUTE + "\n")  # מפריד בין מסלולים
+                stats.writerow([mmsi.replace("MMSI:", ""), lines, duplicates, n_bytes])
+                routes += 1
+                total_lines += lines
+                total_duplicates += duplicates
+                longest = max(longest, lines)
+    shutil.rmtree(tmp_dir)
+
+    elapsed = time.time() - start_time
+    print(f"[INFO] {routes} routes, {total_lines} lines, {total_duplicates} duplicate lines removed, "
+          f"longest route {longest} lines ({elapsed:.2f} seconds). Stats: {stats_path}")
+    print(f"[INFO] קובץ מאוחד נוצר בהצלחה: {output_file}")
+
+
+if __name__ == "__main__":
+    assemble_routes(input_dir, output_file)
@@ -0,0 +1,217 @@
+"""
+Grammar-constrained decoding for route lines.
+
+A grammar is a list of parts:
+    ("lit", text)                          literal text
+    ("num", signed, max_int_digits, frac)  [-]<1..max_int_digits digits>.<frac digits>
+    ("int", max_digits)                    <1..max_digits digits>
+INPUT_GRAMMAR is the segment a rollout step generates:
+    INPUT: LAT:<num> LON:<num> SPD:<num> BRG:<num> ΔT:<int> |
+OUTPUT_GRAMMAR is what follows "... | OUTPUT:" (GPT.py predict_next_coordinate):
+     LAT:<num> LON:<num> |
+
+TrajectoryGrammar compiles the grammar into a byte-level automaton and walks a trie of the
+tokenizer's vocabulary from every automaton state (memoized), so each state knows which tokens
+keep the text inside the grammar and where they lead. GrammarLogitsProcessor masks all other
+tokens; once the segment is complete only EOS is allowed, so generation stops exactly at the end
+of the segment and the output always parses. Works with byte-level BPE (GPT-2, bytes of partial
+UTF-8 tokens such as "Δ" included) and with the trajectory tokenizer.
+
+max_new_tokens() is the longest tokenization of a segment + EOS, the exact cap for generate.
+Make a new logits_processor() for every generate call (it keeps the prompt length).
+"""
+
+import torch
+from transformers import LogitsProcessor
+
+# digit counts only, value ranges (check_main_file.RANGES) are not enforced
+LAT = ("num", True, 2, 4)
+LON = ("num", True, 3, 4)
+UNSIGNED = ("num", False, 3, 4)
+INPUT_GRAMMAR = [
+    ("lit", "INPUT: LAT:"), LAT, ("lit", " LON:"), LON, ("lit", " SPD:"), UNSIGNED,
+    ("lit", " BRG:"), UNSIGNED, ("lit", " ΔT:"), ("int", 9), ("lit", " |"),
+]
+OUTPUT_GRAMMAR = [("lit", " LAT:"), LAT, ("lit", " LON:"), LON, ("lit", " |")]
+
+DIGITS = frozenset(range(ord("0"), ord("9") + 1))
+MINUS, DOT = ord("-"), ord(".")
+
+
+def _byte_level_table():
+    """GPT-2 byte-level BPE: unicode character of the vocabulary -> byte."""
+    printable = list(range(ord("!"), ord("~") + 1)) + list(range(ord("¡"), ord("¬") + 1)) \
+        + list(range(ord("®"), ord("ÿ") + 1))
+    chars = printable[:]
+    n = 0
+    for b in range(256):
+        if b not in printable:
+            printable.append(b)
+            chars.append(256 + n)
+            n += 1
+    return {chr(c): b for b, c in zip(printable, chars)}
+
+
+def token_bytes(tokenizer):
+    """{token id: bytes it adds to the text} for all non-special tokens."""
+    special = set(tokenizer.all_special_ids)
+    backend = getattr(tokenizer, "backend_tokenizer", None)
+    byte_level = backend is not None and type(backend.decoder).__name__ == "ByteLevel"
+    table = _byte_level_table() if byte_level else None
+    result = {}
+    for token, token_id in tokenizer.get_vocab().items():
+        if token_id in special:
+            continue
+        if byte_level:
+            if all(c in table for c in token):
+                result[token_id] = bytes(table[c] for c in token)
+        else:
+            result[token_id] = tokenizer.convert_tokens_to_string([token]).encode("utf-8")
+    return result
+
+
+class TrajectoryGrammar:
+    def __init__(self, tokenizer, grammar=INPUT_GRAMMAR):
+        self.tokenizer = tokenizer
+        self.parts = [(p[0], p[1].encode("utf-8")) if p[0] == "lit" else p for p in grammar]
+        self.eos_token_id = tokenizer.eos_token_id
+        self.final = (len(self.parts), None)
+        self.start = self._start(0)
+        self._trie = self._build_trie(token_bytes(tokenizer))
+        self._transitions = {}
+        self._allowed = {}
+
+    # --- byte automaton ---
+    def _start(self, i):
+        if i >= len(self.parts):
+            return self.final
+        return (i, 0) if self.parts[i][0] == "lit" else (i, ("start", 0))
+
+    def _number_step(self, part, sub, b):
+        phase, n = sub
+        if phase == "start":
+            if b == MINUS and part[0] == "num" and part[1]:
+                return ("sign", 0)
+            return ("int", 1) if b in DIGITS else None
+        if phase == "sign":
+            return ("int", 1) if b in DIGITS else None
+        if phase == "int":
+            max_digits = part[2] if part[0] == "num" else part[1]
+            if b in DIGITS and n < max_digits:
+                return ("int", n + 1)
+            return ("dot", 0) if b == DOT and part[0] == "num" else None
+        if phase == "dot":
+            return ("frac", 1) if b in DIGITS else None
+        if phase == "frac":
+            return ("frac", n + 1) if b in DIGITS and n < part[3] else None
+        return None
+
+    def _number_done(self, part, sub):
+        if part[0] == "num":
+            return sub == ("frac", part[3])
+        return sub[0] == "int"
+
+    def advance(self, state, b):
+        """Automaton state after byte b, or None if b leaves the grammar."""
+        i, sub = state
+        while i < len(self.parts):
+            part = self.parts[i]
+            if part[0] == "lit":
+                if part[1][sub] != b:
+                    return None
+                return self._start(i + 1) if sub + 1 == len(part[1]) else (i, sub + 1)
+            new_sub = self._number_step(part, sub, b)
+            if new_sub is not None:
+                if part[0] == "num" and self._number_done(part, new_sub):
+                    return self._start(i + 1)  # fixed precision: nothing can follow
+                return (i, new_sub)
+            if not self._number_done(part, sub):
+                return None
+            i, sub = self._start(i + 1)  # b belongs to the next part
+        return None
+
+    # --- tokens ---
+    @staticmethod
+    def _build_trie(vocab_bytes):
+        root = ({}, [])
+        for token_id, data in vocab_bytes.items():
+            if not data:
+                continue
+            node = root
+            for b in data:
+                node = node[0].setdefault(b, ({}, []))
+            node[1].append(token_id)
+        return root
+
+    def transitions(self, state):
+        """{token id: next state} for every token allowed in state."""
+        if state in self._transitions:
+            return self._transitions[state]
+        result = {}
+        stack = [(child, self.advance(state, b)) for b, child in self._trie[0].items()]
+        while stack:
+            node, s = stack.pop()
+            if s is None:
+                continue
+            for token_id in node[1]:
+                result[token_id] = s
+            if s != self.final:  # nothing may follow the end of the segment
+                stack.extend((child, self.advance(s, b)) for b, child in node[0].items())
+        self._transitions[state] = result
+        return result
+
+    def allowed_ids(self, state):
+        if state not in self._allowed:
+            # EOS at the end of the segment, or if the vocabulary can't continue (dead end)
+            ids = sorted(self.transitions(state)) if state != self.final else []
+            ids = ids or [self.eos_token_id]
+            self._allowed[state] = torch.tensor(ids, dtype=torch.long)
+        return self._allowed[state]
+
+    def max_new_tokens(self):
+        """Longest tokenization of a segment, plus EOS."""
+        longest = {self.final: 0}
+
+        def visit(state):
+            if state not in longest:
+                # every token consumes bytes, so the state graph has no cycles
+                longest[state] = max((1 + visit(s) for s in set(self.transitions(state).values())), default=0)
+            return longest[state]
+
+        return visit(self.start) + 1
+
+    def logits_processor(self):
+        return GrammarLogitsProcessor(self)
+
+
+class GrammarLogitsProcessor(LogitsProcessor):
+    DONE = "done"
+
+    def __init__(self, grammar):
+        self.grammar = grammar
+        self.prompt_length = None
+        self._states = {(): grammar.start}  # generated ids -> automaton state (beam search safe)
+
+    def _state(self, generated):
+        if generated not in self._states:
+            previous = self._state(generated[:-1])
+            if previous in (self.DONE, self.grammar.final):
+                state = self.DONE  # EOS emitted (or padding after it)
+            elif previous is None:
+                state = None
+            else:
+                state = self.grammar.transitions(previous).get(generated[-1])
+            self._states[generated] = state
+        return self._states[generated]
+
+    def __call__(self, input_ids, scores):
+        if self.prompt_length is None:
+            self.prompt_length = input_ids.shape[1]
+        mask = torch.full_like(scores, float("-inf"))
+        for row, generated in enumerate(input_ids[:, self.prompt_length:].tolist()):
+            state = self._state(tuple(generated))
+            if state in (self.DONE, None):
+                mask[row, self.grammar.eos_token_id] = 0
+            else:
+                mask[row, self.grammar.allowed_ids(state).to(scores.device)] = 0
+        return scores + mask
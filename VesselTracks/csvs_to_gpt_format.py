@@ -1,12 +1,37 @@
+import heapq
+import itertools
 import os
+import shutil
+
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 from glob import glob
 
+from csvs_to_gpt_format_parallel import GptFileWriter
+from gpt_text_format import format_gpt_lines, iter_vessel_segments
+
+# external sort/merge mode (convert_and_save_gpt_text_external)
+RUN_COLUMNS = ['MMSI', 'Segment_StartTime', 'Start_Lat', 'Start_Lon', 'Speed_Knots', 'Bearing_Degrees',
+               'End_Lat', 'End_Lon']
+RUN_ROW_BYTES = 256     # in-memory bytes per row of RUN_COLUMNS, including the copy made by sorting
+MAX_MERGE_FANIN = 128   # runs merged at once (open files); more runs are merged in several passes
+
 def vessel_df_to_gpt_format(vessel_df):
     """
     Converts vessel trajectory into GPT-style training format:
     Each line is: INPUT: LAT:... LON:... SPD:... BRG:... ΔT:... | OUTPUT: LAT:... LON:... |
     """
+    # the row loop does not parse string timestamps, so only datetime columns are vectorized
+    if pd.api.types.is_datetime64_any_dtype(vessel_df.get('Segment_StartTime')):
+        lines = format_gpt_lines(vessel_df, mmsi_prefix=False)
+        if lines is not None:
+            return "\n".join(lines)
+    return vessel_df_to_gpt_format_rows(vessel_df)
+
+
+def vessel_df_to_gpt_format_rows(vessel_df):
+    """Row-by-row formatter, used for vessels the vectorized formatter does not handle."""
     formatted_segments = []
     prev_time = None
 
@@ -92,10 +117,104 @@ def convert_and_save_gpt_text(input_folder, output_folder, max_file_size_mb=100)
             f.write("\n".join(current_lines))
         print(f"[INFO] Saved {output_path} with {len(current_lines)} vessels.")
 
-# Example call
-convert_and_save_gpt_text(
-    input_folder="/mnt/new_home/idan7/data_mining/ais_tracks_export/vectors_for_GPT_updated/",
-    output_folder="/mnt/new_home/idan7/data_mining/ais_tracks_export/text_for_GPT/",
-    max_file_size_mb=200
-)
+def _spill_sorted_runs(all_files, spill_dir, run_rows):
+    """
+    Phase 1: reads every file in pieces of run_rows rows, sorts each piece by (MMSI, Segment_StartTime)
+    and writes it as a run. Returns the run paths in input order.
+    """
+    run_paths = []
+    for file in all_files:
+        try:
+            for df in pd.read_csv(file, usecols=lambda c: c in RUN_COLUMNS, chunksize=run_rows):
+                df['Segment_StartTime'] = pd.to_datetime(df['Segment_StartTime'], utc=True, errors='coerce')
+                df = df.dropna(subset=['MMSI'])
+                df['MMSI'] = df['MMSI'].astype('int64')
+                df = df.sort_values(by=['MMSI', 'Segment_StartTime'], kind='stable')
+
+                run_path = os.path.join(spill_dir, f"run_{len(run_paths)}.parquet")
+                pq.write_table(pa.Table.from_pandas(df, preserve_index=False), run_path)
+                run_paths.append(run_path)
+        except Exception as e:
+            print(f"[WARNING] Failed to read {file}: {e}")
+    return run_paths
+
+
+def _iter_run_vessels(run_path, batch_rows):
+    batches = (batch.to_pandas() for batch in pq.ParquetFile(run_path).iter_batches(batch_size=batch_rows))
+    return iter_vessel_segments(batches)
+
+
+def iter_merged_vessels(run_paths, batch_rows):
+    """
+    k-way merge of sorted runs: yields (mmsi, vessel_df) in MMSI order, the vessel's rows of all runs
+    merged by Segment_StartTime (ties keep run order). Memory: one batch per run plus one vessel.
+    """
+    runs = [_iter_run_vessels(path, batch_rows) for path in run_paths]
+    merged = heapq.merge(*runs, key=lambda item: item[0])
+    for mmsi, items in itertools.groupby(merged, key=lambda item: item[0]):
+        blocks = [block for _, block in items]
+        vessel_df = pd.concat(blocks, ignore_index=True) if len(blocks) > 1 else blocks[0]
+        yield mmsi, vessel_df.sort_values(by='Segment_StartTime', kind='stable')
+
+
+def _merge_runs_to_run(run_paths, output_path, batch_rows):
+    writer = None
+    for _, vessel_df in iter_merged_vessels(run_paths, batch_rows):
+        table = pa.Table.from_pandas(vessel_df, preserve_index=False)
+        if writer is None:
+            writer = pq.ParquetWriter(output_path, table.schema)
+        writer.write_table(table.cast(writer.schema))
+    if writer is not None:
+        writer.close()
+    for path in run_paths:
+        os.remove(path)
+
+
+def convert_and_save_gpt_text_external(input_folder, output_folder, max_file_size_mb=100, memory_budget_mb=4096,
+                                       spill_dir=None):
+    """
+    Out-of-core version of convert_and_save_gpt_text for corpora that do not fit in memory.
+    Sorted runs of about memory_budget_mb are spilled to spill_dir (default: output_folder/_runs) and
+    k-way merged (at most MAX_MERGE_FANIN at a time) into the same vessel_gpt_{i}.txt files, vessels in
+    MMSI order. Rows of a vessel with equal Segment_StartTime keep their input order.
+    """
+    all_files = sorted(glob(os.path.join(input_folder, "*.csv")))
+    os.makedirs(output_folder, exist_ok=True)
+    spill_dir = spill_dir or os.path.join(output_folder, "_runs")
+    shutil.rmtree(spill_dir, ignore_errors=True)
+    os.makedirs(spill_dir)
+
+    budget_rows = max(1000, memory_budget_mb * 1024 * 1024 // RUN_ROW_BYTES)
+    run_paths = _spill_sorted_runs(all_files, spill_dir, budget_rows)
+    print(f"[INFO] Spilled {len(run_paths)} sorted runs to {spill_dir}")
+
+    merge_pass = 0
+    while len(run_paths) > MAX_MERGE_FANIN:
+        merged_paths = []
+        for i in range(0, len(run_paths), MAX_MERGE_FANIN):
+            group = run_paths[i:i + MAX_MERGE_FANIN]
+            output_path = os.path.join(spill_dir, f"pass{merge_pass}_run_{len(merged_paths)}.parquet")
+            _merge_runs_to_run(group, output_path, max(1000, budget_rows // len(group)))
+            merged_paths.append(output_path)
+        run_paths = merged_paths
+        merge_pass += 1
+        print(f"[INFO] Merge pass {merge_pass}: {len(run_paths)} runs left")
+
+    writer = GptFileWriter(output_folder, max_file_size_mb * 1024 * 1024)
+    batch_rows = max(1000, budget_rows // max(1, len(run_paths)))
+    for mmsi, vessel_df in iter_merged_vessels(run_paths, batch_rows):
+        writer.add(mmsi, vessel_df_to_gpt_format(vessel_df))
+    writer.close()
+    shutil.rmtree(spill_dir)
+
+
+if __name__ == "__main__":
+    # Example call
+    convert_and_save_gpt_text(
+        input_folder="/mnt/new_home/idan7/data_mining/ais_tracks_export/vectors_for_GPT_updated/",
+        output_folder="/mnt/new_home/idan7/data_mining/ais_tracks_export/text_for_GPT/",
+        max_file_size_mb=200
+    )
+    # For corpora that do not fit in memory:
+    # convert_and_save_gpt_text_external(..., max_file_size_mb=200, memory_budget_mb=16384)
 
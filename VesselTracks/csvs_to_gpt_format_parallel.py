@@ -1,18 +1,34 @@
+import contextlib
+import io
 import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 import pandas as pd
 from glob import glob
 from datetime import datetime
 
+from gpt_text_format import format_gpt_lines
+
 INPUT_FOLDER = "/mnt/new_home/idan7/data_mining/ais_tracks_export/vectors_for_GPT_updated/"
 OUTPUT_FOLDER = "/mnt/new_home/idan7/data_mining/ais_tracks_export/text_for_GPT_extended/"
 MAX_FILE_SIZE_MB = 100
 MAX_FILE_SIZE_BYTES = MAX_FILE_SIZE_MB * 1024 * 1024
 MAX_ROWS_PER_VESSEL = 100  # אפשר לבטל אם לא רלוונטי
-
-os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+MAX_WORKERS = os.cpu_count()  # 1 = serial conversion
+SHARD_DIR_NAME = "_shards"
 
 
 def vessel_df_to_gpt_format_pandas(df: pd.DataFrame) -> str:
+    lines = format_gpt_lines(df, mmsi_prefix=True)
+    if lines is None:
+        return vessel_df_to_gpt_format_rows(df)
+    return "\n".join(lines)
+
+
+def vessel_df_to_gpt_format_rows(df: pd.DataFrame) -> str:
+    """Row-by-row formatter, used for vessels the vectorized formatter does not handle."""
     formatted_segments = []
     prev_time = None
 
@@ -49,60 +65,142 @@ def vessel_df_to_gpt_format_pandas(df: pd.DataFrame) -> str:
 
 
 
-def convert_all_csvs_to_gpt_format_pandas(input_folder, output_folder):
-    all_files = sorted(glob(os.path.join(input_folder, "*.csv")))
+class GptFileWriter:
+    """
+    Collects vessel texts into vessel_gpt_{i}.txt files of at most max_file_size_bytes.
+    A vessel is never split across files; a vessel larger than a whole file is skipped.
+    """
 
-    current_file_index = 0
-    current_lines = []
-    current_size_bytes = 0
+    def __init__(self, output_folder, max_file_size_bytes=MAX_FILE_SIZE_BYTES):
+        self.output_folder = output_folder
+        self.max_file_size_bytes = max_file_size_bytes
+        self.current_file_index = 0
+        self.current_lines = []
+        self.current_size_bytes = 0
 
-    for file in all_files:
-        print(f"[INFO] Processing {file}")
-        try:
-            df = pd.read_csv(file)
-            # df["Segment_StartTime"] = pd.to_datetime(df["Segment_StartTime"], errors="coerce")
+    def _save(self, label):
+        output_path = os.path.join(self.output_folder, f"vessel_gpt_{self.current_file_index}.txt")
+        with open(output_path, "w") as f:
+            f.write("\n".join(self.current_lines))
+        print(f"[{label}] {output_path} with {len(self.current_lines)} vessels")
+
+    def add(self, mmsi, gpt_text):
+        vessel_bytes = len(gpt_text.encode("utf-8")) + 1
+
+        if self.current_size_bytes + vessel_bytes > self.max_file_size_bytes:
+            self._save("SAVED")
+            self.current_file_index += 1
+            self.current_lines = []
+            self.current_size_bytes = 0
+
+        if vessel_bytes <= self.max_file_size_bytes:
+            self.current_lines.append(gpt_text)
+            self.current_size_bytes += vessel_bytes
+        else:
+            print(f"[SKIPPED] Vessel {mmsi} too large ({vessel_bytes / 1e6:.2f} MB)")
+
+    def close(self):
+        if self.current_lines:
+            self._save("FINAL SAVE")
+
+
+def iter_file_vessels(file):
+    """Yields (mmsi, gpt_text) for every vessel of a vectors CSV file, in output order."""
+    df = pd.read_csv(file)
+    # df["Segment_StartTime"] = pd.to_datetime(df["Segment_StartTime"], errors="coerce")
 
-            dropped = df[df["Segment_StartTime"].isna() | df["MMSI"].isna()]
-            print("[INFO] Dropping rows:\n", dropped.head())
+    dropped = df[df["Segment_StartTime"].isna() | df["MMSI"].isna()]
+    print("[INFO] Dropping rows:\n", dropped.head())
 
-            df = df.dropna(subset=["Segment_StartTime", "MMSI"])  # מסננים שורות בעייתיות
+    df = df.dropna(subset=["Segment_StartTime", "MMSI"])  # מסננים שורות בעייתיות
 
-            df["MMSI"] = df["MMSI"].astype(int)
-            df = df.sort_values(by=["MMSI", "Segment_StartTime"])
+    df["MMSI"] = df["MMSI"].astype(int)
+    df = df.sort_values(by=["MMSI", "Segment_StartTime"])
 
-            for mmsi, vessel_df in df.groupby("MMSI"):
-                vessel_df = vessel_df.dropna()
-                # vessel_df = vessel_df.head(MAX_ROWS_PER_VESSEL)  # בטל אם לא רלוונטי
+    # the whole file is rendered at once (ΔT restarts per MMSI), vessels are slices of it
+    clean = df.dropna()
+    lines = format_gpt_lines(clean, mmsi_prefix=True, group_column="MMSI")
+    if lines is not None:
+        mmsi_values = df["MMSI"].unique()
+        starts = np.searchsorted(clean["MMSI"].to_numpy(), mmsi_values, side="left")
+        stops = np.searchsorted(clean["MMSI"].to_numpy(), mmsi_values, side="right")
+        for mmsi, start, stop in zip(mmsi_values, starts, stops):
+            yield mmsi, "\n".join(lines[start:stop])
+        return
 
-                gpt_text = vessel_df_to_gpt_format_pandas(vessel_df)
-                vessel_bytes = len(gpt_text.encode("utf-8")) + 1
+    for mmsi, vessel_df in df.groupby("MMSI"):
+        vessel_df = vessel_df.dropna()
+        # vessel_df = vessel_df.head(MAX_ROWS_PER_VESSEL)  # בטל אם לא רלוונטי
 
-                if current_size_bytes + vessel_bytes > MAX_FILE_SIZE_BYTES:
-                    output_path = os.path.join(output_folder, f"vessel_gpt_{current_file_index}.txt")
-                    with open(output_path, "w") as f:
-                        f.write("\n".join(current_lines))
-                    print(f"[SAVED] {output_path} with {len(current_lines)} vessels")
-                    current_file_index += 1
-                    current_lines = []
-                    current_size_bytes = 0
+        yield mmsi, vessel_df_to_gpt_format_pandas(vessel_df)
 
-                if vessel_bytes <= MAX_FILE_SIZE_BYTES:
-                    current_lines.append(gpt_text)
-                    current_size_bytes += vessel_bytes
-                else:
-                    print(f"[SKIPPED] Vessel {mmsi} too large ({vessel_bytes / 1e6:.2f} MB)")
 
+def convert_all_csvs_to_gpt_format_pandas(input_folder, output_folder):
+    all_files = sorted(glob(os.path.join(input_folder, "*.csv")))
+    writer = GptFileWriter(output_folder)
+
+    for file in all_files:
+        print(f"[INFO] Processing {file}")
+        try:
+            for mmsi, gpt_text in iter_file_vessels(file):
+                writer.add(mmsi, gpt_text)
         except Exception as e:
             print(f"[ERROR] Failed to process {file}: {e}")
 
-    if current_lines:
-        output_path = os.path.join(output_folder, f"vessel_gpt_{current_file_index}.txt")
-        with open(output_path, "w") as f:
-            f.write("\n".join(current_lines))
-        print(f"[FINAL SAVE] {output_path} with {len(current_lines)} vessels")
+    writer.close()
+
+
+def format_file_to_shard(task):
+    """
+    Worker: formats one vectors CSV file into a shard file (vessel texts back to back, UTF-8).
+    Returns (vessels, log) where vessels is [(mmsi, n_bytes), ...] in file order and log is
+    what the serial conversion would have printed for this file.
+    """
+    file, shard_path = task
+    vessels = []
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log), open(shard_path, "wb") as shard:
+        print(f"[INFO] Processing {file}")
+        try:
+            for mmsi, gpt_text in iter_file_vessels(file):
+                data = gpt_text.encode("utf-8")
+                shard.write(data)
+                vessels.append((int(mmsi), len(data)))
+        except Exception as e:
+            print(f"[ERROR] Failed to process {file}: {e}")
+    return vessels, log.getvalue()
+
+
+def convert_all_csvs_to_gpt_format_parallel(input_folder, output_folder, max_workers=MAX_WORKERS):
+    """
+    Same output as convert_all_csvs_to_gpt_format_pandas, but files are formatted by a process pool.
+    Each worker writes its file's vessels to a shard; shards are merged in input file order through
+    GptFileWriter, so vessel_gpt_{i}.txt files and the rollover points are identical to the serial run.
+    """
+    all_files = sorted(glob(os.path.join(input_folder, "*.csv")))
+    shard_dir = os.path.join(output_folder, SHARD_DIR_NAME)
+    shutil.rmtree(shard_dir, ignore_errors=True)
+    os.makedirs(shard_dir)
+    tasks = [(file, os.path.join(shard_dir, f"{i}.bin")) for i, file in enumerate(all_files)]
+
+    writer = GptFileWriter(output_folder)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        # map returns results in file order while later files are still being formatted
+        for (file, shard_path), (vessels, log) in zip(tasks, executor.map(format_file_to_shard, tasks)):
+            print(log, end="")
+            with open(shard_path, "rb") as shard:
+                for mmsi, n_bytes in vessels:
+                    writer.add(mmsi, shard.read(n_bytes).decode("utf-8"))
+            os.remove(shard_path)
+    writer.close()
+    shutil.rmtree(shard_dir)
 
 
 if __name__ == "__main__":
     print("[START] GPT format conversion using pandas only")
-    convert_all_csvs_to_gpt_format_pandas(INPUT_FOLDER, OUTPUT_FOLDER)
+    os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+    if MAX_WORKERS and MAX_WORKERS > 1:
+        convert_all_csvs_to_gpt_format_parallel(INPUT_FOLDER, OUTPUT_FOLDER, MAX_WORKERS)
+    else:
+        convert_all_csvs_to_gpt_format_pandas(INPUT_FOLDER, OUTPUT_FOLDER)
     print("[DONE]")
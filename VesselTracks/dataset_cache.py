@@ -0,0 +1,153 @@
+"""
+Content-addressed on-disk cache for tokenized / packed datasets.
+
+An entry is a directory named by cache_key: a hash of
+- the content of the input text (blake2b of the bytes; memoized per path / size / mtime in
+  _content_hashes.json so an unchanged multi-GB corpus is not re-read on every run)
+- the tokenizer: the full backend tokenizer state (vocab, merges, pre-tokenizer, added tokens)
+  and the special tokens
+- the build parameters given by the caller (format, lengths, split, seed, ...)
+so the key changes exactly when the cached data would. Code changes that alter the data must
+change the parameters (e.g. a "version" field); renaming a function does not invalidate anything.
+
+Entries are built into a temporary directory and renamed into place. _cache_index.json records
+size and last use; after every build the least recently used entries are deleted until the cache
+is under max_bytes (the entry just used is always kept).
+"""
+
+import glob
+import hashlib
+import json
+import os
+import shutil
+import time
+
+from run_manifest import atomic_output, file_hash, params_hash
+
+INDEX_FILE = "_cache_index.json"
+HASHES_FILE = "_content_hashes.json"
+TEMP_SUFFIX = ".tmp"
+
+
+def _load_json(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _save_json(path, data):
+    with atomic_output(path) as tmp_path:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+
+
+def directory_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def content_hash(path, cache_dir):
+    """file_hash of path, reused while its size and mtime are unchanged."""
+    memo_path = os.path.join(cache_dir, HASHES_FILE)
+    memo = _load_json(memo_path)
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    entry = memo.get(path)
+    if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+        return entry["hash"]
+    print(f"[INFO] Hashing {path} ({stat.st_size / 1e9:.2f} GB)...")
+    digest = file_hash(path)
+    memo[path] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "hash": digest}
+    _save_json(memo_path, memo)
+    return digest
+
+
+def tokenizer_hash(tokenizer):
+    backend = getattr(tokenizer, "backend_tokenizer", None)
+    state = {
+        "backend": backend.to_str() if backend is not None else sorted(tokenizer.get_vocab().items()),
+        "special_tokens": tokenizer.special_tokens_map,
+        "size": len(tokenizer),
+    }
+    data = json.dumps(state, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.blake2b(data, digest_size=20).hexdigest()
+
+
+def cache_key(text_path, tokenizer, params, cache_dir):
+    return params_hash({
+        "text": content_hash(text_path, cache_dir),
+        "tokenizer": tokenizer_hash(tokenizer),
+        "params": params,
+    })
+
+
+class DatasetCache:
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        for stale in glob.glob(os.path.join(cache_dir, f".*{TEMP_SUFFIX}")):
+            shutil.rmtree(stale, ignore_errors=True)  # builds of killed runs
+        self.index_path = os.path.join(cache_dir, INDEX_FILE)
+        self.index = _load_json(self.index_path)
+        self._sync_index()
+
+    def _sync_index(self):
+        """Drops index entries whose directory is gone and adopts directories missing from the index."""
+        for key in [k for k in self.index if not os.path.isdir(os.path.join(self.cache_dir, k))]:
+            del self.index[key]
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if os.path.isdir(path) and not name.startswith(".") and name not in self.index:
+                self.index[name] = {"size": directory_size(path), "last_used": os.path.getmtime(path),
+                                    "description": ""}
+
+    def key(self, text_path, tokenizer, params):
+        return cache_key(text_path, tokenizer, params, self.cache_dir)
+
+    def get_or_build(self, key, build, description=""):
+        """
+        Returns the entry directory for key, calling build(directory) to fill it on a miss.
+        """
+        entry_dir = os.path.join(self.cache_dir, key)
+        if key in self.index:
+            self.index[key]["last_used"] = time.time()
+            _save_json(self.index_path, self.index)
+            print(f"[CACHE] Hit {key} {description}")
+            return entry_dir
+
+        print(f"[CACHE] Miss {key} {description}, building...")
+        start_time = time.time()
+        tmp_dir = os.path.join(self.cache_dir, f".{key}{TEMP_SUFFIX}")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        try:
+            build(tmp_dir)
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        os.replace(tmp_dir, entry_dir)
+        size = directory_size(entry_dir)
+        self.index[key] = {"size": size, "last_used": time.time(), "description": description}
+        print(f"[CACHE] Built {key} ({size / 1e6:.1f} MB) in {time.time() - start_time:.2f} seconds")
+        self.evict(keep=key)
+        _save_json(self.index_path, self.index)
+        return entry_dir
+
+    def total_bytes(self):
+        return sum(entry["size"] for entry in self.index.values())
+
+    def evict(self, keep=None):
+        """Deletes least recently used entries until the cache fits in max_bytes."""
+        for key in sorted(self.index, key=lambda k: self.index[k]["last_used"]):
+            if self.total_bytes() <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+            print(f"[CACHE] Evicted {key} {self.index[key]['description']} ({self.index[key]['size'] / 1e6:.1f} MB)")
+            del self.index[key]
@@ -1,19 +1,30 @@
 import pandas as pd
 from pathlib import Path
 
+from mmsi_index import has_mmsi_index, lookup_mmsi, read_vessel_range
+
 # --- config ---
 CHUNKS_DIR = Path("/mnt/new_home/idan7/data_mining/ais_tracks_export/chunks")
+MMSI_DATASET_DIR = Path("/mnt/new_home/idan7/data_mining/ais_tracks_export/chunks_by_mmsi")  # see mmsi_index.py
 TARGET_MMSI = "367635620"  # keep as string
 OUT_CSV = Path("/mnt/new_home/idan7/data_mining/ais_tracks_export/mmsi_367635620_tracks_sorted.csv")
 
-# --- collect rows from all CSVs ---
+# --- collect rows: index lookup when the MMSI layout exists, otherwise scan all CSVs ---
 frames = []
-for csv_path in sorted(CHUNKS_DIR.glob("*.csv")):
-    df = pd.read_csv(csv_path, dtype={"MMSI": str}, low_memory=False)
-    sub = df[df["MMSI"] == TARGET_MMSI].copy()
-    if not sub.empty:
-        sub["source_file"] = csv_path.name
+if has_mmsi_index(MMSI_DATASET_DIR):
+    location = lookup_mmsi(str(MMSI_DATASET_DIR), TARGET_MMSI)
+    if location is not None:
+        sub = read_vessel_range(location)
+        sub["MMSI"] = sub["MMSI"].astype(str)
+        sub["source_file"] = Path(location[0]).name  # the vessel's partition file, as the scan names its CSV
         frames.append(sub)
+else:
+    for csv_path in sorted(CHUNKS_DIR.glob("*.csv")):
+        df = pd.read_csv(csv_path, dtype={"MMSI": str}, low_memory=False)
+        sub = df[df["MMSI"] == TARGET_MMSI].copy()
+        if not sub.empty:
+            sub["source_file"] = csv_path.name
+            frames.append(sub)
 
 if not frames:
     raise SystemExit(f"No rows found for MMSI {TARGET_MMSI} in {CHUNKS_DIR}")
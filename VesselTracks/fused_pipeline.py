@@ -0,0 +1,131 @@
+"""
+Fused pipeline: MMSI-partitioned tracks -> segments -> GPT lines -> vessel_tracks.txt in one pass.
+
+Replaces the staged run reconstruction.py (vectors_*.csv) -> csvs_to_gpt_format_parallel.py
+(vessel_gpt_*.txt) -> cleaned_data.py (vessel_tracks.txt), in which every stage writes its
+output to disk and the next stage parses it again. Here the stages are generators:
+- iter_segment_batches: partition rows in batches of batch_rows tracks -> segment tables
+- iter_vessel_segments: segment batches -> one table per vessel; only the vessel that
+  continues into the next batch is carried over, so memory is one batch plus one vessel
+- the vessel's GPT lines are appended to the routed output file as soon as it is complete
+
+Input must be an MMSI-partitioned dataset (mmsi_index.build_mmsi_partitions): its rows are
+sorted by (MMSI, TrackStartTime) and a vessel lives in exactly one partition, so every vessel
+is one route with ΔT running over the whole route (the staged run restarted ΔT in every
+vectors file a vessel appeared in). Routes are written in partition order, then by MMSI.
+
+vectors_dir / gpt_dir optionally tee the intermediate vectors_*.csv and vessel_gpt_*.txt
+files of the staged run to disk.
+"""
+
+import os
+import time
+
+from chunk_io import MULTILINE_TYPES, iter_chunk_tracks
+from csvs_to_gpt_format_parallel import MAX_FILE_SIZE_BYTES, GptFileWriter, vessel_df_to_gpt_format_pandas
+from gpt_text_format import iter_vessel_segments
+from mmsi_index import has_mmsi_index
+from run_manifest import atomic_output
+from segments import VESSEL_STATS_BY_TYPE, build_segments
+
+DATASET_DIR = "/mnt/new_home/idan7/data_mining/ais_tracks_export/mmsi_partitions/"
+OUTPUT_FILE = "/mnt/new_home/idan7/data_mining/ais_tracks_export/cleaned_data/vessel_tracks.txt"
+VECTORS_DIR = None  # e.g. ".../vectors_for_GPT_updated/" to keep the vectors_*.csv files
+GPT_DIR = None      # e.g. ".../text_for_GPT_extended/" to keep the vessel_gpt_*.txt files
+DISTANCE_METHOD = "geodesic"
+BATCH_ROWS = 50000  # tracks per batch
+
+END_OF_ROUTE = "<|endofroute|>"
+
+
+def partition_files(dataset_dir):
+    files = [f for f in os.listdir(dataset_dir)
+             if f.startswith("mmsi_part_") and f.endswith((".csv", ".parquet"))]
+    return [os.path.join(dataset_dir, f)
+            for f in sorted(files, key=lambda f: int(os.path.splitext(f)[0].rsplit("_", 1)[1]))]
+
+
+def iter_segment_batches(path, vessel_stats, distance_method, batch_rows=BATCH_ROWS, vectors_file=None):
+    """Yields the segment table of every batch of rows of a partition; tees it to vectors_file if given."""
+    header = True
+    for df, track_coords in iter_chunk_tracks(path, batch_rows, MULTILINE_TYPES):
+        segments = build_segments(df, vessel_stats, distance_method=distance_method, track_coords=track_coords)
+        if vectors_file is not None and len(segments):
+            segments.to_csv(vectors_file, index=False, header=header)
+            header = False
+        yield segments
+
+
+def vessel_gpt_text(vessel_df):
+    """GPT text of one vessel, the same lines csvs_to_gpt_format_parallel.py writes (with MMSI prefix)."""
+    vessel_df = vessel_df.dropna().sort_values(by="Segment_StartTime", kind="stable")
+    return vessel_df_to_gpt_format_pandas(vessel_df)
+
+
+def route_lines(gpt_text):
+    """Strips the MMSI prefix like cleaned_data.py does."""
+    lines = []
+    for line in gpt_text.split("\n"):
+        if "|" in line:
+            lines.append(line.split("|", 1)[1].strip())
+    return lines
+
+
+def process_partition(path, fout, vessel_stats, distance_method, batch_rows, vectors_file=None, gpt_writer=None):
+    vessels = lines_written = 0
+    segment_batches = iter_segment_batches(path, vessel_stats, distance_method, batch_rows, vectors_file)
+    for mmsi, vessel_segments in iter_vessel_segments(segment_batches):
+        gpt_text = vessel_gpt_text(vessel_segments)
+        if gpt_writer is not None:
+            gpt_writer.add(mmsi, gpt_text)
+        lines = route_lines(gpt_text)
+        if lines:
+            fout.write("\n".join(lines) + "\n" + END_OF_ROUTE + "\n")
+            vessels += 1
+            lines_written += len(lines)
+    return vessels, lines_written
+
+
+def run_fused_pipeline(dataset_dir, output_file, vessel_stats, distance_method="geodesic", batch_rows=BATCH_ROWS,
+                       vectors_dir=None, gpt_dir=None, max_file_size_bytes=MAX_FILE_SIZE_BYTES):
+    if not has_mmsi_index(dataset_dir):
+        print(f"[ERROR] {dataset_dir} is not an MMSI-partitioned dataset (run build_mmsi_partitions first).")
+        return
+
+    for folder in (os.path.dirname(os.path.abspath(output_file)), vectors_dir, gpt_dir):
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+    gpt_writer = GptFileWriter(gpt_dir, max_file_size_bytes) if gpt_dir else None
+
+    start_time = time.time()
+    total_vessels = total_lines = 0
+    files = partition_files(dataset_dir)
+    with atomic_output(output_file) as tmp_path:
+        with open(tmp_path, "w", encoding="utf-8") as fout:
+            for path in files:
+                name = os.path.splitext(os.path.basename(path))[0]
+                if vectors_dir:
+                    vectors_path = os.path.join(vectors_dir, f"vectors_{name}.csv")
+                    with atomic_output(vectors_path) as vectors_tmp:
+                        with open(vectors_tmp, "w", newline="") as vectors_file:
+                            vessels, lines = process_partition(path, fout, vessel_stats, distance_method,
+                                                               batch_rows, vectors_file, gpt_writer)
+                    if os.path.getsize(vectors_path) == 0:  # no valid vectors, like reconstruction
+                        os.remove(vectors_path)
+                else:
+                    vessels, lines = process_partition(path, fout, vessel_stats, distance_method,
+                                                       batch_rows, None, gpt_writer)
+                total_vessels += vessels
+                total_lines += lines
+                print(f"[INFO] {name}: {vessels} routes, {lines} lines.")
+    if gpt_writer is not None:
+        gpt_writer.close()
+
+    elapsed = time.time() - start_time
+    print(f"[DONE] Wrote {total_vessels} routes ({total_lines} lines) from {len(files)} partitions "
+          f"to {output_file} in {elapsed:.2f} seconds.")
+
+
+if __name__ == "__main__":
+    run_fused_pipeline(DATASET_DIR, OUTPUT_FILE, VESSEL_STATS_BY_TYPE, distance_method=DISTANCE_METHOD,
+                       batch_rows=BATCH_ROWS, vectors_dir=VECTORS_DIR, gpt_dir=GPT_DIR)
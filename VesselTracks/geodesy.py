@@ -0,0 +1,142 @@
+"""
+Vectorized distance / bearing / speed engine for consecutive AIS vertices.
+
+All functions take NumPy arrays (degrees) for whole batches of segments, e.g. every
+segment of a chunk at once, instead of one geopy call per point pair.
+
+Distance tiers (errors measured against Karney's geodesic on WGS84):
+- "geodesic":        Karney's algorithm on WGS84 (pyproj.Geod, the same algorithm geopy's
+                     geodesic() uses). Error below 15 nanometres.
+- "vincenty":        Vincenty's inverse formula on WGS84 in NumPy. Error below 0.5 mm.
+                     Returns NaN if it does not converge (only near-antipodal points).
+- "haversine":       great circle on a sphere of radius 6371008.8 m (mean Earth radius).
+                     Relative error up to 0.57% from ignoring the flattening.
+- "equirectangular": flat approximation at the mean latitude on the same sphere. Adds
+                     a relative error of under 4e-6 for segments below 10 km and under 4e-4
+                     below 100 km (|lat| < 80) on top of the haversine error.
+
+Bearings are the spherical initial bearing in [0, 360) (the formula calculate_bearing used)
+for every tier, so Bearing_Degrees does not depend on the distance tier.
+"""
+
+import numpy as np
+
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+WGS84_B = WGS84_A * (1 - WGS84_F)
+MEAN_EARTH_RADIUS_M = 6371008.8
+MS_TO_KNOTS = 1.94384
+
+DISTANCE_METHODS = ("geodesic", "vincenty", "haversine", "equirectangular")
+
+_geod = None
+
+
+def _as_float_arrays(*arrays):
+    return [np.asarray(a, dtype=np.float64) for a in arrays]
+
+
+def _wrap_lon_diff(dlon):
+    return (dlon + np.pi) % (2 * np.pi) - np.pi
+
+
+def geodesic_distance(lat1, lon1, lat2, lon2):
+    global _geod
+    if _geod is None:
+        from pyproj import Geod
+        _geod = Geod(ellps="WGS84")
+    _, _, distance = _geod.inv(lon1, lat1, lon2, lat2)
+    return np.asarray(distance, dtype=np.float64)
+
+
+def vincenty_distance(lat1, lon1, lat2, lon2, tol=1e-12, max_iter=200):
+    lat1, lon1, lat2, lon2 = np.radians(_as_float_arrays(lat1, lon1, lat2, lon2))
+    f = WGS84_F
+    L = _wrap_lon_diff(lon2 - lon1)
+    U1 = np.arctan((1 - f) * np.tan(lat1))
+    U2 = np.arctan((1 - f) * np.tan(lat2))
+    sinU1, cosU1 = np.sin(U1), np.cos(U1)
+    sinU2, cosU2 = np.sin(U2), np.cos(U2)
+
+    lam = L.copy()
+    converged = np.zeros(L.shape, dtype=bool)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for _ in range(max_iter):
+            sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+            sin_sigma = np.sqrt((cosU2 * sin_lam) ** 2 + (cosU1 * sinU2 - sinU1 * cosU2 * cos_lam) ** 2)
+            cos_sigma = sinU1 * sinU2 + cosU1 * cosU2 * cos_lam
+            sigma = np.arctan2(sin_sigma, cos_sigma)
+            sin_alpha = np.where(sin_sigma == 0, 0.0, cosU1 * cosU2 * sin_lam / sin_sigma)
+            cos2_alpha = 1 - sin_alpha ** 2
+            # equatorial lines: cos2_alpha == 0
+            cos_2sigma_m = np.where(cos2_alpha == 0, 0.0, cos_sigma - 2 * sinU1 * sinU2 / cos2_alpha)
+            C = f / 16 * cos2_alpha * (4 + f * (4 - 3 * cos2_alpha))
+            lam_prev = lam
+            lam = L + (1 - C) * f * sin_alpha * (
+                sigma + C * sin_sigma * (cos_2sigma_m + C * cos_sigma * (-1 + 2 * cos_2sigma_m ** 2))
+            )
+            converged = np.abs(lam - lam_prev) < tol
+            if converged.all():
+                break
+
+        u2 = cos2_alpha * (WGS84_A ** 2 - WGS84_B ** 2) / WGS84_B ** 2
+        A = 1 + u2 / 16384 * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+        B = u2 / 1024 * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+        delta_sigma = B * sin_sigma * (
+            cos_2sigma_m + B / 4 * (
+                cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)
+                - B / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sigma_m ** 2)
+            )
+        )
+        distance = WGS84_B * A * (sigma - delta_sigma)
+    return np.where(converged, distance, np.nan)
+
+
+def haversine_distance(lat1, lon1, lat2, lon2, radius=MEAN_EARTH_RADIUS_M):
+    lat1, lon1, lat2, lon2 = np.radians(_as_float_arrays(lat1, lon1, lat2, lon2))
+    dlon = _wrap_lon_diff(lon2 - lon1)
+    h = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * radius * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
+
+
+def equirectangular_distance(lat1, lon1, lat2, lon2, radius=MEAN_EARTH_RADIUS_M):
+    lat1, lon1, lat2, lon2 = np.radians(_as_float_arrays(lat1, lon1, lat2, lon2))
+    x = _wrap_lon_diff(lon2 - lon1) * np.cos((lat1 + lat2) / 2)
+    y = lat2 - lat1
+    return radius * np.hypot(x, y)
+
+
+_DISTANCE_FUNCTIONS = {
+    "geodesic": geodesic_distance,
+    "vincenty": vincenty_distance,
+    "haversine": haversine_distance,
+    "equirectangular": equirectangular_distance,
+}
+
+
+def segment_distances(lat1, lon1, lat2, lon2, method="geodesic"):
+    """Distance in meters between point arrays (lat1, lon1) and (lat2, lon2)."""
+    if method not in _DISTANCE_FUNCTIONS:
+        raise ValueError(f"Unknown distance method {method!r}, expected one of {DISTANCE_METHODS}")
+    return _DISTANCE_FUNCTIONS[method](lat1, lon1, lat2, lon2)
+
+
+def initial_bearings(lat1, lon1, lat2, lon2):
+    """Initial bearing in degrees [0, 360) from (lat1, lon1) to (lat2, lon2)."""
+    lat1, lon1, lat2, lon2 = _as_float_arrays(lat1, lon1, lat2, lon2)
+    dlon = np.radians(lon2 - lon1)
+    lat1, lat2 = np.radians(lat1), np.radians(lat2)
+    x = np.sin(dlon) * np.cos(lat2)
+    y = np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * np.cos(lat2) * np.cos(dlon)
+    return (np.degrees(np.arctan2(x, y)) + 360) % 360
+
+
+def segment_metrics(lat1, lon1, lat2, lon2, time_diff_sec, method="geodesic"):
+    """
+    Returns (distance_m, bearing_deg, speed_knots) arrays for a batch of segments.
+    time_diff_sec is the segment duration, a scalar or one value per segment.
+    """
+    distance = segment_distances(lat1, lon1, lat2, lon2, method)
+    bearing = initial_bearings(lat1, lon1, lat2, lon2)
+    speed_knots = distance * MS_TO_KNOTS / np.asarray(time_diff_sec, dtype=np.float64)
+    return distance, bearing, speed_knots
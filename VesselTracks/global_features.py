@@ -1,15 +1,17 @@
 import pandas as pd
 import os
 
+from chunk_io import read_chunk_attributes
+
 def compute_vesseltype_stats_from_folder(input_dir, output_txt):
     all_chunks = []
 
     # Collect all CSV files from directory
     for file in os.listdir(input_dir):
-        if file.endswith('.csv'):
+        if file.endswith(('.csv', '.parquet')):
             file_path = os.path.join(input_dir, file)
             try:
-                df = pd.read_csv(file_path, usecols=['VesselType', 'Length', 'Width', 'Draft'])
+                df = read_chunk_attributes(file_path, columns=['VesselType', 'Length', 'Width', 'Draft'])
                 df = df.dropna()
                 all_chunks.append(df)
                 print(f"[INFO] Loaded: {file}")
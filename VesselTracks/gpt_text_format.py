@@ -0,0 +1,161 @@
+"""
+Vectorized rendering of segment tables into GPT training lines.
+
+One line per segment:
+    [MMSI:<mmsi> | ]INPUT: LAT:<lat> LON:<lon> SPD:<spd> BRG:<brg> ΔT:<sec> | OUTPUT: LAT:<lat> LON:<lon> |
+with 4-decimal floats and ΔT the whole seconds (truncated) since the previous segment of the
+same vessel (0 for its first segment).
+
+The row loops in csvs_to_gpt_format.py / csvs_to_gpt_format_parallel.py build every line
+with f-strings and a Python prev_time variable. Here ΔT is a grouped diff of the parsed
+timestamps and every field is formatted for the whole column at once, then the columns are
+concatenated. format_gpt_lines returns None for inputs the row loops treat specially
+(unparseable / missing timestamps, non-numeric values); callers fall back to their row loop,
+so the output is always identical.
+
+The parsing side (test_gpt.py, rollout.py) is here too: parse_line reads a training line back,
+row_to_prompt renders the INPUT part used as a rollout prompt, POINT_RE / extract_points pull the
+LAT/LON pairs out of generated text. iter_vessel_segments groups an MMSI-sorted stream of
+segment batches into vessels for the streaming converters.
+"""
+
+import re
+
+import numpy as np
+import pandas as pd
+
+FLOAT_COLUMNS = ["Start_Lat", "Start_Lon", "Speed_Knots", "Bearing_Degrees", "End_Lat", "End_Lon"]
+
+
+def _parse_times(values):
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values
+    try:
+        # the row loops call pd.to_datetime per value; a column with mixed formats / offsets
+        # raises here and goes back to them
+        return pd.to_datetime(values)
+    except (ValueError, TypeError):
+        return None
+
+
+def delta_t_seconds(times, groups=None):
+    """
+    Whole seconds between consecutive timestamps, truncated toward zero like
+    int(Timedelta.total_seconds()); 0 at the first row of every group (consecutive equal values of groups).
+    """
+    times = pd.Series(pd.DatetimeIndex(times))
+    seconds = times.diff().dt.total_seconds().to_numpy(copy=True)
+    first = np.zeros(len(times), dtype=bool)
+    first[:1] = True
+    if groups is not None:
+        groups = np.asarray(groups)
+        first[1:] |= groups[1:] != groups[:-1]
+    seconds[first] = 0.0
+    return np.trunc(seconds).astype(np.int64)
+
+
+def _fmt(values):
+    return np.char.mod("%.4f", values)
+
+
+def format_gpt_lines(df, mmsi_prefix=True, group_column=None, time_column="Segment_StartTime"):
+    """
+    Returns a NumPy array with the GPT line of every row of df (in df order), or None if df
+    needs the row-by-row formatter. ΔT runs over all rows of df (one vessel) or, with
+    group_column (e.g. "MMSI" for a whole MMSI-sorted file), restarts at every change of it.
+    """
+    required = FLOAT_COLUMNS + [time_column] + (["MMSI"] if mmsi_prefix else [])
+    if any(c not in df.columns for c in required):
+        return None
+    if len(df) == 0:
+        return np.array([], dtype=str)
+    times = _parse_times(df[time_column])
+    if times is None or pd.isna(times).any():
+        return None
+    for column in FLOAT_COLUMNS:
+        if not pd.api.types.is_numeric_dtype(df[column]):
+            return None
+
+    start_lat, start_lon, spd, brg, end_lat, end_lon = (
+        _fmt(df[c].to_numpy(dtype=np.float64)) for c in FLOAT_COLUMNS
+    )
+
+    delta_t = delta_t_seconds(times, None if group_column is None else df[group_column].to_numpy())
+    if mmsi_prefix:
+        if not pd.api.types.is_numeric_dtype(df["MMSI"]):
+            return None
+        mmsi = df["MMSI"].to_numpy(dtype=np.float64)
+        if not np.isfinite(mmsi).all():
+            return None
+        prefix = np.char.add(np.char.add("MMSI:", np.trunc(mmsi).astype(np.int64).astype(str)), " | INPUT: LAT:")
+    else:
+        prefix = np.full(len(df), "INPUT: LAT:")
+
+    parts = [
+        prefix, start_lat, " LON:", start_lon, " SPD:", spd, " BRG:", brg,
+        " ΔT:", delta_t.astype(str), " | OUTPUT: LAT:", end_lat, " LON:", end_lon, " |",
+    ]
+    lines = parts[0]
+    for part in parts[1:]:
+        lines = np.char.add(lines, part)
+    return lines
+
+
+LINE_RE = re.compile(
+    r"MMSI:(\d+)\s+\|\s+INPUT:\s+LAT:([-\d.]+)\s+LON:([-\d.]+)\s+SPD:([-\d.]+)\s+BRG:([-\d.]+)\s+ΔT:(\d+)\s+\|\s+OUTPUT:\s+LAT:([-\d.]+)\s+LON:([-\d.]+)"
+)
+# תופס גם INPUT וגם PUT, ומחלץ LAT ו-LON כ-float
+POINT_RE = re.compile(r"(?:INPUT|PUT):\s*LAT:([-]?\d+(?:\.\d+)?)\s*LON:([-]?\d+(?:\.\d+)?)", re.IGNORECASE)
+
+
+def parse_line(line):
+    """Fields of an "MMSI:<id> | INPUT: ... | OUTPUT: ..." line, or None."""
+    match = LINE_RE.search(line)
+    if match is None:
+        return None
+    return {
+        "MMSI": int(match.group(1)),
+        "LAT": float(match.group(2)),
+        "LON": float(match.group(3)),
+        "SPD": float(match.group(4)),
+        "BRG": float(match.group(5)),
+        "DeltaT": int(match.group(6)),
+        "OUT_LAT": float(match.group(7)),
+        "OUT_LON": float(match.group(8)),
+    }
+
+
+def row_to_prompt(row):
+    return f"INPUT: LAT:{row['LAT']:.4f} LON:{row['LON']:.4f} SPD:{row['SPD']:.4f} BRG:{row['BRG']:.4f} ΔT:{row['DeltaT']} |"
+
+
+def normalize_predicted_line(line):
+    """One clean "INPUT: ... |" line from a generated line (which may start with a cut "PUT:")."""
+    line = re.sub(r"^\s*(?:IN)?PUT:", "INPUT:", line.strip())
+    return line.split("|")[0].strip() + " |"
+
+
+def extract_points(text):
+    """(lon, lat) of every INPUT/PUT LAT/LON pair in text, WKT order."""
+    return [(float(m.group(2)), float(m.group(1))) for m in POINT_RE.finditer(text)]
+
+
+def iter_vessel_segments(segment_batches):
+    """
+    Yields (mmsi, rows) per vessel from batches of MMSI-sorted rows (segment tables, partition
+    rows); a vessel that continues into the next batch is yielded once, complete.
+    """
+    pending = None
+    for segments in segment_batches:
+        if pending is not None:
+            segments = pd.concat([pending, segments], ignore_index=True)
+        if not len(segments):
+            continue
+        mmsi = segments["MMSI"].to_numpy()
+        starts = np.concatenate([[0], np.flatnonzero(mmsi[1:] != mmsi[:-1]) + 1])
+        for start, stop in zip(starts[:-1], starts[1:]):
+            yield mmsi[start], segments.iloc[start:stop]
+        # the last vessel may continue in the next batch
+        pending = segments.iloc[starts[-1]:]
+    if pending is not None and len(pending):
+        yield pending["MMSI"].iloc[0], pending
@@ -0,0 +1,195 @@
+"""
+MMSI-partitioned chunk layout with a persistent MMSI -> (file, range) index.
+
+build_mmsi_partitions re-lays the chunk files (ais_chunk_*.csv or ais_chunk_*.parquet)
+into mmsi_part_{p}.<format> files, hash-partitioned by MMSI and sorted by
+(MMSI, TrackStartTime), and writes mmsi_index.sqlite next to them.
+- CSV partitions: the index stores the byte range of the vessel's rows.
+- Parquet partitions: the index stores the row range; partitions are written with small
+  row groups so a lookup reads only the row groups that overlap the range.
+
+load_vessel_tracks fetches one vessel's rows with a single index query instead of a
+scan over the whole corpus.
+"""
+
+import os
+import shutil
+import sqlite3
+import time
+from contextlib import closing
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from chunk_io import GEOMETRY_COLUMN, read_csv_byte_range, table_tracks, track_coords_to_geometries
+
+INDEX_FILE = "mmsi_index.sqlite"
+SORT_COLUMNS = ["MMSI", "TrackStartTime"]
+
+
+def _chunk_files(input_dir, chunk_format):
+    return sorted(f for f in os.listdir(input_dir) if f.endswith(f".{chunk_format}"))
+
+
+def _partition_of(mmsi, n_partitions):
+    # MMSIs are 9-digit ids whose low digits are close to uniform
+    return np.asarray(mmsi, dtype=np.int64) % n_partitions
+
+
+def _scatter_chunk(path, staging_dir, n_partitions, chunk_format):
+    name = os.path.splitext(os.path.basename(path))[0]
+    if chunk_format == "parquet":
+        table = pq.read_table(path)
+        mmsi = table.column("MMSI")
+        valid = pc.is_valid(mmsi)
+        if pa.types.is_floating(mmsi.type):
+            valid = pc.and_(valid, pc.invert(pc.is_nan(mmsi)))
+        # rows without MMSI are dropped and MMSI made int64, as on the CSV path (a chunk with
+        # missing MMSIs was written as float64, and the partition's pieces must share one schema)
+        table = table.filter(valid)
+        table = table.set_column(table.schema.get_field_index("MMSI"), "MMSI", pc.cast(table.column("MMSI"), pa.int64()))
+        partitions = _partition_of(table.column("MMSI").to_numpy(), n_partitions)
+        for p in np.unique(partitions):
+            part_dir = os.path.join(staging_dir, str(p))
+            os.makedirs(part_dir, exist_ok=True)
+            pq.write_table(table.filter(pa.array(partitions == p)), os.path.join(part_dir, f"{name}.parquet"))
+    else:
+        df = pd.read_csv(path)
+        df = df.dropna(subset=["MMSI"])
+        for p, part in df.groupby(_partition_of(df["MMSI"], n_partitions)):
+            part_dir = os.path.join(staging_dir, str(p))
+            os.makedirs(part_dir, exist_ok=True)
+            part.to_csv(os.path.join(part_dir, f"{name}.csv"), index=False)
+
+
+def _gather_csv_partition(part_dir, output_path):
+    files = sorted(os.listdir(part_dir))
+    df = pd.concat([pd.read_csv(os.path.join(part_dir, f)) for f in files], ignore_index=True)
+    df["MMSI"] = df["MMSI"].astype("int64")
+    df = df.sort_values(SORT_COLUMNS, kind="stable")
+
+    entries = []
+    with open(output_path, "wb") as f:
+        f.write(df.iloc[:0].to_csv(index=False).encode("utf-8"))
+        for mmsi, vessel_df in df.groupby("MMSI", sort=False):
+            data = vessel_df.to_csv(index=False, header=False).encode("utf-8")
+            start = f.tell()
+            f.write(data)
+            entries.append((int(mmsi), start, start + len(data), len(vessel_df)))
+    return entries
+
+
+def _gather_parquet_partition(part_dir, output_path, row_group_size):
+    files = sorted(os.listdir(part_dir))
+    # pieces of different chunks can differ in column types (a nullable int column with nulls is
+    # float64 in one chunk, an all-null column is type null), so they are promoted to one schema
+    table = pa.concat_tables(
+        [pq.read_table(os.path.join(part_dir, f)) for f in files], promote_options="permissive"
+    )
+    table = table.sort_by([(c, "ascending") for c in SORT_COLUMNS])
+    pq.write_table(table, output_path, row_group_size=row_group_size, compression="zstd")
+
+    mmsi = table.column("MMSI").to_numpy()
+    values, starts, counts = np.unique(mmsi, return_index=True, return_counts=True)
+    return [(int(m), int(s), int(s + c), int(c)) for m, s, c in zip(values, starts, counts)]
+
+
+def build_mmsi_partitions(input_dir, output_dir, n_partitions=256, chunk_format="csv", row_group_size=1000):
+    """
+    Re-lays the chunk files of input_dir into MMSI partitions in output_dir and builds the index.
+    A vessel always lands in exactly one partition.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    staging_dir = os.path.join(output_dir, "_staging")
+    shutil.rmtree(staging_dir, ignore_errors=True)
+    os.makedirs(staging_dir)
+    start_time = time.time()
+
+    chunk_files = _chunk_files(input_dir, chunk_format)
+    if not chunk_files:
+        print(f"[WARNING] No .{chunk_format} chunk files in {input_dir}; the index will be empty.")
+    for filename in chunk_files:
+        print(f"[INFO] Partitioning {filename} ...")
+        _scatter_chunk(os.path.join(input_dir, filename), staging_dir, n_partitions, chunk_format)
+
+    index_path = os.path.join(output_dir, INDEX_FILE)
+    if os.path.exists(index_path):
+        os.remove(index_path)
+    con = sqlite3.connect(index_path)
+    con.execute(
+        "CREATE TABLE vessels (mmsi INTEGER PRIMARY KEY, file TEXT, start INTEGER, stop INTEGER, rows INTEGER)"
+    )
+    con.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+    con.execute("INSERT INTO meta VALUES ('format', ?)", (chunk_format,))
+
+    for p in sorted(os.listdir(staging_dir), key=int):
+        output_name = f"mmsi_part_{p}.{chunk_format}"
+        output_path = os.path.join(output_dir, output_name)
+        part_dir = os.path.join(staging_dir, p)
+        if chunk_format == "parquet":
+            entries = _gather_parquet_partition(part_dir, output_path, row_group_size)
+        else:
+            entries = _gather_csv_partition(part_dir, output_path)
+        con.executemany(
+            "INSERT INTO vessels VALUES (?, ?, ?, ?, ?)",
+            [(mmsi, output_name, start, stop, rows) for mmsi, start, stop, rows in entries],
+        )
+        print(f"[INFO] Saved {output_name} with {len(entries)} vessels.")
+
+    con.commit()
+    con.close()
+    shutil.rmtree(staging_dir)
+
+    elapsed = time.time() - start_time
+    print(f"[DONE] Partitioned {len(chunk_files)} chunks in {elapsed:.2f} seconds. Index: {index_path}")
+
+
+def lookup_mmsi(dataset_dir, mmsi):
+    """Returns (file_path, start, stop, rows) for a vessel, or None if it is not in the index."""
+    with closing(sqlite3.connect(f"file:{os.path.join(dataset_dir, INDEX_FILE)}?mode=ro", uri=True)) as con:
+        row = con.execute("SELECT file, start, stop, rows FROM vessels WHERE mmsi = ?", (int(mmsi),)).fetchone()
+    if row is None:
+        return None
+    return (os.path.join(dataset_dir, row[0]),) + tuple(row[1:])
+
+
+def _read_parquet_range(path, start, stop):
+    pf = pq.ParquetFile(path)
+    row_groups, first_row, row = [], None, 0
+    for i in range(pf.metadata.num_row_groups):
+        n = pf.metadata.row_group(i).num_rows
+        if row < stop and row + n > start:
+            row_groups.append(i)
+            first_row = row if first_row is None else first_row
+        row += n
+    table = pf.read_row_groups(row_groups).slice(start - first_row, stop - start)
+
+    df, track_coords, _ = table_tracks(table, geometry_types=None)  # all rows, as on the CSV path
+    df[GEOMETRY_COLUMN] = track_coords_to_geometries(track_coords)
+    return df
+
+
+def read_vessel_range(location):
+    """Reads the rows of a lookup_mmsi location (file_path, start, stop, rows)."""
+    path, start, stop, _ = location
+    if path.endswith(".parquet"):
+        return _read_parquet_range(path, start, stop)
+    return read_csv_byte_range(path, start, stop)
+
+
+def load_vessel_tracks(dataset_dir, mmsi):
+    """
+    Returns the rows of one vessel from an MMSI-partitioned dataset, sorted by TrackStartTime.
+    Parquet rows get shapely MultiLineStrings in the geometry column. Empty if unknown.
+    """
+    location = lookup_mmsi(dataset_dir, mmsi)
+    if location is None:
+        return pd.DataFrame()
+    return read_vessel_range(location)
+
+
+def has_mmsi_index(dataset_dir):
+    return os.path.exists(os.path.join(dataset_dir, INDEX_FILE))
@@ -0,0 +1,247 @@
+"""
+Long-lived local prediction service (asyncio, standard library HTTP/1.1 over TCP or a Unix socket).
+
+The model and tokenizer are loaded once. Requests:
+    POST /predict   {"seed": ["INPUT: LAT:.. LON:.. SPD:.. BRG:.. ΔT:.. |", ...], "n_steps": 10}
+                    (or "seed_text" with one line per segment)
+                    -> {"points": [[lat, lon] or null, ...], "latency_ms": ..., "batch_size": ...}
+    GET  /stats     queue depth, batches, mean batch size, latency / queue wait percentiles
+    GET  /health
+
+Concurrent requests are coalesced into micro-batches: the batcher takes the first queued request
+and waits at most MAX_WAIT_MS for more (up to MAX_BATCH). The batch is grouped by n_steps
+rounded up to a power of two and every group runs one BatchPredictor rollout (batch_inference.py)
+with its largest n_steps, shortest groups first, so a 1-step request doesn't wait for a 100-step
+rollout. Rollouts run in a worker thread so the event loop keeps accepting.
+Generation settings (grammar, sampling) are fixed for the server.
+"""
+
+import asyncio
+import json
+import time
+from collections import deque
+from http import HTTPStatus
+
+import numpy as np
+
+from batch_inference import BatchPredictor
+
+model_path = "/mnt/new_home/idan7/data_mining/ais_tracks_export/"
+HOST = "127.0.0.1"
+PORT = 8765
+UNIX_SOCKET = None  # e.g. "/tmp/vessel_predict.sock" instead of HOST:PORT
+MAX_BATCH = 32
+MAX_WAIT_MS = 20
+MAX_STEPS = 100
+LATENCY_WINDOW = 1000  # requests kept for the percentiles
+GENERATE_KWARGS = {"do_sample": False}
+
+
+class PredictionServer:
+    def __init__(self, predictor, max_batch=MAX_BATCH, max_wait_ms=MAX_WAIT_MS, generate_kwargs=None):
+        self.predictor = predictor
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.generate_kwargs = dict(GENERATE_KWARGS if generate_kwargs is None else generate_kwargs)
+        self.queue = None
+        self.started_at = time.time()
+        self.stats = {"requests": 0, "errors": 0, "batches": 0, "batched_requests": 0}
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.queue_waits = deque(maxlen=LATENCY_WINDOW)
+        self.batch_seconds = deque(maxlen=LATENCY_WINDOW)
+
+    # --- batching ---
+    async def _next_batch(self):
+        batch = [await self.queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    @staticmethod
+    def _step_groups(batch):
+        """Items grouped by n_steps rounded up to a power of two, shortest group first."""
+        groups = {}
+        for item in batch:
+            groups.setdefault(1 << (item["n_steps"] - 1).bit_length(), []).append(item)
+        return [groups[key] for key in sorted(groups)]
+
+    def _run_batch(self, batch):
+        windows = {i: item["seed"] for i, item in enumerate(batch)}
+        n_steps = max(item["n_steps"] for item in batch)
+        return self.predictor.predict(windows, n_steps=n_steps, verbose=False, **self.generate_kwargs)
+
+    async def _run_group(self, loop, batch):
+        started = time.perf_counter()
+        for item in batch:
+            self.queue_waits.append(started - item["received"])
+        try:
+            results = await loop.run_in_executor(None, self._run_batch, batch)
+        except Exception as e:  # reported to every request of the group
+            for item in batch:
+                if not item["future"].done():
+                    item["future"].set_exception(e)
+            return
+        self.batch_seconds.append(time.perf_counter() - started)
+        self.stats["batches"] += 1
+        self.stats["batched_requests"] += len(batch)
+        for i, item in enumerate(batch):
+            if not item["future"].done():
+                item["future"].set_result((results[i][:item["n_steps"]], len(batch)))
+
+    async def batcher(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            for group in self._step_groups(await self._next_batch()):
+                await self._run_group(loop, group)
+
+    async def predict(self, seed, n_steps):
+        future = asyncio.get_running_loop().create_future()
+        received = time.perf_counter()
+        await self.queue.put({"seed": seed, "n_steps": n_steps, "received": received, "future": future})
+        points, batch_size = await future
+        latency = time.perf_counter() - received
+        self.latencies.append(latency)
+        return {
+            "points": [None if np.isnan(p).any() else [float(p[0]), float(p[1])] for p in points],
+            "latency_ms": round(latency * 1000, 2),
+            "batch_size": batch_size,
+        }
+
+    def report(self):
+        def percentiles(values):
+            if not values:
+                return None
+            ms = np.asarray(values) * 1000
+            return {f"p{q}": round(float(np.percentile(ms, q)), 2) for q in (50, 90, 99)}
+
+        batches = self.stats["batches"]
+        return {
+            **self.stats,
+            "queue_depth": self.queue.qsize() if self.queue is not None else 0,
+            "mean_batch_size": round(self.stats["batched_requests"] / batches, 2) if batches else None,
+            "latency_ms": percentiles(self.latencies),
+            "queue_wait_ms": percentiles(self.queue_waits),
+            "batch_ms": percentiles(self.batch_seconds),
+            "uptime_seconds": round(time.time() - self.started_at, 1),
+        }
+
+    # --- HTTP ---
+    @staticmethod
+    def _parse_request(body):
+        request = json.loads(body or b"{}")
+        if not isinstance(request, dict):
+            raise ValueError("the request body must be a JSON object")
+        seed = request.get("seed")
+        if seed is None and "seed_text" in request:
+            if not isinstance(request["seed_text"], str):
+                raise ValueError("'seed_text' must be a string")
+            seed = [line.strip() for line in request["seed_text"].split("\n") if line.strip()]
+        if not isinstance(seed, list) or not seed or not all(isinstance(line, str) for line in seed):
+            raise ValueError("'seed' must be a non-empty list of lines (or 'seed_text')")
+        n_steps = int(request.get("n_steps", 10))
+        if not 1 <= n_steps <= MAX_STEPS:
+            raise ValueError(f"'n_steps' must be between 1 and {MAX_STEPS}")
+        return seed, n_steps
+
+    async def _respond(self, method, path, body):
+        if method == "GET" and path == "/health":
+            return 200, {"status": "ok"}
+        if method == "GET" and path == "/stats":
+            return 200, self.report()
+        if method == "POST" and path == "/predict":
+            self.stats["requests"] += 1
+            try:
+                seed, n_steps = self._parse_request(body)
+            except (ValueError, TypeError) as e:
+                self.stats["errors"] += 1
+                return 400, {"error": str(e)}
+            try:
+                return 200, await self.predict(seed, n_steps)
+            except Exception as e:
+                self.stats["errors"] += 1
+                return 500, {"error": f"{type(e).__name__}: {e}"}
+        return 404, {"error": f"no route {method} {path}"}
+
+    @staticmethod
+    async def _send(writer, status, payload, keep_alive):
+        data = json.dumps(payload, allow_nan=False).encode("utf-8")
+        writer.write(
+            f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n"
+            f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + data
+        )
+        await writer.drain()
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                parts = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                if len(parts) != 3:
+                    await self._send(writer, 400, {"error": "malformed request line"}, keep_alive=False)
+                    break
+                try:
+                    length = int(headers.get("content-length", 0))
+                    if length < 0:
+                        raise ValueError
+                except ValueError:
+                    # the body can't be skipped without its length: answer and close
+                    await self._send(writer, 400, {"error": "invalid Content-Length"}, keep_alive=False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+
+                method, path, _ = parts
+                status, payload = await self._respond(method.upper(), path.split("?", 1)[0], body)
+                keep_alive = headers.get("connection", "").lower() != "close"
+                await self._send(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host=HOST, port=PORT, unix_socket=UNIX_SOCKET):
+        self.queue = asyncio.Queue()
+        batcher = asyncio.create_task(self.batcher())
+        if unix_socket:
+            server = await asyncio.start_unix_server(self.handle_connection, path=unix_socket)
+            where = unix_socket
+        else:
+            server = await asyncio.start_server(self.handle_connection, host, port)
+            where = f"http://{host}:{server.sockets[0].getsockname()[1]}"
+        print(f"[INFO] Prediction server listening on {where} "
+              f"(micro-batches of up to {self.max_batch}, max wait {self.max_wait * 1000:.0f} ms)")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+
+
+if __name__ == "__main__":
+    from transformers import AutoTokenizer
+
+    from constrained_decoding import INPUT_GRAMMAR, TrajectoryGrammar
+    from quantized_model import load_inference_model
+
+    tokenizer = AutoTokenizer.from_pretrained(model_path)
+    model = load_inference_model(model_path)  # int8 if model_path is a quantized_model.py export
+    predictor = BatchPredictor(model, tokenizer, batch_size=MAX_BATCH, grammar=TrajectoryGrammar(tokenizer, INPUT_GRAMMAR))
+    asyncio.run(PredictionServer(predictor).serve())
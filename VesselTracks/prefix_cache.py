@@ -0,0 +1,97 @@
+"""
+LRU cache of encoded prompt prefixes (KV cache) shared across generations.
+
+Sampled futures for one vessel (Monte-Carlo rollouts, reruns with another temperature) all start
+from the same seed window. PrefixCache keeps the key/value tensors of encoded token prefixes,
+keyed by a hash of the token ids:
+- lookup(ids) finds the longest cached prefix of ids and returns (length, DynamicCache), so only
+  ids[length:] still has to be encoded; the returned cache is a copy, generation may extend it
+- store(ids, cache) keeps a copy of the first len(ids) positions of cache
+- once the entries take more than max_bytes the least recently used ones are evicted
+
+Entries are only valid for the model that computed them: one PrefixCache per model.
+A model needs at least one new token to produce logits, so before generate look up ids[:-1].
+"""
+
+import hashlib
+from collections import Counter, OrderedDict
+
+import numpy as np
+import torch
+from transformers import DynamicCache
+
+MAX_BYTES = 1024 ** 3
+
+
+def _token_list(ids):
+    return ids.tolist() if isinstance(ids, torch.Tensor) else [int(i) for i in ids]
+
+
+class PrefixCache:
+    def __init__(self, max_bytes=MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # hash -> (token ids, [(keys, values) per layer], bytes)
+        self.lengths = Counter()  # prefix lengths held, longest tried first
+        self.size = 0
+        self.stats = {"hits": 0, "misses": 0, "reused_tokens": 0, "stored": 0, "evictions": 0}
+
+    @staticmethod
+    def key(ids):
+        return hashlib.sha1(np.asarray(ids, dtype=np.int64).tobytes()).hexdigest()
+
+    def lookup(self, ids):
+        """(length, DynamicCache of ids[:length]) for the longest cached prefix, or (0, None)."""
+        ids = _token_list(ids)
+        for length in sorted(self.lengths, reverse=True):
+            if length > len(ids):
+                continue
+            key = self.key(ids[:length])
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != tuple(ids[:length]):
+                continue
+            self.entries.move_to_end(key)
+            self.stats["hits"] += 1
+            self.stats["reused_tokens"] += length
+            cache = DynamicCache()
+            for layer_idx, (keys, values) in enumerate(entry[1]):
+                cache.update(keys.clone(), values.clone(), layer_idx)
+            return length, cache
+        self.stats["misses"] += 1
+        return 0, None
+
+    def store(self, ids, cache):
+        ids = _token_list(ids)
+        length = len(ids)
+        if length == 0 or cache.get_seq_length() < length:
+            return
+        key = self.key(ids)
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return
+        layers = [(layer.keys[..., :length, :].clone(), layer.values[..., :length, :].clone())
+                  for layer in cache.layers]
+        size = sum(k.numel() * k.element_size() + v.numel() * v.element_size() for k, v in layers)
+        if size > self.max_bytes:
+            return
+        self.entries[key] = (tuple(ids), layers, size)
+        self.lengths[length] += 1
+        self.size += size
+        self.stats["stored"] += 1
+        while self.size > self.max_bytes:
+            self._evict()
+
+    def _evict(self):
+        _, (ids, _, size) = self.entries.popitem(last=False)
+        self.lengths[len(ids)] -= 1
+        if not self.lengths[len(ids)]:
+            del self.lengths[len(ids)]
+        self.size -= size
+        self.stats["evictions"] += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.lengths.clear()
+        self.size = 0
+
+    def report(self):
+        return {**self.stats, "entries": len(self.entries), "megabytes": round(self.size / 1024 ** 2, 1)}
@@ -1,17 +1,28 @@
 import pandas as pd
 import os
 
+from mmsi_index import has_mmsi_index, load_vessel_tracks
+
 # הגדרת הפרמטרים
 input_folder = r"/mnt/new_home/idan7/data_mining/ais_tracks_export/chunks/"
 output_file = "/mnt/new_home/idan7/data_mining/filtered_mmsi_357455000.csv"
+mmsi_dataset_dir = "/mnt/new_home/idan7/data_mining/ais_tracks_export/chunks_by_mmsi/"  # see mmsi_index.py
 target_mmsi = 357455000
 
-# מציאת כל קובצי CSV בתיקייה
-csv_files = [file for file in os.listdir(input_folder) if file.endswith(".csv")]
-print(csv_files)
 # רשימה לאגירת התוצאות
 filtered_rows = []
 
+# חיפוש ישיר באינדקס MMSI אם קיים, אחרת מעבר על כל הקבצים
+if has_mmsi_index(mmsi_dataset_dir):
+    filtered = load_vessel_tracks(mmsi_dataset_dir, target_mmsi)
+    csv_files = []
+    if not filtered.empty:
+        filtered_rows.append(filtered)
+else:
+    # מציאת כל קובצי CSV בתיקייה
+    csv_files = [file for file in os.listdir(input_folder) if file.endswith(".csv")]
+    print(csv_files)
+
 # מעבר על כל הקבצים
 for file in csv_files:
     file_path = os.path.join(input_folder, file)
@@ -0,0 +1,268 @@
+"""
+CPU inference mode: dynamic int8 quantization, memory-mapped safetensors load, accuracy check.
+
+export_quantized(model_dir, out_dir):
+- GPT-2's Conv1D layers (attention / MLP projections) are turned into nn.Linear and every Linear
+  (lm_head included unless QUANTIZE_LM_HEAD is off) is dynamically quantized to int8 with
+  per-output-channel scales (activations are quantized on the fly, per batch)
+- the int8 weights, scales and zero points and the remaining float tensors (embeddings,
+  LayerNorms, biases) go into one model_int8.safetensors; config and tokenizer next to it
+
+load_quantized(out_dir) builds the model skeleton with its parameters on the meta device (no random
+init; buffers stay on the CPU, non-persistent ones like GPT-2's causal mask are not exported), maps
+the safetensors file and uses the float tensors in place (copy-on-write mmap: workers on one node
+share the pages of the embeddings), and repacks the int8 weights for the quantized kernels.
+load_inference_model(path) picks int8 or the fp32 checkpoint by what is in the directory.
+
+compare_models runs the same greedy, grammar-constrained rollouts (batch_inference.py) with the
+fp32 and the int8 model and reports the geodesic error (geodesy.py, WGS84) of both against the
+real next positions and between the two, with load time, rollout time and the RSS of each model.
+Every model runs in a fresh (spawned) process, so one model's freed heap does not hide the next one's.
+"""
+
+import json
+import mmap
+import multiprocessing
+import os
+import resource
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import torch
+from accelerate import init_empty_weights
+from safetensors.torch import save_file
+from torch import nn
+from torch.ao.nn.quantized.dynamic import Linear as DynamicQuantizedLinear
+from torch.ao.quantization import per_channel_dynamic_qconfig, quantize_dynamic
+from transformers import AutoConfig, AutoModelForCausalLM, AutoTokenizer
+from transformers.pytorch_utils import Conv1D
+
+from batch_inference import BatchPredictor, seed_windows
+from constrained_decoding import INPUT_GRAMMAR, TrajectoryGrammar
+from geodesy import geodesic_distance
+from gpt_text_format import parse_line
+
+model_path = "/mnt/new_home/idan7/data_mining/ais_tracks_export/"
+int8_path = "/mnt/new_home/idan7/data_mining/ais_tracks_export/int8/"
+check_shard = "/mnt/new_home/idan7/data_mining/ais_tracks_export/text_for_GPT_extended/vessel_gpt_1.txt"
+
+QUANTIZED_FILE = "model_int8.safetensors"
+QUANTIZE_LM_HEAD = True
+
+SAFETENSORS_DTYPES = {
+    "F64": torch.float64, "F32": torch.float32, "F16": torch.float16, "BF16": torch.bfloat16,
+    "I64": torch.int64, "I32": torch.int32, "I16": torch.int16, "I8": torch.int8, "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+
+
+def _set_module(model, name, module):
+    parent_name, _, child = name.rpartition(".")
+    setattr(model.get_submodule(parent_name) if parent_name else model, child, module)
+
+
+def conv1d_to_linear(model):
+    """Replaces transformers Conv1D (weight in x out) with the equivalent nn.Linear."""
+    for name, module in list(model.named_modules()):
+        if isinstance(module, Conv1D):
+            n_in, n_out = module.weight.shape
+            linear = nn.Linear(n_in, n_out, device=module.weight.device, dtype=module.weight.dtype)
+            if module.weight.device.type != "meta":
+                linear.weight.data = module.weight.data.t().contiguous()
+                linear.bias.data = module.bias.data
+            _set_module(model, name, linear)
+    return model
+
+
+def quantize_model(model, quantize_lm_head=QUANTIZE_LM_HEAD):
+    model = conv1d_to_linear(model.float().eval())
+    if not quantize_lm_head:
+        names = {name for name, module in model.named_modules() if isinstance(module, nn.Linear) and name != "lm_head"}
+        return quantize_dynamic(model, {name: per_channel_dynamic_qconfig for name in names}, dtype=torch.qint8)
+    return quantize_dynamic(model, {nn.Linear: per_channel_dynamic_qconfig}, dtype=torch.qint8)
+
+
+def export_quantized(model_dir, out_dir, quantize_lm_head=QUANTIZE_LM_HEAD):
+    start_time = time.time()
+    model = AutoModelForCausalLM.from_pretrained(model_dir)
+    qmodel = quantize_model(model, quantize_lm_head)
+
+    tensors, quantized = {}, []
+    for name, module in qmodel.named_modules():
+        if isinstance(module, DynamicQuantizedLinear):
+            weight, bias = module._packed_params._weight_bias()
+            tensors[f"{name}.weight_int8"] = weight.int_repr().contiguous()
+            tensors[f"{name}.weight_scale"] = weight.q_per_channel_scales().contiguous()
+            tensors[f"{name}.weight_zero_point"] = weight.q_per_channel_zero_points().contiguous()
+            if bias is not None:
+                tensors[f"{name}.bias"] = bias.detach().contiguous()
+            quantized.append(name)
+    quantized_set = set(quantized)
+    tied = model.config.tie_word_embeddings and "lm_head" not in quantized_set
+    for key, value in qmodel.state_dict().items():
+        module_name = key.rsplit(".", 1)[0]
+        if "_packed_params" in key or module_name in quantized_set or not isinstance(value, torch.Tensor):
+            continue
+        if tied and key == "lm_head.weight":
+            continue  # same tensor as the token embedding, tied again on load
+        tensors[key] = value.detach().contiguous()
+
+    os.makedirs(out_dir, exist_ok=True)
+    save_file(tensors, os.path.join(out_dir, QUANTIZED_FILE),
+              metadata={"format": "pt", "quantized": json.dumps(quantized), "tied_lm_head": json.dumps(tied)})
+    model.config.save_pretrained(out_dir)
+    AutoTokenizer.from_pretrained(model_dir).save_pretrained(out_dir)
+    size = os.path.getsize(os.path.join(out_dir, QUANTIZED_FILE))
+    print(f"[DONE] int8 model ({len(quantized)} quantized layers, {size / 1e6:.1f} MB) saved to {out_dir} "
+          f"in {time.time() - start_time:.2f} seconds")
+
+
+def mmap_safetensors(path):
+    """(tensors, metadata) of a safetensors file; the tensors point into a copy-on-write mmap."""
+    with open(path, "rb") as f:
+        header_size = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(header_size))
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    metadata = header.pop("__metadata__", {})
+    base = 8 + header_size
+    tensors = {}
+    for name, info in header.items():
+        start, stop = info["data_offsets"]
+        dtype = SAFETENSORS_DTYPES[info["dtype"]]
+        if stop == start:
+            tensors[name] = torch.empty(info["shape"], dtype=dtype)
+            continue
+        tensor = torch.frombuffer(buffer, dtype=dtype, count=(stop - start) // dtype.itemsize, offset=base + start)
+        tensors[name] = tensor.reshape(info["shape"])
+    return tensors, metadata
+
+
+def _quantized_linear(tensors, name):
+    weight_int8 = tensors[f"{name}.weight_int8"]
+    qweight = torch._make_per_channel_quantized_tensor(
+        weight_int8, tensors[f"{name}.weight_scale"], tensors[f"{name}.weight_zero_point"], 0)
+    out_features, in_features = weight_int8.shape
+    linear = DynamicQuantizedLinear(in_features, out_features, dtype=torch.qint8)
+    linear.set_weight_bias(qweight, tensors.get(f"{name}.bias"))
+    return linear
+
+
+def _assign(model, key, tensor):
+    """Puts tensor in place of the (meta) parameter or buffer key, without a copy."""
+    module_name, _, attr = key.rpartition(".")
+    module = model.get_submodule(module_name) if module_name else model
+    if attr in module._parameters:
+        module._parameters[attr] = nn.Parameter(tensor, requires_grad=False)
+    elif attr in module._buffers:
+        module._buffers[attr] = tensor
+    else:
+        raise KeyError(f"{key} is not a parameter or buffer of the model")
+
+
+def load_quantized(model_dir):
+    config = AutoConfig.from_pretrained(model_dir)
+    # parameters on meta, buffers on the CPU: non-persistent buffers (GPT2Attention's causal mask
+    # "bias" and "masked_bias" on older transformers) are not in the state dict, so not exported
+    with init_empty_weights(include_buffers=False):
+        model = AutoModelForCausalLM.from_config(config)
+    conv1d_to_linear(model)
+
+    tensors, metadata = mmap_safetensors(os.path.join(model_dir, QUANTIZED_FILE))
+    quantized = json.loads(metadata["quantized"])
+    for name in quantized:
+        _set_module(model, name, _quantized_linear(tensors, name))
+    quantized_set = set(quantized)
+    for key, tensor in tensors.items():
+        if key.rsplit(".", 1)[0] not in quantized_set:
+            _assign(model, key, tensor)
+    if json.loads(metadata.get("tied_lm_head", "false")):
+        model.lm_head.weight = model.get_input_embeddings().weight
+
+    missing = [name for name, p in list(model.named_parameters()) + list(model.named_buffers()) if p.is_meta]
+    if missing:
+        raise ValueError(f"{model_dir}: tensors missing from {QUANTIZED_FILE}: {missing[:5]}")
+    return model.eval()
+
+
+def load_inference_model(model_dir):
+    """int8 model if model_dir holds an export_quantized output, else the fp32 checkpoint."""
+    if os.path.exists(os.path.join(model_dir, QUANTIZED_FILE)):
+        return load_quantized(model_dir)
+    return AutoModelForCausalLM.from_pretrained(model_dir).eval()
+
+
+def _rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * resource.getpagesize() / 1024 ** 2
+
+
+def _peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KB on Linux
+
+
+def _run_model(model_dir, tokenizer_dir, windows, n_steps):
+    """
+    Loads one model and runs the greedy rollouts; called in a fresh process by compare_models.
+    Returns (predictions, stats); RSS is the process' after the imports, so it is the model's own.
+    """
+    tokenizer = AutoTokenizer.from_pretrained(tokenizer_dir)
+    grammar = TrajectoryGrammar(tokenizer, INPUT_GRAMMAR)
+    rss_before = _rss_mb()
+    start_time = time.time()
+    model = load_inference_model(model_dir)
+    load_seconds = time.time() - start_time
+    start_time = time.time()
+    predictions = BatchPredictor(model, tokenizer, grammar=grammar).predict(
+        windows, n_steps=n_steps, do_sample=False, verbose=False)
+    stats = {"load_seconds": round(load_seconds, 2), "rollout_seconds": round(time.time() - start_time, 2),
+             "rss_added_mb": round(_rss_mb() - rss_before, 1), "peak_rss_mb": round(_peak_rss_mb(), 1)}
+    return predictions, stats
+
+
+def _geodesic_errors_m(points, reference):
+    """Geodesic distances (m) between matching (lat, lon) rows that are both valid."""
+    valid = ~(np.isnan(points).any(axis=1) | np.isnan(reference).any(axis=1))
+    if not valid.any():
+        return np.array([])
+    return geodesic_distance(points[valid, 0], points[valid, 1], reference[valid, 0], reference[valid, 1])
+
+
+def _summary(errors):
+    if len(errors) == 0:
+        return {"n": 0}
+    return {"n": int(len(errors)), "mean_m": round(float(np.mean(errors)), 1),
+            "median_m": round(float(np.median(errors)), 1), "p90_m": round(float(np.percentile(errors, 90)), 1)}
+
+
+def compare_models(fp32_dir, int8_dir, shard_path, n_vessels=50, n_steps=10, seed_lines=20, skip_last=20):
+    """Geodesic error of greedy rollouts of the fp32 and int8 models on the vessels of shard_path."""
+    with open(shard_path, "r") as f:
+        df = pd.DataFrame([p for p in (parse_line(line) for line in f) if p is not None])
+    windows = dict(list(seed_windows(df, seed_lines, skip_last).items())[:n_vessels])
+    truth = {}
+    for mmsi, ship_df in df[df["MMSI"].isin(windows)].groupby("MMSI"):
+        rows = ship_df.iloc[len(ship_df) - skip_last:len(ship_df) - skip_last + n_steps]
+        points = np.full((n_steps, 2), np.nan)
+        points[:len(rows)] = rows[["LAT", "LON"]].to_numpy()
+        truth[mmsi] = points
+
+    report, predictions = {}, {}
+    for label, directory in (("fp32", fp32_dir), ("int8", int8_dir)):
+        # one fresh process per model: RSS per worker is what decides how many fit on a node
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            predictions[label], stats = executor.submit(_run_model, directory, fp32_dir, windows, n_steps).result()
+        errors = np.concatenate([_geodesic_errors_m(predictions[label][m], truth[m]) for m in windows])
+        report[label] = {**stats, "error_vs_truth": _summary(errors)}
+    drift = np.concatenate([_geodesic_errors_m(predictions["int8"][m], predictions["fp32"][m]) for m in windows])
+    report["int8_vs_fp32"] = _summary(drift)
+    report["vessels"] = len(windows)
+    print(json.dumps(report, indent=2))
+    return report
+
+
+if __name__ == "__main__":
+    export_quantized(model_path, int8_path)
+    compare_models(model_path, int8_path, check_shard)
@@ -1,119 +1,257 @@
 import pandas as pd
-import numpy as np
-from shapely import wkt
-from geopy.distance import geodesic
+import pyarrow.parquet as pq
 import os
-import math
 import time
-from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
 
-# Vessel stats dictionary (not included here for brevity)
-# You can inject VESSEL_STATS_BY_TYPE externally if needed
+from chunk_io import MULTILINE_TYPES, decode_wkt_geometries, read_chunk_tracks, read_csv_byte_range, table_tracks
+from run_manifest import (atomic_output, load_manifest, maybe_save_manifest, output_fingerprint, output_status,
+                          record_output, remove_stale_temp_files, save_manifest)
+from segments import build_segments
 
-def calculate_bearing(lat1, lon1, lat2, lon2):
-    dLon = math.radians(lon2 - lon1)
-    lat1 = math.radians(lat1)
-    lat2 = math.radians(lat2)
+# Row-range task size for process_all_batches_balanced. Bytes of input track a file's vertex
+# count (the WKT / coordinate payload dominates), so tasks of equal size take similar time.
+TARGET_TASK_BYTES = 32 * 1024 * 1024
 
-    x = math.sin(dLon) * math.cos(lat2)
-    y = math.cos(lat1) * math.sin(lat2) - (
-        math.sin(lat1) * math.cos(lat2) * math.cos(dLon)
-    )
+# Vessel stats dictionary (not included here for brevity)
+# You can inject VESSEL_STATS_BY_TYPE externally if needed
 
-    bearing = math.atan2(x, y)
-    return (math.degrees(bearing) + 360) % 360
+def reconstruction_params(vessel_stats, distance_method):
+    """Parameters recorded in the run manifest; changing them makes existing outputs stale."""
+    return {'distance_method': distance_method, 'vessel_stats': vessel_stats}
 
-def process_single_file(file_tuple):
-    input_csv_path, output_csv_path, vessel_stats = file_tuple
 
-    if os.path.exists(output_csv_path):
-        return f"[SKIP] {os.path.basename(output_csv_path)} already exists."
+def pending_outputs(input_dir, output_dir, params, verify="size"):
+    """
+    Lists (input_path, output_path) pairs that must be (re)done according to the run manifest
+    and removes temporary files of killed runs. Returns (pairs, manifest).
+    """
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    stale = remove_stale_temp_files(output_dir)
+    if stale:
+        print(f"[INFO] Removed {stale} temporary files of an interrupted run.")
 
-    try:
-        df = pd.read_csv(input_csv_path)
-        df = df.sort_values(by=['MMSI', 'TrackStartTime']).reset_index(drop=True)
-        vector_data = []
-
-        for idx, row in df.iterrows():
-            try:
-                vt = int(row['VesselType'])
-                if vt not in vessel_stats:
-                    continue
+    manifest = load_manifest(output_dir)
+    pairs = []
+    for filename in sorted(os.listdir(input_dir)):
+        if filename.endswith(('.csv', '.parquet')):
+            input_path = os.path.join(input_dir, filename)
+            output_path = os.path.join(output_dir, f'vectors_{os.path.splitext(filename)[0]}.csv')
+            reason = output_status(manifest, output_path, input_path, params, verify)
+            if reason is None:
+                print(f"[SKIP] {os.path.basename(output_path)} is up to date.")
+                continue
+            if os.path.exists(output_path):
+                print(f"[REDO] {os.path.basename(output_path)}: {reason}")
+            pairs.append((input_path, output_path))
+    return pairs, manifest
 
-                multiline = wkt.loads(row['geometry'])
-                all_points = [pt for line in multiline.geoms for pt in line.coords]
-                if len(all_points) < 2:
-                    continue
 
-                total_duration_min = row['DurationMinutes']
-                if total_duration_min == 0:
-                    continue
+def process_single_file(file_tuple):
+    """
+    Returns (input_path, output_path, rows, message, fingerprint); rows is None on failure.
+    The manifest fingerprint is computed here, in the pool, not in the parent.
+    """
+    input_csv_path, output_csv_path, vessel_stats, distance_method = file_tuple
 
-                duration_per_segment_min = total_duration_min / (len(all_points) - 1)
-                time_diff_sec = duration_per_segment_min * 60.0
-                stats = vessel_stats[vt]
-
-                for i in range(1, len(all_points)):
-                    lon1, lat1 = all_points[i - 1]
-                    lon2, lat2 = all_points[i]
-
-                    distance = geodesic((lat1, lon1), (lat2, lon2)).meters
-                    angle = calculate_bearing(lat1, lon1, lat2, lon2)
-                    speed_knots = (distance * 1.94384) / time_diff_sec
-
-                    segment_start = pd.to_datetime(row['TrackStartTime']) + pd.to_timedelta((i - 1) * duration_per_segment_min, unit='m')
-                    segment_end = pd.to_datetime(row['TrackStartTime']) + pd.to_timedelta(i * duration_per_segment_min, unit='m')
-
-                    vector_data.append({
-                        'MMSI': row['MMSI'],
-                        'TrackStartTime': row['TrackStartTime'],
-                        'TrackEndTime': row['TrackEndTime'],
-                        'Segment_StartTime': segment_start,
-                        'Segment_EndTime': segment_end,
-                        'VesselType': vt,
-                        'Global_Length': stats['Length'],
-                        'Global_Width': stats['Width'],
-                        'Global_Draft': stats['Draft'],
-                        'Distance_Meters': distance,
-                        'Speed_Knots': speed_knots,
-                        'Bearing_Degrees': angle,
-                        'Start_Lat': lat1,
-                        'Start_Lon': lon1,
-                        'End_Lat': lat2,
-                        'End_Lon': lon2
-                    })
-
-            except Exception:
-                continue
+    try:
+        df, track_coords = read_chunk_tracks(input_csv_path, MULTILINE_TYPES)
+        order = df.sort_values(by=['MMSI', 'TrackStartTime']).index.to_numpy()
+        output_df = build_segments(df, vessel_stats, distance_method=distance_method,
+                                   track_coords=track_coords, order=order)
 
-        if vector_data:
-            output_df = pd.DataFrame(vector_data)
-            output_df.to_csv(output_csv_path, index=False)
-            return f"[INFO] Processed and saved {len(vector_data)} vectors to: {os.path.basename(output_csv_path)}"
+        if len(output_df):
+            with atomic_output(output_csv_path) as tmp_path:
+                output_df.to_csv(tmp_path, index=False)
+            message = f"[INFO] Processed and saved {len(output_df)} vectors to: {os.path.basename(output_csv_path)}"
         else:
-            return f"[WARNING] No valid vectors in file: {os.path.basename(input_csv_path)}"
+            message = f"[WARNING] No valid vectors in file: {os.path.basename(input_csv_path)}"
+        fingerprint = output_fingerprint(output_csv_path, input_csv_path, written=len(output_df) > 0)
+        return input_csv_path, output_csv_path, len(output_df), message, fingerprint
     except Exception as e:
-        return f"[ERROR] Failed to process {os.path.basename(input_csv_path)}: {e}"
+        return (input_csv_path, output_csv_path, None,
+                f"[ERROR] Failed to process {os.path.basename(input_csv_path)}: {e}", None)
 
-def process_all_batches_parallel(input_dir, output_dir, vessel_stats, max_workers=4):
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-
-    file_tasks = []
-    for filename in os.listdir(input_dir):
-        if filename.endswith('.csv'):
-            input_path = os.path.join(input_dir, filename)
-            output_path = os.path.join(output_dir, f'vectors_{filename}')
-            file_tasks.append((input_path, output_path, vessel_stats))
+def process_all_batches_parallel(input_dir, output_dir, vessel_stats, max_workers=4, distance_method="geodesic",
+                                 verify="size"):
+    params = reconstruction_params(vessel_stats, distance_method)
+    pairs, manifest = pending_outputs(input_dir, output_dir, params, verify)
+    file_tasks = [(input_path, output_path, vessel_stats, distance_method) for input_path, output_path in pairs]
 
     start_time = time.time()
 
     with ProcessPoolExecutor(max_workers=max_workers) as executor:
-        results = executor.map(process_single_file, file_tasks)
-        for result in results:
-            print(result)
+        futures = [executor.submit(process_single_file, task) for task in file_tasks]
+        for future in as_completed(futures):
+            input_path, output_path, rows, message, fingerprint = future.result()
+            print(message)
+            if rows is not None:
+                record_output(manifest, output_path, input_path, params, rows, written=rows > 0,
+                              fingerprint=fingerprint)
+                maybe_save_manifest(output_dir, manifest)
+    save_manifest(output_dir, manifest)
 
     elapsed = time.time() - start_time
     print(f"[DONE] Processed {len(file_tasks)} files in {elapsed:.2f} seconds.")
 
 # This function can now be used by providing vessel stats and the appropriate folder paths.
+
+
+def plan_file_tasks(input_path, target_task_bytes=TARGET_TASK_BYTES):
+    """
+    Splits one chunk file into row-range tasks of about target_task_bytes each.
+    Returns [(row_range, size_bytes)]: row_range is a line-aligned (start, stop) byte range
+    for CSV or a tuple of row group ids for Parquet.
+    CSV ranges are cut at newlines, so they assume rows without quoted newlines (the chunk
+    writers never produce any); a range that cuts a quoted field fails its task in
+    read_csv_byte_range instead of producing wrong rows.
+    """
+    if input_path.endswith('.parquet'):
+        metadata = pq.ParquetFile(input_path).metadata
+        tasks, groups, size = [], [], 0
+        for i in range(metadata.num_row_groups):
+            groups.append(i)
+            size += metadata.row_group(i).total_byte_size
+            if size >= target_task_bytes:
+                tasks.append((tuple(groups), size))
+                groups, size = [], 0
+        if groups:
+            tasks.append((tuple(groups), size))
+        return tasks
+
+    file_size = os.path.getsize(input_path)
+    with open(input_path, 'rb') as f:
+        f.readline()  # header
+        bounds = [f.tell()]
+        while bounds[-1] + target_task_bytes < file_size:
+            f.seek(bounds[-1] + target_task_bytes)
+            f.readline()
+            if f.tell() >= file_size:
+                break
+            bounds.append(f.tell())
+    bounds.append(file_size)
+    return [((start, stop), stop - start) for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+
+
+def _read_task_rows(input_path, row_range):
+    if input_path.endswith('.parquet'):
+        df, track_coords, _ = table_tracks(pq.ParquetFile(input_path).read_row_groups(list(row_range)), MULTILINE_TYPES)
+        return df, track_coords
+    df = read_csv_byte_range(input_path, *row_range)
+    return df, decode_wkt_geometries(df.pop('geometry'), MULTILINE_TYPES)
+
+
+def _write_vectors(input_path, output_path, output_df):
+    """Writes a file's vectors_*.csv; returns (rows, message, fingerprint) for record_output."""
+    if len(output_df):
+        with atomic_output(output_path) as tmp_path:
+            output_df.to_csv(tmp_path, index=False)
+        message = f"[INFO] Processed and saved {len(output_df)} vectors to: {os.path.basename(output_path)}"
+    else:
+        message = f"[WARNING] No valid vectors for: {os.path.basename(output_path)}"
+    return len(output_df), message, output_fingerprint(output_path, input_path, written=len(output_df) > 0)
+
+
+def process_task(task):
+    """
+    Builds the segments of one row-range task. The only task of a file (part_path None) writes
+    the file's vectors_*.csv and returns (rows, message, fingerprint); other tasks store their
+    segments in their part file and return None.
+    """
+    input_path, output_path, part_path, row_range, vessel_stats, distance_method = task
+    df, track_coords = _read_task_rows(input_path, row_range)
+    order = df.sort_values(by=['MMSI', 'TrackStartTime']).index.to_numpy()
+    output_df = build_segments(df, vessel_stats, distance_method=distance_method,
+                               track_coords=track_coords, order=order)
+    if part_path is None:
+        return _write_vectors(input_path, output_path, output_df)
+    output_df.to_pickle(part_path)
+    return None
+
+
+def merge_task_outputs(input_path, output_path, part_paths):
+    """
+    Merges a file's task outputs (in row order) into its vectors_*.csv and removes the parts.
+    Runs in the pool, submitted when the file's last task is done. Returns (rows, message, fingerprint).
+    """
+    output_df = pd.concat([pd.read_pickle(p) for p in part_paths], ignore_index=True)
+    output_df = output_df.sort_values(by=['MMSI', 'TrackStartTime'], kind='stable')
+    for p in part_paths:
+        os.remove(p)
+    return _write_vectors(input_path, output_path, output_df)
+
+
+def _remove_parts(part_paths):
+    for p in part_paths:
+        if p is not None and os.path.exists(p):
+            os.remove(p)
+
+
+def process_all_batches_balanced(input_dir, output_dir, vessel_stats, max_workers=4, distance_method="geodesic",
+                                 target_task_bytes=TARGET_TASK_BYTES, verify="size"):
+    """
+    Like process_all_batches_parallel, but load-balanced: every file is split into row-range
+    tasks of about target_task_bytes, the largest tasks are submitted first, and tasks are
+    collected as they complete. A file with one task is written by that task; the parts of a
+    split file are merged (and its CSV written) by a merge task submitted as soon as its last
+    part is done. Outputs are hashed in the pool too; the parent only does the bookkeeping (manifest).
+    """
+    params = reconstruction_params(vessel_stats, distance_method)
+    pairs, manifest = pending_outputs(input_dir, output_dir, params, verify)
+
+    tasks = []
+    files = {}  # output_path -> {'input': path, 'parts': [...], 'remaining': n, 'failed': bool}
+    for input_path, output_path in pairs:
+        file_tasks = plan_file_tasks(input_path, target_task_bytes)
+        if not file_tasks:
+            # recorded like a file without vectors, so it is not re-planned and an old output is removed
+            print(f"[WARNING] No rows in file: {os.path.basename(input_path)}")
+            record_output(manifest, output_path, input_path, params, 0, written=False)
+            continue
+        # part files are temporary files too, so an interrupted run's parts are cleaned up
+        parts = [os.path.join(output_dir, f".{os.path.basename(output_path)}.part{k}.pkl.tmp")
+                 for k in range(len(file_tasks))] if len(file_tasks) > 1 else [None]
+        files[output_path] = {'input': input_path, 'parts': parts, 'remaining': len(file_tasks), 'failed': False}
+        for part_path, (row_range, size) in zip(parts, file_tasks):
+            tasks.append((size, (input_path, output_path, part_path, row_range, vessel_stats, distance_method)))
+
+    # largest first, so the stragglers start early and small tasks fill the gaps
+    tasks.sort(key=lambda t: t[0], reverse=True)
+    print(f"[INFO] {len(tasks)} tasks from {len(files)} files, {max_workers} workers.")
+    start_time = time.time()
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        pending = {executor.submit(process_task, task): ('task', task[1]) for _, task in tasks}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                kind, output_path = pending.pop(future)
+                state = files[output_path]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    state['failed'] = True
+                    result = None
+                    print(f"[ERROR] {kind.capitalize()} failed for {os.path.basename(output_path)}: {e}")
+                if kind == 'task':
+                    state['remaining'] -= 1
+                    if state['remaining'] > 0:
+                        continue
+                if state['failed']:
+                    _remove_parts(state['parts'])
+                    print(f"[ERROR] Failed to process {os.path.basename(output_path)}")
+                    continue
+                if result is None:
+                    # all parts of a split file are done: merge them in the pool
+                    pending[executor.submit(merge_task_outputs, state['input'], output_path, state['parts'])] = ('merge', output_path)
+                    continue
+                rows, message, fingerprint = result
+                print(message)
+                record_output(manifest, output_path, state['input'], params, rows, written=rows > 0,
+                              fingerprint=fingerprint)
+                maybe_save_manifest(output_dir, manifest)
+    save_manifest(output_dir, manifest)
+
+    elapsed = time.time() - start_time
+    print(f"[DONE] Processed {len(files)} files ({len(tasks)} tasks) in {elapsed:.2f} seconds.")
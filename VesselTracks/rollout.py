@@ -0,0 +1,188 @@
+"""
+Multi-step rollout with KV-cache reuse.
+
+test_gpt.py predicts N points by calling the text-generation pipeline N times on the growing
+prompt
+    <seed lines joined by "\\n"><predicted line>\\n<predicted line>\\n...<INSTRUCTION>
+so every step re-tokenizes and re-encodes everything (quadratic in the rollout length).
+
+RolloutEngine keeps the context (seed + predicted lines) encoded in a DynamicCache:
+- a step feeds only INSTRUCTION and the generated tokens on top of the cache, then crops the
+  cache back to the context
+- the normalized predicted line is appended to the context (only its tokens are encoded)
+- dropping seed lines (every drop_every steps, drop_count lines) changes the start of the
+  context; GPT-2's absolute positions make trimming the front of a cache invalid, so the
+  context is re-encoded once at that point (recompute-on-drop)
+- when context + instruction + max_new_tokens would exceed the model's positions, the oldest
+  lines (seed first) are dropped and the context re-encoded (recompute-on-overflow), leaving
+  OVERFLOW_HEADROOM of the positions free so the next steps append to the cache again
+- with a prefix_cache.PrefixCache every re-encode takes the seed part of the context from it
+  (and stores it there), so repeated rollouts of one seed window (sample_futures, reruns with
+  other sampling settings) only encode their own predicted lines
+
+The prompt text is the same as in test_gpt.py; it is tokenized piece by piece (seed, predicted
+lines, instruction), which only differs from tokenizing the whole prompt where BPE
+would merge across a piece boundary.
+"""
+
+import time
+
+import torch
+from transformers import DynamicCache, LogitsProcessorList
+
+from gpt_text_format import normalize_predicted_line
+
+INSTRUCTION = "\n→ Predict next input in the same format:\n"
+OVERFLOW_HEADROOM = 0.25
+
+
+class RolloutEngine:
+    def __init__(self, model, tokenizer, instruction=INSTRUCTION, max_positions=None, grammar=None,
+                 prefix_cache=None):
+        self.model = model.eval()
+        self.tokenizer = tokenizer
+        self.device = next(model.parameters()).device
+        self.instruction_ids = self._encode(instruction)
+        self.max_positions = max_positions or getattr(model.config, "n_positions", None) \
+            or getattr(model.config, "max_position_embeddings", 1024)
+        # constrained_decoding.TrajectoryGrammar: every step generates exactly one valid segment
+        self.grammar = grammar
+        self.grammar_max_tokens = grammar.max_new_tokens() if grammar is not None else None
+        self.prefix_cache = prefix_cache
+        self.stats = {"encoded_tokens": 0, "cached_tokens": 0, "generated_tokens": 0, "recomputes": 0,
+                      "seconds": 0.0}
+        self.cache = None
+        self.context_ids = None
+
+    def _encode(self, text):
+        ids = self.tokenizer(text, add_special_tokens=False, return_tensors="pt")["input_ids"]
+        return ids.to(self.device)
+
+    @torch.no_grad()
+    def _feed(self, ids):
+        """Encodes ids on top of the cache."""
+        if ids.shape[1] == 0:
+            return
+        self.model(input_ids=ids, past_key_values=self.cache, use_cache=True)
+        self.context_ids = torch.cat([self.context_ids, ids], dim=1)
+        self.stats["encoded_tokens"] += ids.shape[1]
+
+    def _reset(self, seed_lines, predicted):
+        """Encodes the context from scratch, the seed part through the prefix cache if there is one."""
+        self.cache = DynamicCache()
+        self.context_ids = torch.zeros((1, 0), dtype=torch.long, device=self.device)
+        seed_ids = self._encode(context_text(seed_lines, []))
+        use_prefix_cache = self.prefix_cache is not None and seed_ids.shape[1] > 0
+        if use_prefix_cache:
+            length, cache = self.prefix_cache.lookup(seed_ids[0])
+            if cache is not None:
+                self.cache = cache
+                self.context_ids = seed_ids[:, :length]
+                self.stats["cached_tokens"] += length
+        self._feed(seed_ids[:, self.context_ids.shape[1]:])
+        if use_prefix_cache:
+            self.prefix_cache.store(seed_ids[0], self.cache)
+        self._feed(self._encode(context_text([], predicted)))
+
+    def _crop(self, length):
+        extra = self.cache.get_seq_length() - length
+        if extra > 0:
+            self.cache.crop(-extra)
+
+    @torch.no_grad()
+    def _generate(self, max_new_tokens, **generate_kwargs):
+        prompt_ids = torch.cat([self.context_ids, self.instruction_ids], dim=1)
+        if self.grammar is not None:
+            generate_kwargs["logits_processor"] = LogitsProcessorList(
+                list(generate_kwargs.get("logits_processor") or []) + [self.grammar.logits_processor()])
+        output = self.model.generate(
+            input_ids=prompt_ids,
+            attention_mask=torch.ones_like(prompt_ids),
+            past_key_values=self.cache,
+            max_new_tokens=max_new_tokens,
+            pad_token_id=self.tokenizer.pad_token_id if self.tokenizer.pad_token_id is not None
+            else self.tokenizer.eos_token_id,
+            **generate_kwargs,
+        )
+        new_ids = output[0, prompt_ids.shape[1]:]
+        self.stats["encoded_tokens"] += self.instruction_ids.shape[1]
+        self.stats["generated_tokens"] += len(new_ids)
+        self._crop(self.context_ids.shape[1])  # back to seed + predicted lines
+        return self.tokenizer.decode(new_ids, skip_special_tokens=True)
+
+    def _n_tokens(self, text):
+        return len(self.tokenizer(text, add_special_tokens=False)["input_ids"]) if text else 0
+
+    def _fit_context(self, seed_lines, predicted, max_new_tokens, headroom=0):
+        """
+        (seed_lines, predicted) without the oldest lines that don't fit:
+        context + instruction + max_new_tokens (+ headroom) must fit the model.
+        """
+        budget = self.max_positions - self.instruction_ids.shape[1] - max_new_tokens - headroom
+        seed_lines, predicted = list(seed_lines), list(predicted)
+        while seed_lines or predicted:
+            n_tokens = self._n_tokens(context_text(seed_lines, [])) + self._n_tokens(context_text([], predicted))
+            if n_tokens <= budget:
+                break
+            if seed_lines:
+                seed_lines.pop(0)
+            else:
+                predicted.pop(0)
+        return seed_lines, predicted
+
+    def rollout(self, seed_lines, n_steps=10, max_new_tokens=17, drop_every=5, drop_count=5,
+                seed=None, on_step=None, **generate_kwargs):
+        """
+        Predicts n_steps lines after seed_lines; returns the normalized predicted lines.
+        With a grammar max_new_tokens is the grammar's exact segment length.
+        generate_kwargs go to model.generate (do_sample, temperature, top_k, logits_processor, ...).
+        on_step(step, prompt_text, generated_text) is called after every step.
+        """
+        start_time = time.time()
+        if self.grammar is not None:
+            max_new_tokens = self.grammar_max_tokens
+        if seed is not None:
+            torch.manual_seed(seed)
+        drop = 0
+        predicted = []
+        self._reset(*self._fit_context(seed_lines, predicted, max_new_tokens))
+        for step in range(n_steps):
+            generated = self._generate(max_new_tokens, **generate_kwargs)
+            if on_step is not None:
+                on_step(step, context_text(seed_lines[drop:], predicted) + self.tokenizer.decode(
+                    self.instruction_ids[0]), generated)
+
+            lines = [l.strip() for l in generated.strip().split("\n") if l.strip()]
+            if lines:
+                new_line = normalize_predicted_line(lines[-1])
+                predicted.append(new_line)
+                new_ids = self._encode(new_line + "\n")
+                needed = self.context_ids.shape[1] + new_ids.shape[1] + self.instruction_ids.shape[1] + max_new_tokens
+                if needed > self.max_positions:
+                    self.stats["recomputes"] += 1
+                    headroom = int(self.max_positions * OVERFLOW_HEADROOM)
+                    self._reset(*self._fit_context(seed_lines[drop:], predicted, max_new_tokens, headroom))
+                else:
+                    self._feed(new_ids)
+
+            # every drop_every steps the next prompt loses drop_count more seed lines
+            if drop_every and (step + 1) % drop_every == 0 and drop < len(seed_lines):
+                drop = min(drop + drop_count, len(seed_lines))
+                self.stats["recomputes"] += 1
+                self._reset(*self._fit_context(seed_lines[drop:], predicted, max_new_tokens))
+        self.stats["seconds"] += time.time() - start_time
+        return predicted
+
+
+def sample_futures(engine, seed_lines, n_samples=50, first_seed=0, **rollout_kwargs):
+    """
+    n_samples sampled rollouts (torch seeds first_seed, first_seed + 1, ...) of one seed window;
+    give the engine a PrefixCache so the seed is encoded once for all of them.
+    """
+    rollout_kwargs.setdefault("do_sample", True)
+    return [engine.rollout(seed_lines, seed=first_seed + i, **rollout_kwargs) for i in range(n_samples)]
+
+
+def context_text(seed_lines, predicted):
+    """Seed lines joined by "\\n", then every predicted line followed by "\\n" (test_gpt.py layout)."""
+    return "\n".join(seed_lines) + "".join(line + "\n" for line in predicted)
@@ -0,0 +1,169 @@
+"""
+Atomic outputs and a run manifest for resumable reconstruction.
+
+Outputs are written to a temporary file next to the target and renamed into place, so a run
+killed mid-write never leaves a truncated vectors_*.csv behind.
+
+The manifest (_manifest.json in the output directory) records for every output: the input's
+size / mtime / content hash, the output's row count, size and hash, and the run parameters.
+On a re-run an output is redone only when it is missing, unknown to the manifest, stale (input
+or parameters changed) or corrupt (size, or with verify="hash" the content hash, differs).
+"""
+
+import glob
+import hashlib
+import json
+import os
+import stat
+import tempfile
+import time
+from contextlib import contextmanager
+
+MANIFEST_FILE = "_manifest.json"
+TEMP_SUFFIX = ".tmp"
+SAVE_INTERVAL_SEC = 5.0
+
+
+def _file_mode(path):
+    """Mode a plain open(path, "w") would leave: the existing file's, else 0o666 minus the umask."""
+    if os.path.exists(path):
+        return stat.S_IMODE(os.stat(path).st_mode)
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+def _fsync_dir(directory):
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+@contextmanager
+def atomic_output(path):
+    """
+    Yields a temporary path in the target directory; on success it is fsynced and renamed
+    to path (with the mode a plain write would give it, mkstemp creates 0600), and the
+    directory is fsynced so the rename survives a crash. On error it is removed.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix=TEMP_SUFFIX, dir=directory)
+    os.close(fd)
+    try:
+        yield tmp_path
+        with open(tmp_path, "rb+") as f:
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, _file_mode(path))
+        os.replace(tmp_path, path)
+        _fsync_dir(directory)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def remove_stale_temp_files(output_dir):
+    """Removes temporary files left behind by killed runs (call before starting a run)."""
+    stale = glob.glob(os.path.join(output_dir, f".*{TEMP_SUFFIX}"))
+    for path in stale:
+        os.remove(path)
+    return len(stale)
+
+
+def file_hash(path, chunk_size=8 * 1024 * 1024):
+    h = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def params_hash(params):
+    return hashlib.blake2b(json.dumps(params, sort_keys=True, default=str).encode("utf-8"), digest_size=12).hexdigest()
+
+
+def load_manifest(output_dir):
+    path = os.path.join(output_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {"outputs": {}}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(output_dir, manifest):
+    manifest["_last_save"] = time.time()
+    with atomic_output(os.path.join(output_dir, MANIFEST_FILE)) as tmp_path:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+
+
+def maybe_save_manifest(output_dir, manifest):
+    """Saves at most every SAVE_INTERVAL_SEC; outputs recorded after a crash are simply redone."""
+    if time.time() - manifest.get("_last_save", 0) >= SAVE_INTERVAL_SEC:
+        save_manifest(output_dir, manifest)
+
+
+def output_status(manifest, output_path, input_path, params, verify="size"):
+    """
+    Returns None when output_path is up to date, otherwise the reason it must be redone.
+    verify: "size" compares the output size with the manifest, "hash" also re-hashes it.
+    """
+    entry = manifest["outputs"].get(os.path.basename(output_path))
+    if entry is None:
+        return "not in manifest"
+    if entry["params"] != params_hash(params):
+        return "parameters changed"
+
+    input_stat = os.stat(input_path)
+    if input_stat.st_size != entry["input_size"]:
+        return "input changed"
+    if input_stat.st_mtime_ns != entry["input_mtime_ns"]:
+        if file_hash(input_path) != entry["input_hash"]:
+            return "input changed"
+        entry["input_mtime_ns"] = input_stat.st_mtime_ns  # touched only: don't re-hash it next run
+
+    if entry["output_size"] is None:  # recorded as "no rows", no file written
+        return None
+    if not os.path.exists(output_path):
+        return "missing"
+    if os.path.getsize(output_path) != entry["output_size"]:
+        return "corrupt (size)"
+    if verify == "hash" and file_hash(output_path) != entry["output_hash"]:
+        return "corrupt (hash)"
+    return None
+
+
+def output_fingerprint(output_path, input_path, written=True):
+    """
+    Sizes, input mtime and content hashes recorded for an output. Workers compute it right after
+    writing the output and return it with their result, so the parent does not re-read the files.
+    """
+    input_stat = os.stat(input_path)
+    return {
+        "input_size": input_stat.st_size,
+        "input_mtime_ns": input_stat.st_mtime_ns,
+        "input_hash": file_hash(input_path),
+        "output_size": os.path.getsize(output_path) if written else None,
+        "output_hash": file_hash(output_path) if written else None,
+    }
+
+
+def record_output(manifest, output_path, input_path, params, rows, written=True, fingerprint=None):
+    """
+    Records a finished output. written=False: this run wrote no file for the input (no rows);
+    an output left by an earlier run is stale and removed. fingerprint: output_fingerprint
+    computed by the worker; without it the files are hashed here.
+    """
+    if not written and os.path.exists(output_path):
+        os.remove(output_path)
+    if fingerprint is None:
+        fingerprint = output_fingerprint(output_path, input_path, written)
+    manifest["outputs"][os.path.basename(output_path)] = {
+        "input": os.path.abspath(input_path),
+        **fingerprint,
+        "rows": int(rows),
+        "params": params_hash(params),
+        "finished_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
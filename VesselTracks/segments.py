@@ -0,0 +1,205 @@
+"""
+Columnar segment builder shared by reconstruction.py and reconstruct_in_parallel.py.
+
+Builds the per-segment table (one row per consecutive vertex pair of a track) column by
+column with NumPy instead of iterrows + one 16-key dict per segment:
+- segment times are vectorized offsets from each track's TrackStartTime, parsed once per chunk
+- Global_Length/Width/Draft come from arrays indexed by VesselType
+- distance / bearing / speed come from geodesy.segment_metrics for the whole chunk at once
+
+Row filtering is the same as the row loop it replaces: unknown VesselType, fewer than two
+vertices, zero DurationMinutes, and unparseable geometry / TrackStartTime rows are skipped.
+"""
+
+import numpy as np
+import pandas as pd
+
+from chunk_io import MULTILINE_TYPES, decode_wkt_geometries, track_point_offsets
+from geodesy import segment_metrics
+
+SEGMENT_COLUMNS = [
+    'MMSI', 'TrackStartTime', 'TrackEndTime', 'Segment_StartTime', 'Segment_EndTime',
+    'VesselType', 'Global_Length', 'Global_Width', 'Global_Draft',
+    'Distance_Meters', 'Speed_Knots', 'Bearing_Degrees',
+    'Start_Lat', 'Start_Lon', 'End_Lat', 'End_Lon',
+]
+
+# Global Length / Width / Draft per VesselType (global_features.py), used by every reconstruction script
+VESSEL_STATS_BY_TYPE = {
+1: {'Length': 168.056, 'Width': 25.435, 'Draft': 7.835},
+2: {'Length': 40.0, 'Width': 11.0, 'Draft': 3.0},
+4: {'Length': 295.0, 'Width': 45.0, 'Draft': 9.5},
+6: {'Length': 32.0, 'Width': 8.0, 'Draft': 2.0},
+7: {'Length': 33.0, 'Width': 7.0, 'Draft': 2.7},
+9: {'Length': 100.636, 'Width': 17.393, 'Draft': 5.223},
+10: {'Length': 83.089, 'Width': 15.153, 'Draft': 4.723},
+15: {'Length': 15.0, 'Width': 5.0, 'Draft': 0.0},
+16: {'Length': 80.0, 'Width': 18.0, 'Draft': 4.0},
+18: {'Length': 45.0, 'Width': 10.0, 'Draft': 0.0},
+19: {'Length': 80.0, 'Width': 20.0, 'Draft': 5.843},
+20: {'Length': 85.394, 'Width': 19.267, 'Draft': 3.951},
+22: {'Length': 128.0, 'Width': 17.0, 'Draft': 4.9},
+26: {'Length': 500.0, 'Width': 100.0, 'Draft': 1.0},
+27: {'Length': 31.0, 'Width': 13.0, 'Draft': 2.0},
+29: {'Length': 46.909, 'Width': 11.068, 'Draft': 2.932},
+30: {'Length': 36.87, 'Width': 10.443, 'Draft': 2.397},
+31: {'Length': 37.479, 'Width': 10.159, 'Draft': 3.179},
+32: {'Length': 57.681, 'Width': 13.239, 'Draft': 4.871},
+33: {'Length': 55.924, 'Width': 13.353, 'Draft': 2.831},
+34: {'Length': 20.223, 'Width': 5.812, 'Draft': 0.878},
+35: {'Length': 78.635, 'Width': 12.728, 'Draft': 3.704},
+36: {'Length': 41.218, 'Width': 8.481, 'Draft': 3.374},
+37: {'Length': 40.104, 'Width': 8.772, 'Draft': 2.466},
+38: {'Length': 63.006, 'Width': 14.154, 'Draft': 3.806},
+39: {'Length': 40.918, 'Width': 9.931, 'Draft': 2.189},
+40: {'Length': 49.517, 'Width': 11.79, 'Draft': 2.099},
+49: {'Length': 28.54, 'Width': 8.658, 'Draft': 1.692},
+50: {'Length': 16.938, 'Width': 5.52, 'Draft': 1.33},
+51: {'Length': 14.452, 'Width': 3.91, 'Draft': 0.824},
+52: {'Length': 61.712, 'Width': 13.013, 'Draft': 4.176},
+53: {'Length': 11.802, 'Width': 7.641, 'Draft': 1.059},
+54: {'Length': 35.024, 'Width': 9.632, 'Draft': 2.259},
+55: {'Length': 28.213, 'Width': 5.775, 'Draft': 1.26},
+56: {'Length': 23.0, 'Width': 8.0, 'Draft': 0.0},
+57: {'Length': 133.287, 'Width': 21.422, 'Draft': 4.961},
+58: {'Length': 142.371, 'Width': 15.543, 'Draft': 4.711},
+59: {'Length': 38.65, 'Width': 11.372, 'Draft': 3.802},
+60: {'Length': 125.502, 'Width': 20.493, 'Draft': 3.919},
+63: {'Length': 44.704, 'Width': 9.0, 'Draft': 0.849},
+65: {'Length': 49.084, 'Width': 13.135, 'Draft': 2.829},
+66: {'Length': 45.0, 'Width': 12.0, 'Draft': 1.2},
+67: {'Length': 116.708, 'Width': 18.123, 'Draft': 2.083},
+68: {'Length': 18.424, 'Width': 5.433, 'Draft': 1.892},
+69: {'Length': 210.057, 'Width': 32.495, 'Draft': 6.011},
+70: {'Length': 192.008, 'Width': 29.576, 'Draft': 8.754},
+71: {'Length': 249.29, 'Width': 34.723, 'Draft': 10.204},
+72: {'Length': 259.872, 'Width': 35.788, 'Draft': 10.531},
+73: {'Length': 284.026, 'Width': 37.534, 'Draft': 11.344},
+74: {'Length': 268.766, 'Width': 37.1, 'Draft': 10.954},
+75: {'Length': 180.802, 'Width': 26.808, 'Draft': 7.303},
+76: {'Length': 180.0, 'Width': 32.0, 'Draft': 10.45},
+77: {'Length': 96.646, 'Width': 17.198, 'Draft': 4.273},
+78: {'Length': 95.883, 'Width': 20.417, 'Draft': 3.143},
+79: {'Length': 193.531, 'Width': 27.722, 'Draft': 8.551},
+80: {'Length': 217.939, 'Width': 36.534, 'Draft': 10.065},
+81: {'Length': 224.22, 'Width': 36.51, 'Draft': 9.678},
+82: {'Length': 173.619, 'Width': 28.39, 'Draft': 9.032},
+83: {'Length': 191.438, 'Width': 31.117, 'Draft': 8.799},
+84: {'Length': 240.557, 'Width': 38.085, 'Draft': 9.46},
+85: {'Length': 190.716, 'Width': 30.235, 'Draft': 9.037},
+88: {'Length': 228.129, 'Width': 40.193, 'Draft': 13.168},
+89: {'Length': 189.681, 'Width': 31.289, 'Draft': 9.107},
+90: {'Length': 84.455, 'Width': 14.461, 'Draft': 3.279},
+91: {'Length': 175.622, 'Width': 32.021, 'Draft': 8.059},
+95: {'Length': 44.786, 'Width': 11.925, 'Draft': 2.949},
+96: {'Length': 45.935, 'Width': 12.584, 'Draft': 2.812},
+97: {'Length': 50.437, 'Width': 10.586, 'Draft': 1.155},
+98: {'Length': 15.0, 'Width': 0.0, 'Draft': 0.0},
+120: {'Length': 19.0, 'Width': 8.0, 'Draft': 0.0},
+200: {'Length': 77.0, 'Width': 13.0, 'Draft': 3.0},
+208: {'Length': 278.0, 'Width': 62.0, 'Draft': 12.4},
+255: {'Length': 8.0, 'Width': 3.0, 'Draft': 1.0},
+
+}
+
+
+def vessel_stats_arrays(vessel_stats):
+    """
+    Turns {VesselType: {'Length', 'Width', 'Draft'}} into arrays indexed by VesselType:
+    (known, length, width, draft).
+    """
+    size = max(vessel_stats) + 1
+    known = np.zeros(size, dtype=bool)
+    length, width, draft = (np.full(size, np.nan) for _ in range(3))
+    for vt, stats in vessel_stats.items():
+        known[vt] = True
+        length[vt], width[vt], draft[vt] = stats['Length'], stats['Width'], stats['Draft']
+    return known, length, width, draft
+
+
+def parse_times(raw):
+    """
+    Vectorized pd.to_datetime; values the inferred format rejects are retried one by one.
+    Unparseable values become NaT.
+    """
+    parsed = pd.to_datetime(raw, errors='coerce')
+    failed = parsed.isna() & raw.notna()
+    if failed.any():
+        parsed = parsed.astype(object)
+        parsed[failed] = [pd.to_datetime(value, errors='coerce') for value in raw[failed]]
+        parsed = pd.to_datetime(parsed, errors='coerce')
+    return parsed
+
+
+def _vessel_types(df, known):
+    vessel_type = pd.to_numeric(df['VesselType'], errors='coerce').to_numpy(dtype=np.float64)
+    valid = np.isfinite(vessel_type)
+    vt = np.zeros(len(df), dtype=np.int64)
+    vt[valid] = np.trunc(vessel_type[valid]).astype(np.int64)
+    valid &= (vt >= 0) & (vt < len(known))
+    valid[valid] = known[vt[valid]]
+    return vt, valid
+
+
+def build_segments(df, vessel_stats, distance_method="geodesic", track_coords=None, order=None):
+    """
+    Builds the segment table of a chunk DataFrame (one track per row).
+    track_coords holds the coordinates of the rows of df (chunk_io.TrackCoords); when omitted
+    df['geometry'] is decoded as WKT. order is a row permutation giving the output track order
+    (e.g. sorted by MMSI, TrackStartTime); rows are used in their current order when omitted.
+    Returns a DataFrame with SEGMENT_COLUMNS.
+    """
+    known, length, width, draft = vessel_stats_arrays(vessel_stats)
+    if track_coords is None:
+        track_coords = decode_wkt_geometries(df['geometry'], MULTILINE_TYPES)
+    lon, lat = track_coords.lon, track_coords.lat
+    point_offsets = track_point_offsets(track_coords)
+
+    vt, keep = _vessel_types(df, known)
+    n_points = np.diff(point_offsets)
+    keep &= n_points >= 2
+
+    duration_min = pd.to_numeric(df['DurationMinutes'], errors='coerce').to_numpy(dtype=np.float64)
+    keep &= duration_min != 0
+
+    track_start_raw = df['TrackStartTime']
+    track_start = parse_times(track_start_raw)
+    keep &= ~(track_start.isna().to_numpy() & track_start_raw.notna().to_numpy())
+
+    tracks = np.flatnonzero(keep) if order is None else order[keep[order]]
+    n_segments = n_points[tracks] - 1
+    seg_track = np.repeat(tracks, n_segments)
+    seg_first = np.cumsum(n_segments) - n_segments
+    seg_index = np.arange(len(seg_track)) - np.repeat(seg_first, n_segments)
+
+    start_point = point_offsets[seg_track] + seg_index
+    lat1, lon1 = lat[start_point], lon[start_point]
+    lat2, lon2 = lat[start_point + 1], lon[start_point + 1]
+
+    duration_per_segment_min = duration_min[tracks] / n_segments
+    segment_min = np.repeat(duration_per_segment_min, n_segments)
+    distance, bearing, speed_knots = segment_metrics(lat1, lon1, lat2, lon2, segment_min * 60.0, distance_method)
+
+    seg_track_start = track_start.array[seg_track]
+    segment_start = seg_track_start + pd.to_timedelta(seg_index * segment_min, unit='m')
+    segment_end = seg_track_start + pd.to_timedelta((seg_index + 1) * segment_min, unit='m')
+
+    seg_vt = vt[seg_track]
+    return pd.DataFrame({
+        'MMSI': df['MMSI'].to_numpy()[seg_track],
+        'TrackStartTime': track_start_raw.to_numpy()[seg_track],
+        'TrackEndTime': df['TrackEndTime'].to_numpy()[seg_track],
+        'Segment_StartTime': segment_start,
+        'Segment_EndTime': segment_end,
+        'VesselType': seg_vt,
+        'Global_Length': length[seg_vt],
+        'Global_Width': width[seg_vt],
+        'Global_Draft': draft[seg_vt],
+        'Distance_Meters': distance,
+        'Speed_Knots': speed_knots,
+        'Bearing_Degrees': bearing,
+        'Start_Lat': lat1,
+        'Start_Lon': lon1,
+        'End_Lat': lat2,
+        'End_Lon': lon2,
+    }, columns=SEGMENT_COLUMNS)
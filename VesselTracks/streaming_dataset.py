@@ -0,0 +1,122 @@
+"""
+Streaming training data straight from the vessel_gpt_*.txt shards ("MMSI:<id> | <line>").
+
+StreamingRouteDataset is a torch IterableDataset: nothing is loaded or cached up front.
+- shards are read lazily, line by line; with DataLoader workers every worker reads its own
+  subset of the shards (shard i -> worker i % num_workers) and the DataLoader interleaves them
+- consecutive lines of one MMSI form a route (MMSI prefix stripped, identical consecutive lines
+  dropped, like cleaned_data.py), followed by <|endofroute|>. A vessel whose lines are in several
+  runs of the shards (one per vectors file) is seen as several shorter routes, where
+  cleaned_data.py merges them into one
+- the split is by route: a vessel is in validation when crc32(MMSI) falls in the first
+  val_fraction of the hash range, so all its lines are on one side, on every run and worker
+- routes are tokenized on the fly, routes_per_batch at a time, and packed into blocks of
+  block_size tokens (labels = input_ids); the last short block of every worker is padded and
+  its padding masked (-100)
+"""
+
+import random
+import zlib
+
+import torch
+from torch.utils.data import IterableDataset, get_worker_info
+
+from cleaned_data import shard_files
+
+END_OF_ROUTE = "<|endofroute|>"
+HASH_BUCKETS = 10000
+
+
+def is_validation_mmsi(mmsi, val_fraction=0.1):
+    return zlib.crc32(mmsi.encode("utf-8")) % HASH_BUCKETS < val_fraction * HASH_BUCKETS
+
+
+def iter_shard_routes(path):
+    """Yields (mmsi, route lines) for every run of consecutive lines of one MMSI in a shard."""
+    current, lines = None, []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or "|" not in line:
+                continue  # מדלג על שורות לא תקינות
+            mmsi, content = line.split("|", 1)
+            mmsi, content = mmsi.strip(), content.strip()
+            if mmsi != current:
+                if lines:
+                    yield current, lines
+                current, lines = mmsi, []
+            if not lines or lines[-1] != content:
+                lines.append(content)
+    if lines:
+        yield current, lines
+
+
+class StreamingRouteDataset(IterableDataset):
+    def __init__(self, shard_dir, tokenizer, split="train", val_fraction=0.1, block_size=512,
+                 routes_per_batch=256, shuffle_shards=True, seed=42, max_blocks=None):
+        assert split in ("train", "validation")
+        self.shards = shard_files(shard_dir) if isinstance(shard_dir, str) else list(shard_dir)
+        self.tokenizer = tokenizer
+        self.split = split
+        self.val_fraction = val_fraction
+        self.block_size = block_size
+        self.routes_per_batch = routes_per_batch
+        self.shuffle_shards = shuffle_shards and split == "train"
+        self.seed = seed
+        self.max_blocks = max_blocks  # per worker, e.g. to bound evaluation
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def _worker_shards(self):
+        shards = list(self.shards)
+        if self.shuffle_shards:
+            random.Random(self.seed + self.epoch).shuffle(shards)
+        worker = get_worker_info()
+        if worker is None:
+            return shards
+        return shards[worker.id::worker.num_workers]
+
+    def _iter_route_texts(self):
+        want_validation = self.split == "validation"
+        for path in self._worker_shards():
+            for mmsi, lines in iter_shard_routes(path):
+                if is_validation_mmsi(mmsi, self.val_fraction) == want_validation:
+                    yield "\n".join(lines + [END_OF_ROUTE]) + "\n"
+
+    def _block(self, ids):
+        n = len(ids)
+        pad = self.block_size - n
+        input_ids = torch.tensor(ids + [self.tokenizer.pad_token_id] * pad, dtype=torch.long)
+        labels = input_ids.clone()
+        labels[n:] = -100
+        attention_mask = torch.zeros(self.block_size, dtype=torch.long)
+        attention_mask[:n] = 1
+        return {"input_ids": input_ids, "attention_mask": attention_mask, "labels": labels}
+
+    def _iter_token_batches(self):
+        batch = []
+        for text in self._iter_route_texts():
+            batch.append(text)
+            if len(batch) >= self.routes_per_batch:
+                yield self.tokenizer(batch, add_special_tokens=False)["input_ids"]
+                batch = []
+        if batch:
+            yield self.tokenizer(batch, add_special_tokens=False)["input_ids"]
+
+    def __iter__(self):
+        buffer, n_blocks = [], 0
+        for batch_ids in self._iter_token_batches():
+            for ids in batch_ids:
+                buffer.extend(ids)
+            pos = 0
+            while len(buffer) - pos >= self.block_size:
+                if self.max_blocks is not None and n_blocks >= self.max_blocks:
+                    return
+                yield self._block(buffer[pos:pos + self.block_size])
+                pos += self.block_size
+                n_blocks += 1
+            buffer = buffer[pos:]
+        if buffer and (self.max_blocks is None or n_blocks < self.max_blocks):
+            yield self._block(buffer)
@@ -0,0 +1,161 @@
+"""
+Pre-tokenized token store for GPT.py.
+
+build_token_store tokenizes vessel_tracks.txt once, route by route (route lines joined by "\\n",
+followed by <|endofroute|>), into:
+- tokens.bin  flat token ids (uint16 while the vocabulary fits, else uint32), read with np.memmap
+- routes.npy  int64 token offset of every route start, plus the total token count at the end
+- meta.json   dtype, counts and the tokenizer the ids belong to (written last: store complete)
+
+PackedBlockDataset serves fixed-length blocks of block_size tokens without padding. Blocks start
+at a route start (a route longer than a block continues in the next block): the next block starts
+at the last route start inside the current block (or at its last token if none), and the current
+block's labels after the next block's first token are masked (-100). The model shifts labels by
+one, so a block's first token is never its target; it is the last target of the previous block
+instead (consecutive blocks overlap by at least that token). Every token after the first of the
+range is a training target exactly once. Only the last block is moved back to end exactly at the
+end of the data instead of being short.
+"""
+
+import json
+import os
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+
+TOKENS_FILE = "tokens.bin"
+ROUTES_FILE = "routes.npy"
+META_FILE = "meta.json"
+END_OF_ROUTE = "<|endofroute|>"
+
+
+def tokenizer_fingerprint(tokenizer):
+    return {"name": tokenizer.name_or_path, "vocab_size": len(tokenizer)}
+
+
+def _iter_route_texts(text_path):
+    lines = []
+    with open(text_path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line == END_OF_ROUTE:
+                yield "\n".join(lines + [END_OF_ROUTE]) + "\n"
+                lines = []
+            else:
+                lines.append(line)
+    if lines:  # last route without separator
+        yield "\n".join(lines + [END_OF_ROUTE]) + "\n"
+
+
+def build_token_store(text_path, tokenizer, store_dir, routes_per_batch=1000):
+    """One-off tokenization pass of text_path (vessel_tracks.txt) into store_dir."""
+    os.makedirs(store_dir, exist_ok=True)
+    meta_path = os.path.join(store_dir, META_FILE)
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    dtype = np.uint16 if len(tokenizer) <= np.iinfo(np.uint16).max + 1 else np.uint32
+    tokens_path = os.path.join(store_dir, TOKENS_FILE)
+
+    route_offsets = [0]
+    batch = []
+
+    def flush(f):
+        for ids in tokenizer(batch, add_special_tokens=False)["input_ids"]:
+            f.write(np.asarray(ids, dtype=dtype).tobytes())
+            route_offsets.append(route_offsets[-1] + len(ids))
+        batch.clear()
+
+    with open(tokens_path + ".tmp", "wb") as f:
+        for route_text in _iter_route_texts(text_path):
+            batch.append(route_text)
+            if len(batch) >= routes_per_batch:
+                flush(f)
+                if len(route_offsets) % (100 * routes_per_batch) == 1:
+                    print(f"[INFO] Tokenized {len(route_offsets) - 1} routes, {route_offsets[-1]} tokens")
+        if batch:
+            flush(f)
+    os.replace(tokens_path + ".tmp", tokens_path)
+    np.save(os.path.join(store_dir, ROUTES_FILE), np.asarray(route_offsets, dtype=np.int64))
+
+    meta = {
+        "dtype": np.dtype(dtype).name,
+        "n_tokens": route_offsets[-1],
+        "n_routes": len(route_offsets) - 1,
+        "source": os.path.abspath(text_path),
+        "tokenizer": tokenizer_fingerprint(tokenizer),
+    }
+    with open(meta_path, "w") as f:
+        json.dump(meta, f, indent=2)
+    print(f"[DONE] Token store {store_dir}: {meta['n_routes']} routes, {meta['n_tokens']} tokens")
+    return meta
+
+
+def has_token_store(store_dir, tokenizer=None):
+    meta_path = os.path.join(store_dir, META_FILE)
+    if not os.path.exists(meta_path):
+        return False
+    if tokenizer is None:
+        return True
+    with open(meta_path) as f:
+        return json.load(f)["tokenizer"] == tokenizer_fingerprint(tokenizer)
+
+
+class TokenStore:
+    def __init__(self, store_dir):
+        with open(os.path.join(store_dir, META_FILE)) as f:
+            self.meta = json.load(f)
+        self.tokens = np.memmap(os.path.join(store_dir, TOKENS_FILE), dtype=self.meta["dtype"], mode="r")
+        self.route_offsets = np.load(os.path.join(store_dir, ROUTES_FILE))
+
+    @property
+    def n_routes(self):
+        return len(self.route_offsets) - 1
+
+    def split_routes(self, val_fraction=0.1):
+        """(train, val) route ranges: the last val_fraction of the routes is the validation set."""
+        n_val = max(1, int(self.n_routes * val_fraction)) if self.n_routes > 1 else 0
+        return (0, self.n_routes - n_val), (self.n_routes - n_val, self.n_routes)
+
+
+def packed_block_starts(route_starts, end, block_size):
+    """
+    Block start offsets: each block starts at the last route start inside the previous block,
+    or at the previous block's last token when no route starts there. The last block ends at end.
+    """
+    starts = [int(route_starts[0])] if len(route_starts) else []
+    while starts and starts[-1] + block_size < end:
+        last_token = starts[-1] + block_size - 1
+        k = np.searchsorted(route_starts, last_token, side="right") - 1
+        next_start = int(route_starts[k])
+        starts.append(next_start if next_start > starts[-1] else last_token)
+    if len(starts) > 1 and starts[-1] + block_size > end:
+        # full-length last block ending at end instead of a short one (the previous block's
+        # targets then stop at its start)
+        starts[-1] = end - block_size
+    return np.asarray(starts, dtype=np.int64)
+
+
+class PackedBlockDataset(Dataset):
+    """Fixed-length blocks over the routes route_range = (first, stop) of a TokenStore."""
+
+    def __init__(self, store, block_size=512, route_range=None):
+        first, stop = route_range if route_range is not None else (0, store.n_routes)
+        self.store = store
+        self.block_size = block_size
+        self.end = int(store.route_offsets[stop])
+        self.starts = packed_block_starts(store.route_offsets[first:stop], self.end, block_size)
+        # leading labels of each block kept: up to and including the next block's first token
+        self.n_targets = np.append(self.starts[1:] + 1, self.end) - self.starts
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, i):
+        start = self.starts[i]
+        input_ids = torch.from_numpy(self.store.tokens[start:min(start + self.block_size, self.end)].astype(np.int64))
+        labels = input_ids.clone()
+        labels[self.n_targets[i]:] = -100  # targets of the next block
+        return {"input_ids": input_ids, "attention_mask": torch.ones_like(input_ids), "labels": labels}
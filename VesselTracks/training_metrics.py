@@ -0,0 +1,169 @@
+"""
+Throughput instrumentation for the Trainer in GPT.py.
+
+InstrumentedTrainer times the fetch of every optimizer step's batches (get_batch_samples, i.e.
+waiting for the DataLoader / its workers) and counts their tokens. ThroughputCallback adds the
+step timing and writes one JSON line per optimizer step to <output_dir>/throughput_log.jsonl:
+    step, step_time, data_wait, compute_time, tokens, effective_tokens (attention_mask / non -100
+    labels), tokens_per_sec, effective_fraction, wait_fraction, peak_rss_mb
+and at the end <output_dir>/throughput_summary.json with totals and step time percentiles.
+compute_time is the rest of the step (forward, backward, optimizer). A run with a wait_fraction
+close to 1 is input-bound, close to 0 compute-bound.
+
+Peak RSS is the main process; DataLoader workers are only counted once they have exited.
+"""
+
+import json
+import os
+import resource
+import time
+
+import numpy as np
+from transformers import Trainer, TrainerCallback
+
+LOG_FILE = "throughput_log.jsonl"
+SUMMARY_FILE = "throughput_summary.json"
+INPUT_BOUND_WAIT_FRACTION = 0.5
+
+
+def peak_rss_mb():
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(own, children) / 1024  # ru_maxrss is in KB on Linux
+
+
+def count_tokens(batch):
+    """(tokens, effective non-padding tokens) of a collated batch."""
+    input_ids = batch.get("input_ids")
+    if input_ids is None:
+        return 0, 0
+    tokens = int(input_ids.numel())
+    if batch.get("attention_mask") is not None:
+        return tokens, int(batch["attention_mask"].sum())
+    if batch.get("labels") is not None:
+        return tokens, int((batch["labels"] != -100).sum())
+    return tokens, tokens
+
+
+class ThroughputCallback(TrainerCallback):
+    def __init__(self, log_dir=None):
+        self.log_dir = log_dir  # default: args.output_dir
+        self.log_path = None
+        self.records = []
+        self._reset_step()
+
+    def _reset_step(self):
+        self.step_start = None
+        self.data_wait = 0.0
+        self.tokens = 0
+        self.effective_tokens = 0
+
+    def record_batches(self, fetch_start, data_wait, batches):
+        """Called by InstrumentedTrainer after fetching the batches of an optimizer step."""
+        if self.step_start is None:
+            self.step_start = fetch_start
+        self.data_wait += data_wait
+        for batch in batches:
+            tokens, effective = count_tokens(batch)
+            self.tokens += tokens
+            self.effective_tokens += effective
+
+    def on_train_begin(self, args, state, control, **kwargs):
+        log_dir = self.log_dir or args.output_dir
+        self.log_path = os.path.join(log_dir, LOG_FILE)
+        if state.is_world_process_zero:
+            os.makedirs(log_dir, exist_ok=True)
+            open(self.log_path, "w").close()
+        self.records = []
+        self._reset_step()
+
+    def on_step_begin(self, args, state, control, **kwargs):
+        if self.step_start is None:  # used without InstrumentedTrainer
+            self.step_start = time.perf_counter()
+
+    def on_step_end(self, args, state, control, **kwargs):
+        if self.step_start is None:
+            return
+        step_time = time.perf_counter() - self.step_start
+        record = {
+            "step": state.global_step,
+            "step_time": round(step_time, 6),
+            "data_wait": round(self.data_wait, 6),
+            "compute_time": round(step_time - self.data_wait, 6),
+            "tokens": self.tokens,
+            "effective_tokens": self.effective_tokens,
+            "tokens_per_sec": round(self.tokens / step_time, 2) if step_time > 0 else None,
+            "effective_fraction": round(self.effective_tokens / self.tokens, 4) if self.tokens else None,
+            "wait_fraction": round(self.data_wait / step_time, 4) if step_time > 0 else None,
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+        }
+        self.records.append(record)
+        if state.is_world_process_zero and self.log_path:
+            with open(self.log_path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+        self._reset_step()
+
+    def on_log(self, args, state, control, logs=None, **kwargs):
+        # averages since the previous log, next to loss / learning_rate
+        if logs is None or not self.records or "loss" not in logs:
+            return
+        recent = self.records[-max(1, args.logging_steps):]
+        step_time = sum(r["step_time"] for r in recent)
+        if step_time > 0:
+            logs["tokens_per_sec"] = round(sum(r["tokens"] for r in recent) / step_time, 2)
+            logs["wait_fraction"] = round(sum(r["data_wait"] for r in recent) / step_time, 4)
+        logs["peak_rss_mb"] = recent[-1]["peak_rss_mb"]
+
+    def summary(self):
+        if not self.records:
+            return {}
+        step_times = np.array([r["step_time"] for r in self.records])
+        total_time = float(step_times.sum())
+        tokens = sum(r["tokens"] for r in self.records)
+        effective = sum(r["effective_tokens"] for r in self.records)
+        wait = sum(r["data_wait"] for r in self.records)
+        wait_fraction = wait / total_time if total_time > 0 else 0.0
+        return {
+            "steps": len(self.records),
+            "tokens": tokens,
+            "effective_tokens": effective,
+            "tokens_per_sec": round(tokens / total_time, 2) if total_time > 0 else None,
+            "effective_tokens_per_sec": round(effective / total_time, 2) if total_time > 0 else None,
+            "effective_fraction": round(effective / tokens, 4) if tokens else None,
+            "data_wait_seconds": round(wait, 3),
+            "compute_seconds": round(total_time - wait, 3),
+            "wait_fraction": round(wait_fraction, 4),
+            "bound": "input" if wait_fraction >= INPUT_BOUND_WAIT_FRACTION else "compute",
+            "step_time_p50": round(float(np.percentile(step_times, 50)), 6),
+            "step_time_p90": round(float(np.percentile(step_times, 90)), 6),
+            "step_time_p99": round(float(np.percentile(step_times, 99)), 6),
+            "step_time_max": round(float(step_times.max()), 6),
+            "peak_rss_mb": max(r["peak_rss_mb"] for r in self.records),
+        }
+
+    def on_train_end(self, args, state, control, **kwargs):
+        summary = self.summary()
+        if not summary or not state.is_world_process_zero or not self.log_path:
+            return
+        path = os.path.join(os.path.dirname(self.log_path), SUMMARY_FILE)
+        with open(path, "w") as f:
+            json.dump(summary, f, indent=4)
+        print(f"[INFO] Throughput: {summary['tokens_per_sec']} tokens/sec, "
+              f"{summary['wait_fraction']:.0%} of step time waiting for data ({summary['bound']}-bound), "
+              f"step p50/p90 {summary['step_time_p50']:.3f}/{summary['step_time_p90']:.3f}s, "
+              f"peak RSS {summary['peak_rss_mb']:.0f} MB. Log: {self.log_path}")
+
+
+class InstrumentedTrainer(Trainer):
+    """Trainer that feeds ThroughputCallback the data wait and token counts of every step."""
+
+    def __init__(self, *args, throughput_log_dir=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.throughput = ThroughputCallback(throughput_log_dir)
+        self.add_callback(self.throughput)
+
+    def get_batch_samples(self, epoch_iterator, num_batches, device):
+        start = time.perf_counter()
+        batch_samples, num_items_in_batch = super().get_batch_samples(epoch_iterator, num_batches, device)
+        self.throughput.record_batches(start, time.perf_counter() - start, batch_samples)
+        return batch_samples, num_items_in_batch
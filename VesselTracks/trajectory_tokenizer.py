@@ -0,0 +1,96 @@
+"""
+Tokenizer built for the route line format:
+    INPUT: LAT:18.3234 LON:-64.8056 SPD:5.1064 BRG:278.3201 ΔT:158 | OUTPUT: LAT:18.3301 LON:-64.8123 |
+
+Instead of BPE fragments every field is one token and numbers are split into few tokens:
+- field tokens, with their leading space: "INPUT:", " LAT:", " LON:", " SPD:", " BRG:", " ΔT:", " |", " OUTPUT:", ...
+- "-" for the sign, integer parts as groups of 1-3 digits ("278", "64", "1234" -> "123" "4")
+- 4-decimal fractions as one token (".3234")
+- "\\n", <|endofroute|> (route separator) and <|endoftext|> (eos / pad)
+- any other single character seen in the corpus sample, [UNK] for the rest
+
+A segment line is 27 tokens. The vocabulary (~11K tokens, fits the uint16 token store) is fixed
+by the format plus the characters of vessel_tracks.txt. The tokenizer is a WordLevel model behind
+a regex Split pre-tokenizer, wrapped in PreTrainedTokenizerFast, so it works with GPT2LMHeadModel
+(after resize_token_embeddings) and save_pretrained / AutoTokenizer.from_pretrained.
+"""
+
+import os
+
+from tokenizers import Regex, Tokenizer, decoders, models, pre_tokenizers
+from transformers import AutoTokenizer, PreTrainedTokenizerFast
+
+END_OF_ROUTE = "<|endofroute|>"
+END_OF_TEXT = "<|endoftext|>"
+UNK = "[UNK]"
+SPECIAL_TOKENS = [END_OF_TEXT, END_OF_ROUTE, UNK]
+
+FIELD_TOKENS = [
+    "MMSI:", "INPUT:", "OUTPUT:", " INPUT:", " OUTPUT:", " LAT:", " LON:", " SPD:", " BRG:", " ΔT:", " |",
+    "LAT:", "LON:", "SPD:", "BRG:", "ΔT:", "\n",
+]
+DIGIT_GROUPS = [f"{n:0{width}d}" for width in (1, 2, 3) for n in range(10 ** width)]
+FRACTIONS = [f".{n:04d}" for n in range(10 ** 4)]
+
+# field tokens first (longest first), then fractions of exactly 4 digits, digit groups, any char
+SPLIT_PATTERN = (
+    "|".join(sorted((f.replace("|", "\\|") for f in FIELD_TOKENS if f != "\n"), key=len, reverse=True))
+    + r"|\.\d{4}(?!\d)|\d{1,3}|\n|."
+)
+SAMPLE_BYTES = 64 * 1024 * 1024
+
+
+def trajectory_vocab(extra_chars=()):
+    tokens = SPECIAL_TOKENS + FIELD_TOKENS + DIGIT_GROUPS + FRACTIONS
+    seen = set(tokens)
+    for char in sorted(set(extra_chars) | set("-.| :")):
+        if char not in seen:
+            tokens.append(char)
+            seen.add(char)
+    return {token: i for i, token in enumerate(tokens)}
+
+
+def _corpus_chars(text_path, sample_bytes=SAMPLE_BYTES):
+    with open(text_path, "r", encoding="utf-8", errors="replace") as f:
+        return set(f.read(sample_bytes))
+
+
+def build_trajectory_tokenizer(text_path=None, sample_bytes=SAMPLE_BYTES):
+    """Builds the tokenizer; text_path (vessel_tracks.txt) adds the characters of its first sample_bytes."""
+    extra_chars = _corpus_chars(text_path, sample_bytes) if text_path else ()
+    tokenizer = Tokenizer(models.WordLevel(vocab=trajectory_vocab(extra_chars), unk_token=UNK))
+    tokenizer.pre_tokenizer = pre_tokenizers.Split(Regex(SPLIT_PATTERN), behavior="isolated")
+    tokenizer.decoder = decoders.Fuse()
+    return PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer,
+        bos_token=END_OF_TEXT,
+        eos_token=END_OF_TEXT,
+        pad_token=END_OF_TEXT,
+        unk_token=UNK,
+        additional_special_tokens=[END_OF_ROUTE],
+        clean_up_tokenization_spaces=False,
+    )
+
+
+def load_or_build_trajectory_tokenizer(save_dir, text_path=None):
+    if os.path.exists(os.path.join(save_dir, "tokenizer.json")):
+        return AutoTokenizer.from_pretrained(save_dir)
+    tokenizer = build_trajectory_tokenizer(text_path)
+    tokenizer.save_pretrained(save_dir)
+    print(f"[INFO] Saved trajectory tokenizer ({len(tokenizer)} tokens) to {save_dir}")
+    return tokenizer
+
+
+def tokens_per_line(tokenizer, text_path, n_lines=1000):
+    """Average tokens per route line over the first n_lines lines (separator lines excluded)."""
+    lines = []
+    with open(text_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip() and line.strip() != END_OF_ROUTE:
+                lines.append(line)
+            if len(lines) >= n_lines:
+                break
+    if not lines:
+        return 0.0
+    ids = tokenizer(lines, add_special_tokens=False)["input_ids"]
+    return sum(len(x) for x in ids) / len(ids)
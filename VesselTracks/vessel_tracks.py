@@ -10,33 +10,145 @@
 #
 # print(gdf.head())
 
+"""
+Exports AISVesselTracks2024.gpkg into fixed-size chunk files (ais_chunk_{i}.csv, or
+ais_chunk_{i}.parquet in the columnar format of chunk_io.py).
+
+The feature table is walked once instead of re-reading it with skip_features/max_features
+for every chunk (which re-seeks from the first feature each time):
+- export_chunks_streaming: one pyogrio Arrow batch stream, one chunk per batch.
+- export_chunks_parallel: splits the GeoPackage rowid (fid) range into contiguous ranges
+  and exports each range in a worker process with an indexed "fid >= a AND fid < b" filter.
+"""
+
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import closing
 
 import geopandas as gpd
+import pyogrio
+from pyogrio.raw import open_arrow
+
+from chunk_io import write_columnar_chunk
+from mmsi_index import build_mmsi_partitions
 
 # מסלול לקובץ
 file_path = "/mnt/new_home/idan7/data_mining/ais_tracks_export/AISVesselTracks2024/AISVesselTracks2024.gpkg"
+output_dir = "/mnt/new_home/idan7/data_mining/ais_tracks_export/chunks/"
 
 # קביעת גודל צ’אנק
 chunk_size = 10000  # שורות לכל קובץ
-offset = 0
-chunk_id = 1
-
-while True:
-    print(f"Reading chunk {chunk_id}...")
-    gdf = gpd.read_file(
-        file_path,
-        engine="pyogrio",
-        skip_features=offset,
-        max_features=chunk_size
+max_workers = 8
+chunk_format = "csv"  # "csv" or "parquet"
+mmsi_partitions_dir = "/mnt/new_home/idan7/data_mining/ais_tracks_export/chunks_by_mmsi/"
+build_mmsi_layout = False  # also write the MMSI-partitioned layout + index (see mmsi_index.py)
+
+
+def write_chunk(gdf, output_dir, chunk_id, chunk_format="csv"):
+    output_path = os.path.join(output_dir, f"ais_chunk_{chunk_id}.{chunk_format}")
+    if chunk_format == "parquet":
+        write_columnar_chunk(gdf, output_path)
+    else:
+        gdf.to_csv(output_path, index=False)
+    return output_path
+
+
+def _batch_to_gdf(batch, geometry_name, crs):
+    df = batch.to_pandas()
+    geometry = gpd.GeoSeries.from_wkb(df.pop(geometry_name).to_numpy(), crs=crs)
+    return gpd.GeoDataFrame(df, geometry=geometry)
+
+
+def export_chunks_streaming(gpkg_path, output_dir, chunk_size=10000, layer=None, chunk_format="csv"):
+    """
+    Single pass over the layer: pyogrio streams Arrow record batches of chunk_size
+    features and every batch is written as one chunk.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    chunk_id = 1
+    start_time = time.time()
+
+    with open_arrow(gpkg_path, layer=layer, batch_size=chunk_size, use_pyarrow=True) as (meta, reader):
+        geometry_name = meta["geometry_name"] or "wkb_geometry"
+        for batch in reader:
+            if batch.num_rows == 0:
+                continue
+            gdf = _batch_to_gdf(batch, geometry_name, meta["crs"])
+            output_path = write_chunk(gdf, output_dir, chunk_id, chunk_format)
+            print(f"[INFO] Saved chunk {chunk_id} ({len(gdf)} rows): {output_path}")
+            chunk_id += 1
+
+    elapsed = time.time() - start_time
+    print(f"[DONE] Exported {chunk_id - 1} chunks in {elapsed:.2f} seconds.")
+
+
+def gpkg_fid_range(gpkg_path, layer=None):
+    """
+    Returns (table, fid_column, min_fid, max_fid) read straight from the GeoPackage
+    SQLite tables, without scanning the features.
+    """
+    # closing(): the connection's own context manager only ends a transaction
+    with closing(sqlite3.connect(f"file:{gpkg_path}?mode=ro", uri=True)) as con:
+        if layer is None:
+            layer = con.execute(
+                "SELECT table_name FROM gpkg_contents WHERE data_type = 'features' LIMIT 1"
+            ).fetchone()[0]
+        columns = con.execute(f'PRAGMA table_info("{layer}")').fetchall()
+        fid_column = next(col[1] for col in columns if col[5] == 1)  # primary key
+        min_fid, max_fid = con.execute(f'SELECT MIN("{fid_column}"), MAX("{fid_column}") FROM "{layer}"').fetchone()
+    return layer, fid_column, min_fid, max_fid
+
+
+def _export_fid_range(task):
+    gpkg_path, layer, fid_column, fid_start, fid_stop, output_dir, chunk_id, chunk_format = task
+    gdf = pyogrio.read_dataframe(
+        gpkg_path,
+        layer=layer,
+        where=f'"{fid_column}" >= {fid_start} AND "{fid_column}" < {fid_stop}',
     )
     if gdf.empty:
-        break
+        return chunk_id, 0, None
+    return chunk_id, len(gdf), write_chunk(gdf, output_dir, chunk_id, chunk_format)
+
+
+def export_chunks_parallel(gpkg_path, output_dir, chunk_size=10000, max_workers=4, layer=None, chunk_format="csv"):
+    """
+    Splits the fid range into chunk_size-wide ranges and exports them in parallel.
+    The fid is the GeoPackage rowid, so every range is an indexed range scan.
+    Chunks keep the fid order (ais_chunk_1 holds the lowest fids); when the fids have
+    gaps (deleted features) a chunk holds fewer than chunk_size rows and empty ranges
+    produce no file.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    layer, fid_column, min_fid, max_fid = gpkg_fid_range(gpkg_path, layer)
+    if min_fid is None:
+        print(f"[WARNING] Layer {layer} is empty.")
+        return
+
+    tasks = []
+    for chunk_id, fid_start in enumerate(range(min_fid, max_fid + 1, chunk_size), start=1):
+        tasks.append((gpkg_path, layer, fid_column, fid_start, fid_start + chunk_size, output_dir, chunk_id, chunk_format))
+
+    start_time = time.time()
+    total_rows = 0
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(_export_fid_range, task) for task in tasks]
+        for future in as_completed(futures):
+            chunk_id, rows, output_path = future.result()
+            total_rows += rows
+            if output_path:
+                print(f"[INFO] Saved chunk {chunk_id} ({rows} rows): {output_path}")
 
-    output_path = f"/mnt/new_home/idan7/data_mining/ais_tracks_export/chunks/ais_chunk_{chunk_id}.csv"
-    gdf.to_csv(output_path, index=False)
-    print(f"Saved: {output_path}")
+    elapsed = time.time() - start_time
+    print(f"[DONE] Exported {total_rows} rows in {len(tasks)} ranges in {elapsed:.2f} seconds.")
 
-    offset += chunk_size
-    chunk_id += 1
 
-print("All chunks exported successfully.")
+if __name__ == "__main__":
+    export_chunks_parallel(file_path, output_dir, chunk_size=chunk_size, max_workers=max_workers,
+                           chunk_format=chunk_format)
+    if build_mmsi_layout:
+        build_mmsi_partitions(output_dir, mmsi_partitions_dir, chunk_format=chunk_format)
+    print("All chunks exported successfully.")